@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Throughput and memory benchmarks of PSL -> SAM conversion on synthetic data. """
+
+import argparse
+from collections import OrderedDict
+import json
+import multiprocessing
+from os import path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.fasta_store import FastaStore, ReferenceWindows
+
+# Benchmark configurations: name -> (use reads, soft clip, N limit, MD tags from reference)
+CONFIGS = OrderedDict([
+    ('plain', (False, True, None, False)),
+    ('reads', (True, True, None, False)),
+    ('hard_clip', (True, False, None, False)),
+    ('n_limit', (False, True, 100, False)),
+    ('reads_hard_clip_n_limit', (True, False, 100, False)),
+    ('reads_md', (True, True, 100, True)),
+])
+
+parser = argparse.ArgumentParser(
+    description='Benchmark PSL -> SAM conversion on synthetic data.')
+parser.add_argument(
+    '-n', metavar='records', type=int, help="Number of PSL records (100000).", default=100000)
+parser.add_argument(
+    '-l', metavar='read_length', type=int, help="Read length (1000).", default=1000)
+parser.add_argument(
+    '-k', metavar='blocks', type=int, help="Number of blocks per record (10).", default=10)
+parser.add_argument(
+    '-m', metavar='minus_fraction', type=float, help="Fraction of minus strand records (0.5).", default=0.5)
+parser.add_argument(
+    '-c', metavar='max_clip', type=int, help="Maximum length of clipped flanks (50).", default=50)
+parser.add_argument(
+    '-i', metavar='intron_length', type=int, help="Length of large target gaps (200).", default=200)
+parser.add_argument(
+    '-r', metavar='repeats', type=int, help="Number of repeats, the best is reported (3).", default=3)
+parser.add_argument(
+    '-s', metavar='configs', type=str, help="Comma separated list of configurations (all): {}.".format(
+        ','.join(CONFIGS.keys())), default=None)
+parser.add_argument(
+    '-o', metavar='results_json', type=str, help="Save results as JSON.", default=None)
+parser.add_argument(
+    '-b', metavar='baseline_json', type=str, help="Compare results to a saved baseline.", default=None)
+parser.add_argument(
+    '-T', metavar='threshold', type=float, help="Allowed relative slowdown or memory increase (0.2).", default=0.2)
+
+
+def _generate_data(work_dir, args):
+    """ Write synthetic PSL, reads and reference FASTA files. """
+    lines, reads, targets = simulate.simulate(nr_records=args.n, read_length=args.l, block_count=args.k,
+                                        minus_fraction=args.m, max_clip=args.c, intron_length=args.i)
+    psl = path.join(work_dir, 'input.psl')
+    with open(psl, 'w') as handle:
+        handle.write(simulate.PSL_HEADER)
+        handle.writelines(lines)
+    fasta = path.join(work_dir, 'reads.fas')
+    with open(fasta, 'w') as handle:
+        simulate.write_fasta(reads, handle)
+    reference = path.join(work_dir, 'reference.fas')
+    with open(reference, 'w') as handle:
+        simulate.write_fasta(targets, handle, line_width=60)
+    # Build the indices once, so that runs do not include them:
+    FastaStore(fasta).close()
+    FastaStore(reference).close()
+
+
+def generate_data(work_dir, args):
+    """ Generate data in a child process, so that the memory used does not show up in the peak RSS of runs. """
+    child = multiprocessing.Process(target=_generate_data, args=(work_dir, args))
+    child.start()
+    child.join()
+    if child.exitcode != 0:
+        raise Exception('Failed to generate benchmark data.')
+    return path.join(work_dir, 'input.psl'), path.join(work_dir, 'reads.fas'), path.join(work_dir, 'reference.fas')
+
+
+def _run_child(conn, psl, fasta, reference_fasta, out, config):
+    """ Run a single conversion in a child process and report time, peak RSS and output size. """
+    use_reads, soft_clip, n_limit, use_reference = config
+    start = time.time()
+    reads = FastaStore(fasta) if use_reads else None
+    reference = ReferenceWindows(FastaStore(reference_fasta)) if use_reference else None
+    with open(psl, 'rb') as psl_handle, open(out, 'wb') as out_handle:
+        psl2sam.psl2sam(psl_handle, out_handle, reads, soft_clip=soft_clip, n_limit=n_limit, reference=reference)
+    if reads is not None:
+        reads.close()
+    if reference is not None:
+        reference.close()
+    seconds = time.time() - start
+    conn.send((seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, path.getsize(out)))
+    conn.close()
+
+
+def run_config(psl, fasta, reference, out, config, repeats):
+    """ Run configuration in fresh processes, return best time and the largest peak RSS. """
+    best, peak_rss, out_size = None, 0, 0
+    for _ in xrange(repeats):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        child = multiprocessing.Process(target=_run_child, args=(child_conn, psl, fasta, reference, out, config))
+        child.start()
+        seconds, rss, out_size = parent_conn.recv()
+        child.join()
+        best = seconds if best is None else min(best, seconds)
+        peak_rss = max(peak_rss, rss)
+    return best, peak_rss, out_size
+
+
+def compare(results, baseline, threshold):
+    """ Compare results to baseline, return list of regressions. """
+    regressions = []
+    for name, res in results.iteritems():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if res['records_per_s'] < base['records_per_s'] * (1.0 - threshold):
+            regressions.append('{}: records/s {:.0f} < baseline {:.0f}'.format(
+                name, res['records_per_s'], base['records_per_s']))
+        if res['peak_rss_mb'] > base['peak_rss_mb'] * (1.0 + threshold):
+            regressions.append('{}: peak RSS {:.1f} MB > baseline {:.1f} MB'.format(
+                name, res['peak_rss_mb'], base['peak_rss_mb']))
+    return regressions
+
+
+def main(args):
+    configs = CONFIGS.keys() if args.s is None else args.s.split(',')
+    work_dir = tempfile.mkdtemp(prefix='uncle_psl_bench')
+    try:
+        psl, fasta, reference = generate_data(work_dir, args)
+        out = path.join(work_dir, 'output.sam')
+        in_size = path.getsize(psl)
+        results = OrderedDict()
+        sys.stdout.write("{:<26}{:>14}{:>10}{:>14}\n".format('config', 'records/s', 'MB/s', 'peak RSS MB'))
+        for name in configs:
+            seconds, rss, out_size = run_config(psl, fasta, reference, out, CONFIGS[name], args.r)
+            results[name] = OrderedDict([
+                ('seconds', seconds),
+                ('records_per_s', args.n / seconds),
+                ('mb_per_s', in_size / seconds / 1e6),
+                ('peak_rss_mb', rss / 1024.0),  # ru_maxrss is in kilobytes on Linux
+                ('output_mb', out_size / 1e6),
+            ])
+            sys.stdout.write("{:<26}{:>14.0f}{:>10.2f}{:>14.1f}\n".format(
+                name, results[name]['records_per_s'], results[name]['mb_per_s'], results[name]['peak_rss_mb']))
+    finally:
+        shutil.rmtree(work_dir)
+
+    params = OrderedDict([('records', args.n), ('read_length', args.l), ('blocks', args.k),
+                          ('minus_fraction', args.m), ('max_clip', args.c), ('intron_length', args.i)])
+    if args.o is not None:
+        with open(args.o, 'w') as handle:
+            json.dump(OrderedDict([('params', params), ('results', results)]), handle, indent=2)
+            handle.write("\n")
+    if args.b is not None:
+        baseline = json.load(open(args.b))
+        if baseline['params'] != params:
+            sys.stderr.write("WARNING: Benchmark parameters differ from the baseline.\n")
+        regressions = compare(results, baseline['results'], args.T)
+        for regression in regressions:
+            sys.stderr.write("REGRESSION: {}\n".format(regression))
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
@@ -14,21 +14,101 @@ import sys
 
 from Bio import SeqIO
 
+from uncle_PSL import checkpoint
+from uncle_PSL import compressed_input
+from uncle_PSL import multi_hit
 from uncle_PSL import psl2sam
+from uncle_PSL import psl_index
+from uncle_PSL import shard
+from uncle_PSL import splice
+from uncle_PSL.fasta_store import FastaStore, ReferenceWindows, read_references
+from uncle_PSL.read_stream import ReadStream
+from uncle_PSL.sam_writer import new_header
+from uncle_PSL.stats import Stats
 
 # Parse command line arguments:
 parser = argparse.ArgumentParser(
     description='Script to convert PSL files (BLAT output) to SAM format.')
 parser.add_argument(
-    '-f', metavar='reads_fasta', type=str, help="Reads in fasta format.", required=False, default=None)
+    '-f', metavar='reads', type=str, help="Reads in fasta format (indexed through a .fai file, created if missing) or fastq format (adds base qualities). Not needed for pslx input, the sequences are built from its query blocks.", required=False, default=None)
+parser.add_argument(
+    '-s', action="store_true", help="Stream the reads instead of indexing them (reads in the order of the PSL records, can be compressed).", default=False)
 parser.add_argument(
     '-N', metavar='n_limit', type=int, help="Use N CIGAR operation for deletions larger than this parameter (None).", required=False, default=None)
 parser.add_argument(
     '-H', action="store_false", help="Use hard clipping instead of soft clipping.", default=True)
-parser.add_argument('infile', nargs='?', help='Input PSL (default: stdin).',
-                    type=argparse.FileType('r'), default=sys.stdin)
-parser.add_argument('outfile', nargs='?', help='Output SAM (default: stdout)',
-                    type=argparse.FileType('w'), default=sys.stdout)
+parser.add_argument(
+    '-p', '--processes', dest='p', metavar='processes', type=int, help="Number of worker processes (1).", required=False, default=1)
+parser.add_argument(
+    '-U', '--unordered', dest='U', action="store_false", help="Allow unordered output when using multiple worker processes.", default=True)
+parser.add_argument(
+    '-b', action="store_true", help="Write BAM output (default if the output file name ends with .bam).", default=False)
+parser.add_argument(
+    '-t', metavar='bam_threads', type=int, help="Number of BGZF compression and decompression threads (1).", required=False, default=1)
+parser.add_argument(
+    '-r', metavar='reference', type=str, help="Reference FASTA or .fai index for the @SQ header records (default: taken from the PSL records). Exact MD and NM tags are computed if a FASTA is given together with the reads or pslx input.", required=False, default=None)
+parser.add_argument(
+    '-S', action="store_true", help="Write SAM header with @HD, @SQ and @PG records (always written for BAM output). Without -r, the records are spooled to a temporary file until all @SQ records are known.", default=False)
+parser.add_argument(
+    '-P', action="store_true", help="Pipeline: read the input and write the output on separate threads, overlapping them with the conversion.", default=False)
+parser.add_argument(
+    '-X', action="store_true", help="Set the XS strand tag of spliced records from the splice motifs of their N operations (needs -N and a reference FASTA).", default=False)
+parser.add_argument(
+    '--junctions', metavar='junctions_bed', type=str, help="Write the splice junctions (N operations) with their motifs and read counts as BED (needs -N and a reference FASTA, not with --resume and --shard).", required=False, default=None)
+parser.add_argument(
+    '-M', action="store_true", help="Set primary/secondary/supplementary flags, MAPQ and SA tags from the hits of each query (input grouped by query name, an error is raised otherwise).", default=False)
+parser.add_argument(
+    '--unsorted', action="store_true", help="Input is not grouped by query name: partition it through temporary files for -M (memory use about input size / 64).", default=False)
+parser.add_argument(
+    '--sort', metavar='order', choices=['input', 'coordinate'], help="Output order: input or coordinate (input).", required=False, default='input')
+parser.add_argument(
+    '--sort-memory', metavar='MB', type=int, help="Memory used for sorting before spilling to temporary files (768).", required=False, default=768)
+parser.add_argument(
+    '--read-cache', metavar='MB', type=int, help="Size of the cache of recently used reads, 0 disables it (0).", required=False, default=0)
+parser.add_argument(
+    '--region', metavar='region', type=str, help="Convert only the records overlapping a target region (chr, chr:start or chr:start-end), using an index of the uncompressed input file (built as input.psl.psi if missing).", required=False, default=None)
+parser.add_argument(
+    '--shard', metavar='i/n', type=str, help="Convert only shard i of n (one-based) of the uncompressed input file, split at line boundaries by size (and between queries with -M), SAM output only. Merge the shard outputs with uncle_psl_merge.py.", required=False, default=None)
+parser.add_argument(
+    '--checkpoint', metavar='records', type=int, help="Save a checkpoint (outfile.ckpt) every this many records, with the input and output offsets and the output checksum. Needs -r with -S, not with -P, -U, -b, --sort coordinate and --unsorted.", required=False, default=None)
+parser.add_argument(
+    '--resume', action="store_true", help="Resume an interrupted conversion from its checkpoint: truncate the output to the checkpoint and continue from the matching input offset.", default=False)
+parser.add_argument(
+    '--stats', metavar='stats_json', type=str, help="Write per-stage timings, counters and peak memory as JSON.", required=False, default=None)
+parser.add_argument('infile', nargs='?', help='Input PSL or pslx, plain or gzip/bgzip/zstd compressed (default: stdin).',
+                    type=argparse.FileType('rb'), default=sys.stdin)
+parser.add_argument('outfile', nargs='?', help='Output SAM (default: stdout)', type=str, default=None)
+
+
+def command_line(argv, outfile=None):
+    """ Command line for the @PG record. The shard option and the output file are left out, so that the merged
+    shards have the header of a single run. """
+    argv = list(argv)
+    if outfile is not None and outfile in argv:
+        # The output file is the last positional argument:
+        del argv[len(argv) - 1 - argv[::-1].index(outfile)]
+    result = []
+    skip = False
+    for arg in argv:
+        if skip or arg.startswith('--shard='):
+            skip = False
+        elif arg == '--shard':
+            skip = True
+        else:
+            result.append(arg)
+    return ' '.join(result)
+
+
+def open_reads(fname, stream, threads):
+    """ Open reads as a stream, a FASTQ index or a FASTA store. """
+    if stream:
+        return ReadStream(compressed_input.open_input(open(fname, 'rb'), threads=threads))
+    with open(fname, 'r') as handle:
+        fastq = handle.read(1) == '@'
+    if fastq:
+        return SeqIO.index(fname, 'fastq')
+    return FastaStore(fname)
+
 
 # Reference on the PSL format: http://www.ensembl.org/info/website/upload/psl.html
 # Reference on the SAM format: https://samtools.github.io/hts-specs/SAMv1.pdf
@@ -36,6 +116,71 @@ parser.add_argument('outfile', nargs='?', help='Output SAM (default: stdout)',
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    reads = SeqIO.index(args.f, 'fasta') if args.f is not None else None
-    psl2sam.psl2sam(args.infile, args.outfile, reads, args.H, args.N)
-    reads.close()
+    if (args.checkpoint is not None or args.resume) and args.outfile is None:
+        parser.error('--checkpoint and --resume need an output file')
+    bam = args.b or (args.outfile is not None and args.outfile.endswith('.bam'))
+    if (args.checkpoint is not None or args.resume) and (
+            bam or args.sort == 'coordinate' or args.unsorted or args.P or not args.U or (args.S and args.r is None)):
+        parser.error('--checkpoint and --resume need SAM output in input order with the @SQ records given by -r '
+                     'when -S is used, and can not be combined with -P, -U, -b, --sort and --unsorted')
+    out_handle = sys.stdout if args.outfile is None else open(args.outfile, 'r+b' if args.resume else 'wb')
+    stats = Stats() if args.stats is not None else None
+    reads = open_reads(args.f, args.s, args.t) if args.f is not None else None
+    header = None
+    if args.S or bam:
+        references = read_references(args.r) if args.r is not None else None
+        header = new_header(references, command_line=command_line(sys.argv, args.outfile))
+    splice_motifs = args.X or args.junctions is not None
+    if splice_motifs and (args.N is None or args.r is None or args.r.endswith('.fai')):
+        parser.error('-X and --junctions need -N and a reference FASTA')
+    if args.junctions is not None and (args.resume or args.shard is not None):
+        # The read counts would only cover the records converted by this run:
+        parser.error('--junctions can not be combined with --resume and --shard')
+    reference, splice_junctions = None, None
+    if args.r is not None and not args.r.endswith('.fai'):
+        reference = ReferenceWindows(FastaStore(args.r))
+    if splice_motifs:
+        splice_junctions = splice.SpliceJunctions(reference, count=args.junctions is not None, tags=args.X)
+    if args.shard is not None:
+        if args.region is not None or args.unsorted or args.checkpoint is not None or args.resume or bam:
+            parser.error('--shard can not be combined with --region, --unsorted, --checkpoint, --resume and BAM '
+                         'output')
+        if args.infile is sys.stdin or compressed_input.detect_format(args.infile.read(18)) != 'plain':
+            parser.error('--shard needs an uncompressed input file')
+        psl_lines = shard.iter_shard(args.infile, *shard.parse_shard(args.shard),
+                                     key=multi_hit.line_query if args.M else None)
+    elif args.region is not None:
+        if args.infile is sys.stdin or compressed_input.detect_format(args.infile.read(18)) != 'plain':
+            parser.error('--region needs an uncompressed input file')
+        region = psl_index.parse_region(args.region)
+        index = psl_index.open_index(args.infile.name, names=[region[0]])
+        psl_lines = psl_index.iter_region(args.infile, index, *region)
+    else:
+        psl_lines = compressed_input.open_input(args.infile, threads=args.t)
+    checkpointer = None
+    if args.resume:
+        if psl_lines is not args.infile or args.region is not None:
+            parser.error('--resume needs an uncompressed input file and no region')
+        checkpointer = checkpoint.resume(args.outfile + '.ckpt', psl_lines, out_handle,
+                                         args.checkpoint or checkpoint.DEFAULT_INTERVAL)
+    elif args.checkpoint is not None:
+        checkpointer = checkpoint.Checkpointer(args.outfile + '.ckpt', args.checkpoint)
+    psl2sam.psl2sam(psl_lines, out_handle, reads, args.H, args.N, processes=args.p, ordered=args.U,
+                    bam=bam, bam_threads=args.t, stats=stats,
+                    header=header, reference=reference,
+                    sort_memory=args.sort_memory << 20 if args.sort == 'coordinate' else None,
+                    multi_hits=args.M, partitions=multi_hit.DEFAULT_PARTITIONS if args.unsorted else None,
+                    read_cache_size=args.read_cache << 20 if args.read_cache > 0 else None, pipeline=args.P,
+                    checkpointer=checkpointer, splice_junctions=splice_junctions)
+    if out_handle is not sys.stdout:
+        out_handle.close()
+    if args.junctions is not None:
+        with open(args.junctions, 'w') as junctions_handle:
+            splice_junctions.write_bed(junctions_handle)
+    if reads is not None:
+        reads.close()
+    if reference is not None:
+        reference.close()
+    if stats is not None:
+        with open(args.stats, 'w') as stats_handle:
+            stats.write_json(stats_handle)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+import argparse
+import sys
+
+from uncle_PSL import shard
+
+# Parse command line arguments:
+parser = argparse.ArgumentParser(
+    description='Merge the SAM outputs of uncle_psl.py --shard runs into the output of a single run.')
+parser.add_argument('shards', nargs='+', help='SAM outputs of the shards, in shard order.',
+                    type=argparse.FileType('r'))
+parser.add_argument('-o', metavar='outfile', help='Output SAM (default: stdout)',
+                    type=argparse.FileType('w'), default=sys.stdout)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    shard.merge_shards(args.shards, args.o)
+    for handle in args.shards:
+        handle.close()
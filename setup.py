@@ -8,7 +8,8 @@ with open('README.md') as readme_file:
     readme = readme_file.read()
 
 requirements = [
-    'biopython'
+    'biopython',
+    'numpy'
     # TODO: put package requirements here
 ]
 
@@ -31,6 +32,7 @@ setup(
                  'uncle_PSL'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={'zstd': ['zstandard'], 'pysam': ['pysam']},
     zip_safe=False,
     keywords='uncle_PSL',
     classifiers=[
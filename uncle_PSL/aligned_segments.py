@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Adapter building pysam AlignedSegment objects from converted SAM records, without formatting and parsing
+SAM text. Needs the optional pysam module. """
+
+from uncle_PSL import psl2sam
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+# Converters of optional tag values by SAM type:
+_TAG_TYPES = {'i': int, 'f': float, 'A': str, 'Z': str, 'H': str}
+
+
+def alignment_header(header):
+    """ Build pysam AlignmentHeader from a SAM header structure.
+
+    :param header: SAM header structure with @SQ records (see sam_writer.new_header).
+    :returns: AlignmentHeader object.
+    :rtype: pysam.AlignmentHeader
+    """
+    if pysam is None:
+        raise Exception('The pysam module is needed to build AlignedSegment objects.')
+    if len(header.get('SQ', [])) == 0:
+        raise Exception('The SAM header must have @SQ records to build AlignedSegment objects.')
+    header_dict = {}
+    for key, records in header.iteritems():
+        records = [dict(record) if isinstance(record, dict) else record for record in records]
+        # pysam takes the single @HD record as a dictionary:
+        header_dict[key] = records[0] if key == 'HD' else records
+    return pysam.AlignmentHeader.from_dict(header_dict)
+
+
+def _parse_tags(tags):
+    """ Parse tab separated optional tags into (tag, value, type) tuples. """
+    result = []
+    for tag in tags.split("\t"):
+        if len(tag) == 0:
+            continue
+        name, value_type, value = tag.split(':', 2)
+        result.append((name, _TAG_TYPES.get(value_type, str)(value), value_type))
+    return result
+
+
+def to_aligned_segment(record, header):
+    """ Build pysam AlignedSegment object from a SAM record.
+
+    :param record: SamRecord object.
+    :param header: AlignmentHeader object holding the reference of the record.
+    :returns: AlignedSegment object.
+    :rtype: pysam.AlignedSegment
+    """
+    segment = pysam.AlignedSegment(header)
+    segment.query_name = record.qname
+    segment.flag = record.flag
+    if record.rname != '*':
+        segment.reference_name = record.rname
+    segment.reference_start = record.pos - 1
+    segment.mapping_quality = record.mapq
+    segment.cigarstring = record.cigar
+    segment.next_reference_id = -1
+    segment.next_reference_start = record.pnext - 1
+    segment.template_length = record.tlen
+    # The qualities have to be set after the sequence (str() copies only buffer views of long reads):
+    if record.seq != '*':
+        segment.query_sequence = str(record.seq)
+    if record.qual != '*':
+        segment.query_qualities = pysam.qualitystring_to_array(str(record.qual))
+    segment.set_tags(_parse_tags(record.tags))
+    return segment
+
+
+def iter_aligned_segments(psl_source, header, reads=None, **kwargs):
+    """ Convert PSL data into pysam AlignedSegment objects in the calling process.
+
+    :param psl_source: File handle or iterable of PSL lines.
+    :param header: SAM header structure with @SQ records of all targets (see sam_writer.new_header).
+    :param reads: Input reads, see psl2sam.psl2sam.
+    :param kwargs: Further arguments of psl2sam.iter_sam_records.
+    :returns: Generator of lists of AlignedSegment objects in input order.
+    """
+    header = alignment_header(header)
+    for records in psl2sam.iter_sam_records(psl_source, reads, **kwargs):
+        yield [to_aligned_segment(record, header) for record in records]
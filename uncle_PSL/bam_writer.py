@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+# Reference on the BAM and BGZF formats: https://samtools.github.io/hts-specs/SAMv1.pdf (section 4)
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import re
+import string
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+from uncle_PSL.external_sort import ExternalSorter, coordinate_key
+from uncle_PSL.sam_writer import SamWriter, format_header
+
+# Maximum size of uncompressed data in a BGZF block (as in htslib):
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = ("\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43"
+            "\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+
+_CIGAR_OPS = dict((op, code) for code, op in enumerate('MIDNSHP=X'))
+_CIGAR_REF_OPS = frozenset('MDN=X')
+_CIGAR_RE = re.compile(r'(\d+)([MIDNSHP=X])')
+
+
+def _seq_codes():
+    """ Build translation table of bases into 4-bit codes, unknown bases are encoded as N. """
+    table = [chr(15)] * 256
+    for code, base in enumerate('=ACMGRSVTWYHKDBN'):
+        table[ord(base)] = chr(code)
+        table[ord(base.lower())] = chr(code)
+    return ''.join(table)
+
+
+# Lookup tables of byte values, applied to sequences and qualities without copying them first (they can be
+# buffer views of long reads):
+_SEQ_CODES = np.frombuffer(_seq_codes(), dtype=np.uint8)
+# Translation of Phred+33 qualities into raw values:
+_QUAL_CODES = np.frombuffer(string.maketrans(''.join(chr(i) for i in range(33, 127)),
+                                             ''.join(chr(i) for i in range(0, 94))), dtype=np.uint8)
+_CORE = struct.Struct('<iiiBBHHHiiii')
+
+
+def _compress_block(data, level=6):
+    """ Compress data into a single BGZF block. """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter:
+
+    """ Write BGZF compressed data, compressing blocks on a thread pool. """
+
+    def __init__(self, out_file, threads=1, level=6):
+        """ Initialise BGZF writer object.
+
+        :param out_file: Output file handle.
+        :param threads: Number of compression threads.
+        :param level: Compression level.
+        """
+        self.out_handler = out_file
+        self.level = level
+        self.threads = threads
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.buffer = []
+        self.buffer_size = 0
+        self.blocks = []
+        self.pending = None
+
+    def write(self, data):
+        """Write data.
+
+        :param self: object
+        :param data: String to write.
+        :returns: None
+        """
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= BGZF_BLOCK_SIZE:
+            self._cut_blocks(final=False)
+
+    def _cut_blocks(self, final):
+        """ Cut full blocks from the buffer and compress them in batches. """
+        data = "".join(self.buffer)
+        pos = 0
+        while len(data) - pos >= BGZF_BLOCK_SIZE or (final and pos < len(data)):
+            self.blocks.append(data[pos:pos + BGZF_BLOCK_SIZE])
+            pos += BGZF_BLOCK_SIZE
+        self.buffer = [data[pos:]]
+        self.buffer_size = len(data) - pos
+        if final or len(self.blocks) >= 4 * self.threads:
+            self._compress_blocks()
+
+    def _compress_blocks(self):
+        """ Compress a batch of blocks while the previous batch is being written. """
+        blocks, self.blocks = self.blocks, []
+        if self.pool is None:
+            self.out_handler.write("".join(_compress_block(block, self.level) for block in blocks))
+            return
+        # Overlap the compression of this batch with formatting of the next one:
+        previous = self.pending
+        self.pending = self.pool.map_async(_compress_block, blocks)
+        if previous is not None:
+            self.out_handler.write("".join(previous.get()))
+
+    def flush(self):
+        """Compress and write all buffered data.
+
+        :param self: object
+        :returns: None
+        """
+        self._cut_blocks(final=True)
+        if self.pending is not None:
+            self.out_handler.write("".join(self.pending.get()))
+            self.pending = None
+        self.out_handler.flush()
+
+    def finish(self):
+        """Flush data and write the EOF marker block.
+
+        :param self: object
+        :returns: None
+        """
+        self.flush()
+        self.out_handler.write(BGZF_EOF)
+        self.out_handler.flush()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _reg2bin(beg, end):
+    """ Calculate BAI bin of a zero-based, half-open interval. """
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def _encode_seq(seq):
+    """ Pack sequence into 4-bit codes. """
+    codes = _SEQ_CODES[np.frombuffer(seq, dtype=np.uint8)]
+    if len(codes) % 2 == 1:
+        codes = np.append(codes, np.uint8(0))
+    return ((codes[0::2] << 4) | codes[1::2]).tostring()
+
+
+def _encode_tags(tags):
+    """ Encode tab separated SAM tags. """
+    encoded = []
+    for tag in tags.split("\t"):
+        if len(tag) == 0:
+            continue
+        name, tag_type, value = tag.split(':', 2)
+        if tag_type == 'i':
+            encoded.append(name + 'i' + struct.pack('<i', int(value)))
+        elif tag_type == 'A':
+            encoded.append(name + 'A' + value)
+        elif tag_type == 'f':
+            encoded.append(name + 'f' + struct.pack('<f', float(value)))
+        elif tag_type in ('Z', 'H'):
+            encoded.append(name + tag_type + value + "\0")
+        else:
+            raise Exception('Unsupported tag type in BAM output: {}'.format(tag))
+    return "".join(encoded)
+
+
+def encode_record(record, ref_id, next_ref_id=-1):
+    """ Encode SAM record in binary BAM layout.
+
+    :param record: SAM record as returned by SamWriter.new_sam_record.
+    :param ref_id: Reference index of the record (-1 if unmapped).
+    :param next_ref_id: Reference index of the next segment.
+    :returns: Binary BAM record including the block size.
+    :rtype: str
+    """
+    cigar = [(int(length), op) for length, op in _CIGAR_RE.findall(record.cigar)] if record.cigar != '*' else []
+    if len(cigar) > 0xffff:
+        raise Exception('Too many CIGAR operations for BAM output in record: {}'.format(record.qname))
+    pos = record.pos - 1
+    ref_len = sum(length for length, op in cigar if op in _CIGAR_REF_OPS)
+    seq = record.seq if record.seq != '*' else ''
+    qual = _QUAL_CODES[np.frombuffer(record.qual, dtype=np.uint8)].tostring() if record.qual != '*' \
+        else "\xff" * len(seq)
+    qname = record.qname + "\0"
+
+    data = "".join([
+        struct.pack('<{}I'.format(len(cigar)), *[(length << 4) | _CIGAR_OPS[op] for length, op in cigar]),
+        _encode_seq(seq),
+        qual,
+        _encode_tags(record.tags),
+    ])
+    core = _CORE.pack(32 + len(qname) + len(data), ref_id, pos, len(qname), record.mapq,
+                      _reg2bin(pos, pos + max(ref_len, 1)) if pos >= 0 else 4680, len(cigar),
+                      record.flag, len(seq), next_ref_id, record.pnext - 1, record.tlen)
+    return core + qname + data
+
+
+def _remap_references(data, mapping):
+    """ Replace chunk-local reference indices in a buffer of encoded BAM records. """
+    data = bytearray(data)
+    pos = 0
+    while pos < len(data):
+        block_size, ref_id = struct.unpack_from('<ii', data, pos)
+        if ref_id >= 0:
+            struct.pack_into('<i', data, pos + 4, mapping[ref_id])
+        next_ref_id = struct.unpack_from('<i', data, pos + 24)[0]
+        if next_ref_id >= 0:
+            struct.pack_into('<i', data, pos + 24, mapping[next_ref_id])
+        pos += block_size + 4
+    return str(data)
+
+
+class BamSorter(ExternalSorter):
+
+    """ External sorter taking buffers of encoded BAM records, sorting them by reference index and position. """
+
+    def write(self, data):
+        """Add encoded records.
+
+        :param self: object
+        :param data: Concatenated encoded BAM records.
+        :returns: None
+        """
+        pos = 0
+        while pos < len(data):
+            block_size, ref_id, ref_pos = struct.unpack_from('<iii', data, pos)
+            self.add(coordinate_key(ref_id, ref_pos + 1), data[pos:pos + block_size + 4])
+            pos += block_size + 4
+
+
+class BamRecordBuffer(SamWriter):
+
+    """ Encode SAM records into an in-memory buffer of BAM records using a local reference table. """
+
+    def __init__(self):
+        """ Initialise BAM record buffer object """
+        SamWriter.__init__(self, None)
+        self.ref_ids = {}
+        self.chunks = []
+
+    def add_reference(self, name, length):
+        """Register a reference sequence seen in the records.
+
+        :param self: object
+        :param name: Reference name.
+        :param length: Reference length.
+        :returns: None
+        """
+        if name not in self.ref_ids:
+            self.ref_ids[name] = len(self.ref_ids)
+            self.references[name] = length
+
+    def write(self, record):
+        """Encode SAM record into the buffer.
+
+        :param self: object
+        :param record: SAM record.
+        :returns: None
+        """
+        self.chunks.append(encode_record(record, self.ref_ids.get(record.rname, -1)))
+
+    def write_many(self, records):
+        """Encode a batch of SAM records into the buffer.
+
+        :param self: object
+        :param records: List of SAM records.
+        :returns: None
+        """
+        for record in records:
+            self.write(record)
+
+    def getvalue(self):
+        """Get encoded records and the local reference table.
+
+        :param self: object
+        :returns: Encoded records and list of (name, length) tuples.
+        :rtype: tuple
+        """
+        return "".join(self.chunks), self.references.items()
+
+
+class BamWriter(SamWriter):
+
+    """ Class to write BAM files.
+
+    If the header has no @SQ records, the references are collected from the records through add_reference and
+    the encoded records are spooled to a temporary file until the header can be written by finish.
+    If sort_memory is given, the encoded records are sorted by coordinate with an external merge sort instead.
+    """
+
+    def __init__(self, out_file, header=None, threads=1, level=6, sort_memory=None):
+        """ Initialise BAM writer object.
+
+        :param out_file: Output file handle.
+        :param header: SAM header structure.
+        :param threads: Number of BGZF compression threads.
+        :param level: Compression level.
+        :param sort_memory: Sort records by coordinate, keeping runs of this many bytes in memory (None: no sorting).
+        """
+        self.out_file = out_file
+        self.out_handler = out_file
+        self.header = header if header is not None else OrderedDict()
+        self.references = OrderedDict()
+        self.ref_ids = {}
+        self.bgzf = BgzfWriter(out_file, threads, level)
+        self.spool = None
+        self.sort = sort_memory is not None
+        self.sorter = BamSorter(sort_memory) if self.sort else None
+        self.finished = False
+        self.fixed_references = len(self.header.get('SQ', [])) > 0
+        if self.fixed_references:
+            for sq in self.header['SQ']:
+                self.references[sq['SN']] = sq['LN']
+                self.ref_ids[sq['SN']] = len(self.ref_ids)
+            if not self.sort:
+                self._write_header()
+        elif not self.sort:
+            self.spool = tempfile.TemporaryFile(prefix='uncle_psl_bam')
+
+    def _write_header(self):
+        """Write BAM header."""
+        text = format_header(self._complete_header())
+        parts = ['BAM\1', struct.pack('<i', len(text)), text, struct.pack('<i', len(self.references))]
+        for name, length in self.references.iteritems():
+            parts.append(struct.pack('<i', len(name) + 1) + name + "\0" + struct.pack('<i', int(length)))
+        self.bgzf.write("".join(parts))
+
+    def add_reference(self, name, length):
+        """Register a reference sequence seen in the records.
+
+        :param self: object
+        :param name: Reference name.
+        :param length: Reference length.
+        :returns: None
+        """
+        if name in self.ref_ids:
+            return
+        if self.fixed_references:
+            raise Exception('Reference not in BAM header: {}'.format(name))
+        self.ref_ids[name] = len(self.ref_ids)
+        self.references[name] = length
+
+    def _sink(self):
+        """ Get the destination of encoded records. """
+        if self.sorter is not None:
+            return self.sorter
+        return self.spool if self.spool is not None else self.bgzf
+
+    def write(self, record):
+        """Write SAM record to file in BAM format.
+
+        :param self: object
+        :param record: SAM record.
+        :returns: None
+        """
+        ref_id = self.ref_ids.get(record.rname, -1) if record.rname != '*' else -1
+        self._sink().write(encode_record(record, ref_id))
+
+    def write_many(self, records):
+        """Write a batch of SAM records to file in BAM format.
+
+        :param self: object
+        :param records: List of SAM records.
+        :returns: None
+        """
+        ref_ids = self.ref_ids
+        self._sink().write("".join([encode_record(record, ref_ids.get(record.rname, -1)) for record in records]))
+
+    def write_encoded(self, data, references):
+        """Write records encoded by a BamRecordBuffer object.
+
+        :param self: object
+        :param data: Encoded records.
+        :param references: Local reference table of the encoded records.
+        :returns: None
+        """
+        mapping = []
+        for name, length in references:
+            self.add_reference(name, length)
+            mapping.append(self.ref_ids[name])
+        if mapping != range(len(mapping)):
+            data = _remap_references(data, mapping)
+        self._sink().write(data)
+
+    def finish(self):
+        """Write spooled records, flush compressed data and write the EOF marker.
+
+        :param self: object
+        :returns: None
+        """
+        if self.finished:
+            return
+        if self.sorter is not None:
+            self._write_header()
+            for data in self.sorter.merged():
+                self.bgzf.write(data)
+            self.sorter.close()
+            self.sorter = None
+        if self.spool is not None:
+            self._write_header()
+            self.spool.seek(0)
+            while True:
+                data = self.spool.read(BGZF_BLOCK_SIZE * 16)
+                if len(data) == 0:
+                    break
+                self.bgzf.write(data)
+            self.spool.close()
+            self.spool = None
+        self.bgzf.finish()
+        self.finished = True
+
+    def close(self):
+        """Close BAM file.
+
+        :param self: object
+        :returns: None
+        :rtype: object
+        """
+        self.finish()
+        self.out_handler.close()
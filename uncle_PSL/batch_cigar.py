@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Vectorised CIGAR and NM computation for batches of PSL records.
+
+The records are passed in columnar form: one array per scalar PSL column and the block columns
+(blockSizes, qStarts, tStarts) concatenated over all records, with offsets[i]:offsets[i + 1] giving
+the blocks of record i. The results are identical to the per-record path in psl2sam.
+"""
+
+import numpy as np
+
+from uncle_PSL.records import PSL_FIELDS
+
+# Integer PSL columns used by the batch functions:
+INT_COLUMNS = ('misMatches', 'nCount', 'qSize', 'qStart', 'qEnd', 'tSize', 'tStart', 'tEnd')
+# All integer PSL columns, with their positions:
+ALL_INT_COLUMNS = tuple((PSL_FIELDS[pos], pos) for pos in (0, 1, 2, 3, 4, 5, 6, 7, 10, 11, 12, 14, 15, 16, 17))
+BLOCK_COLUMNS = ('blockSizes', 'qStarts', 'tStarts')
+
+
+def _parse_strands(strands):
+    """ Decode strand fields into query reverse and target flip masks. """
+    reverse = np.zeros(len(strands), dtype=bool)
+    target_flip = np.zeros(len(strands), dtype=bool)
+    for i, strand in enumerate(strands):
+        if len(strand) == 1:
+            reverse[i] = strand == '-'
+        elif len(strand) == 2:
+            reverse[i] = strand[0] != strand[1]
+            target_flip[i] = strand[1] == '-'
+        else:
+            raise Exception('Invalid strand field in record number: {}'.format(i))
+    return reverse, target_flip
+
+
+def columns_from_fields(records):
+    """ Build columnar batch from PSL records split into fields.
+
+    :param records: List of PSL lines split into 21 fields.
+    :returns: Dictionary of the integer and name columns, the flattened block columns and the block offsets.
+    :rtype: dict
+    """
+    columns = {'strand': [r[8] for r in records], 'qName': [r[9] for r in records],
+               'tName': [r[13] for r in records]}
+    for name, pos in ALL_INT_COLUMNS:
+        columns[name] = np.array([int(r[pos]) for r in records], dtype=np.int64)
+    block_counts = columns['blockCount']
+    for name, pos in zip(BLOCK_COLUMNS, (18, 19, 20)):
+        text = ''.join(r[pos] if r[pos].endswith(',') else r[pos] + ',' for r in records)
+        columns[name] = np.fromstring(text, dtype=np.int64, sep=',')
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum(block_counts, out=offsets[1:])
+    columns['offsets'] = offsets
+    return columns
+
+
+def _join_tokens(tokens, offsets, five, three):
+    """ Materialise CIGAR strings from the per-block tokens. """
+    join = ''.join
+    return [five[i] + join(tokens[3 * offsets[i]:3 * offsets[i + 1]]) + three[i] for i in xrange(len(five))]
+
+
+def batch_cigar(columns, soft_clip=True, n_limit=None):
+    """ Compute CIGAR strings and NM values for a batch of PSL records.
+
+    :param columns: Columnar batch as returned by columns_from_fields.
+    :param soft_clip: Soft clip if true.
+    :param n_limit: Deletion size limit for using N operation.
+    :returns: Dictionary with cigar (list of str), NM, reverse, qStart, qEnd, five_clip and three_clip arrays
+     and the transformed block arrays.
+    :rtype: dict
+    """
+    offsets = np.asarray(columns['offsets'], dtype=np.int64)
+    nr_records = len(offsets) - 1
+    counts = np.diff(offsets)
+    if np.any(counts < 1):
+        raise Exception('Records without alignment blocks in batch.')
+    reverse, target_flip = _parse_strands(columns['strand'])
+    q_size, t_size = columns['qSize'], columns['tSize']
+
+    # Transform start and end coordinates if strand is '-':
+    q_start = np.where(reverse, q_size - columns['qEnd'], columns['qStart'])
+    q_end = np.where(reverse, q_size - columns['qStart'], columns['qEnd'])
+
+    # Reverse and transform segment information if target strand is '-':
+    rec = np.repeat(np.arange(nr_records), counts)
+    idx = np.arange(len(rec))
+    flip = target_flip[rec]
+    perm = np.where(flip, 2 * offsets[rec] + counts[rec] - 1 - idx, idx)
+    block_sizes = columns['blockSizes'][perm]
+    q_starts = columns['qStarts'][perm]
+    t_starts = columns['tStarts'][perm]
+    q_starts = np.where(flip, q_size[rec] - block_sizes - q_starts, q_starts)
+    t_starts = np.where(flip, t_size[rec] - block_sizes - t_starts, t_starts)
+
+    # Gaps after each block, zero after the last block of a record:
+    has_next = np.ones(len(rec), dtype=bool)
+    has_next[offsets[1:] - 1] = False
+    insertion = np.zeros(len(rec), dtype=np.int64)
+    deletion = np.zeros(len(rec), dtype=np.int64)
+    insertion[:-1] = q_starts[1:] - q_starts[:-1] - block_sizes[:-1]
+    deletion[:-1] = t_starts[1:] - t_starts[:-1] - block_sizes[:-1]
+    insertion[~has_next] = 0
+    deletion[~has_next] = 0
+
+    # Use N operation if deletion is larger than limit:
+    if n_limit is not None:
+        del_ops = np.where(deletion >= n_limit, 'N', 'D')
+    else:
+        del_ops = np.full(len(rec), 'D', dtype='S1')
+
+    # Clipping:
+    clip_op = 'S' if soft_clip else 'H'
+    five_clip = q_start
+    three_clip = q_size - q_end
+
+    # NM: indels + mismatches + N bases:
+    indels = np.add.reduceat(insertion + deletion, offsets[:-1]) if nr_records > 0 else np.zeros(0, np.int64)
+    nm = indels + columns['misMatches'] + columns['nCount']
+
+    # Materialise CIGAR strings, three token slots per block:
+    tokens = np.empty((len(rec), 3), dtype=object)
+    tokens[:, 0] = np.char.add(block_sizes.astype(str), 'M')
+    tokens[:, 1] = np.where(insertion != 0, np.char.add(insertion.astype(str), 'I'), '')
+    tokens[:, 2] = np.where(deletion != 0, np.char.add(deletion.astype(str), del_ops), '')
+    five = np.where(five_clip != 0, np.char.add(five_clip.astype(str), clip_op), '').tolist()
+    three = np.where(three_clip != 0, np.char.add(three_clip.astype(str), clip_op), '').tolist()
+    cigars = _join_tokens(tokens.ravel().tolist(), offsets.tolist(), five, three)
+
+    return {'cigar': cigars, 'NM': nm, 'reverse': reverse, 'qStart': q_start, 'qEnd': q_end,
+            'five_clip': five_clip, 'three_clip': three_clip, 'blockSizes': block_sizes,
+            'qStarts': q_starts, 'tStarts': t_starts}
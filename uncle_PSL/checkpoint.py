@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Checkpoints for resuming an interrupted conversion.
+
+A checkpoint records the input offset up to which the PSL records are converted, the output offset up to which
+their SAM records are written, the number of records and the CRC32 checksum of the output so far. It is saved as
+JSON after the output is flushed to disk, replacing the previous checkpoint atomically. A resumed conversion
+truncates the output to the checkpoint, continues from the input offset and carries on the checksum, so the final
+checksum can be compared to the one of a conversion from scratch.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import zlib
+
+# Default number of records between checkpoints:
+DEFAULT_INTERVAL = 1000000
+
+
+class ChecksumHandle(object):
+
+    """ File handle wrapper computing the CRC32 checksum and the size of the data written. """
+
+    def __init__(self, handle, crc32=0, offset=0):
+        """ Initialise checksum handle object.
+
+        :param handle: Wrapped file handle.
+        :param crc32: Checksum of the data already in the file.
+        :param offset: Size of the data already in the file.
+        """
+        self.handle = handle
+        self.crc32 = crc32
+        self.offset = offset
+
+    def write(self, data):
+        # The writers hand over bytearrays, which crc32 only takes through a read-only buffer:
+        self.crc32 = zlib.crc32(buffer(data), self.crc32)
+        self.offset += len(data)
+        self.handle.write(data)
+
+    def __getattr__(self, attr):
+        return getattr(self.handle, attr)
+
+
+class Checkpointer:
+
+    """ Tracks the progress of a conversion and saves checkpoints. """
+
+    def __init__(self, path, interval=DEFAULT_INTERVAL, state=None):
+        """ Initialise checkpointer object.
+
+        :param path: Path of the checkpoint file.
+        :param interval: Number of records between checkpoints.
+        :param state: State loaded from a checkpoint (None: conversion from scratch).
+        """
+        self.path = path
+        self.interval = interval
+        if state is None:
+            state = OrderedDict([('input_offset', 0), ('output_offset', 0), ('records', 0), ('crc32', 0),
+                                 ('complete', False)])
+        self.state = state
+        self.handle = None
+        self.last_records = self.state['records']
+
+    @property
+    def resumed(self):
+        """ True if the conversion continues from a checkpoint. """
+        return self.state['output_offset'] > 0 or self.state['input_offset'] > 0
+
+    def wrap(self, out_handle):
+        """Wrap the output handle to track the output offset and checksum.
+
+        :param self: object
+        :param out_handle: Output file handle.
+        :returns: Wrapped file handle.
+        :rtype: ChecksumHandle
+        """
+        self.handle = ChecksumHandle(out_handle, self.state['crc32'], self.state['output_offset'])
+        return self.handle
+
+    def advance(self, input_size, records):
+        """Record that a part of the input was converted.
+
+        :param self: object
+        :param input_size: Size of the converted input in bytes.
+        :param records: Number of records written.
+        :returns: True if a checkpoint is due.
+        :rtype: bool
+        """
+        self.state['input_offset'] += input_size
+        self.state['records'] += records
+        return self.state['records'] - self.last_records >= self.interval
+
+    def save(self, complete=False):
+        """Save checkpoint. The output has to be flushed by the caller.
+
+        :param self: object
+        :param complete: Mark the conversion as complete.
+        :returns: None
+        """
+        self.handle.flush()
+        if hasattr(self.handle, 'fileno'):
+            os.fsync(self.handle.fileno())
+        self.state['output_offset'] = self.handle.offset
+        self.state['crc32'] = self.handle.crc32 & 0xffffffff
+        self.state['complete'] = complete
+        self.last_records = self.state['records']
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(self.state, handle, indent=2)
+            handle.write("\n")
+        os.rename(tmp_path, self.path)
+
+
+def resume(path, psl_handle, out_handle, interval=DEFAULT_INTERVAL):
+    """ Prepare the input and output for continuing a conversion from a checkpoint.
+
+    The output is truncated to the checkpoint and the input is positioned at the matching offset.
+
+    :param path: Path of the checkpoint file.
+    :param psl_handle: Seekable PSL file handle.
+    :param out_handle: Output file handle opened for reading and writing.
+    :param interval: Number of records between checkpoints.
+    :returns: Checkpointer object continuing from the checkpoint.
+    :rtype: Checkpointer
+    """
+    with open(path, 'r') as handle:
+        state = json.load(handle, object_pairs_hook=OrderedDict)
+    out_handle.seek(0, os.SEEK_END)
+    if out_handle.tell() < state['output_offset']:
+        raise Exception('Output is shorter than the checkpoint: {}'.format(path))
+    out_handle.seek(state['output_offset'])
+    out_handle.truncate()
+    psl_handle.seek(state['input_offset'])
+    return Checkpointer(path, interval, state)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Reading of plain, gzip, BGZF and zstd compressed input, detected by magic bytes.
+
+Decompression runs on a separate thread (BGZF blocks are inflated in parallel on a thread pool),
+so that decompression and parsing overlap.
+"""
+
+from cStringIO import StringIO
+import itertools
+from multiprocessing.pool import ThreadPool
+import Queue
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = "\x1f\x8b"
+ZSTD_MAGIC = "\x28\xb5\x2f\xfd"
+READ_SIZE = 1 << 20
+# Number of BGZF blocks inflated in a batch per thread:
+BGZF_BATCH = 16
+
+
+def detect_format(head):
+    """ Detect compression format from the first bytes of a file.
+
+    :param head: At least the first 16 bytes of the file (if available).
+    :returns: One of 'bgzf', 'gzip', 'zstd' or 'plain'.
+    :rtype: str
+    """
+    if head.startswith(GZIP_MAGIC):
+        # BGZF: gzip with an extra field holding the BC subfield:
+        if len(head) >= 14 and ord(head[3]) & 4 and head[12:14] == 'BC':
+            return 'bgzf'
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return 'plain'
+
+
+def _iter_raw(handle, head):
+    """ Iterate over raw chunks of a handle, starting with the bytes already read. """
+    if len(head) > 0:
+        yield head
+    while True:
+        data = handle.read(READ_SIZE)
+        if len(data) == 0:
+            return
+        yield data
+
+
+def _inflate_gzip(raw_chunks):
+    """ Decompress (possibly multi-member) gzip data. """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for data in raw_chunks:
+        while len(data) > 0:
+            yield decompressor.decompress(data)
+            data = decompressor.unused_data
+            if len(data) > 0:
+                # Start of the next gzip member:
+                yield decompressor.flush()
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.flush()
+
+
+class _ChunkReader(object):
+
+    """ File-like reader over an iterator of raw chunks. """
+
+    def __init__(self, raw_chunks):
+        self.raw_chunks = raw_chunks
+        self.buff = ''
+        self.pos = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buff) - self.pos < size:
+            data = next(self.raw_chunks, '')
+            if len(data) == 0:
+                break
+            self.buff = self.buff[self.pos:] + data
+            self.pos = 0
+        end = len(self.buff) if size < 0 else self.pos + size
+        data = self.buff[self.pos:end]
+        self.pos += len(data)
+        return data
+
+
+def _inflate_zstd(raw_chunks):
+    """ Decompress (possibly multi-frame) zstd data. """
+    if zstandard is None:
+        raise Exception('The zstandard module is needed to read zstd compressed input.')
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    if not hasattr(decompressor, 'eof'):
+        # Older zstandard versions end the decompressor at the first frame, without the unused data:
+        reader = zstandard.ZstdDecompressor().stream_reader(_ChunkReader(iter(raw_chunks)), read_across_frames=True)
+        for data in iter(lambda: reader.read(READ_SIZE), ''):
+            yield data
+        return
+    for data in raw_chunks:
+        while len(data) > 0:
+            yield decompressor.decompress(data)
+            if not decompressor.eof:
+                break
+            # Start of the next zstd frame:
+            data = decompressor.unused_data
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+
+def _inflate_bgzf_block(block):
+    """ Inflate a single BGZF block. """
+    return zlib.decompress(block[18:-8], -15)
+
+
+def _iter_bgzf_blocks(raw_chunks):
+    """ Split BGZF data into blocks. """
+    buff = ""
+    for data in raw_chunks:
+        buff += data
+        pos = 0
+        while len(buff) - pos >= 18:
+            block_size = struct.unpack_from('<H', buff, pos + 16)[0] + 1
+            if len(buff) - pos < block_size:
+                break
+            yield buff[pos:pos + block_size]
+            pos += block_size
+        buff = buff[pos:]
+    if len(buff) > 0:
+        raise Exception('Truncated BGZF block at the end of input.')
+
+
+def _inflate_bgzf(raw_chunks, threads):
+    """ Decompress BGZF data, inflating batches of blocks on a thread pool. """
+    if threads < 2:
+        for block in _iter_bgzf_blocks(raw_chunks):
+            yield _inflate_bgzf_block(block)
+        return
+    pool = ThreadPool(threads)
+    try:
+        blocks = _iter_bgzf_blocks(raw_chunks)
+        pending = None
+        while True:
+            batch = list(itertools.islice(blocks, BGZF_BATCH * threads))
+            # Inflate this batch while the previous one is being parsed:
+            current = pool.map_async(_inflate_bgzf_block, batch) if len(batch) > 0 else None
+            if pending is not None:
+                yield "".join(pending.get())
+            if current is None:
+                return
+            pending = current
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _producer(chunks, queue):
+    """ Put decompressed chunks on a queue, ending with None (or an exception). """
+    try:
+        for chunk in chunks:
+            if len(chunk) > 0:
+                queue.put(chunk)
+        queue.put(None)
+    except Exception:
+        queue.put(sys.exc_info())
+
+
+def _iter_lines(chunks, queue_size=8):
+    """ Iterate over lines of decompressed chunks produced on a separate thread. """
+    queue = Queue.Queue(queue_size)
+    thread = threading.Thread(target=_producer, args=(chunks, queue))
+    thread.daemon = True
+    thread.start()
+    rest = ""
+    while True:
+        chunk = queue.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, tuple):
+            raise chunk[0], chunk[1], chunk[2]
+        data = rest + chunk
+        end = data.rfind("\n") + 1
+        rest = data[end:]
+        for line in StringIO(data[:end]):
+            yield line
+    if len(rest) > 0:
+        yield rest
+    thread.join()
+
+
+def open_input(source, threads=1):
+    """ Open plain or compressed text input for line iteration.
+
+    :param source: File name or file handle opened in binary mode.
+    :param threads: Number of threads inflating BGZF blocks.
+    :returns: Iterable of lines (the file handle itself for plain input if possible).
+    """
+    handle = open(source, 'rb') if isinstance(source, basestring) else source
+    head = handle.read(18)
+    fmt = detect_format(head)
+    if fmt == 'plain':
+        try:
+            handle.seek(0)
+            return handle
+        except (IOError, AttributeError):
+            # Not seekable (e.g. stdin), complete the first line and continue with the handle:
+            first_lines = (head + handle.readline()).splitlines(True) if len(head) > 0 else []
+            return itertools.chain(first_lines, handle)
+    raw_chunks = _iter_raw(handle, head)
+    if fmt == 'bgzf':
+        return _iter_lines(_inflate_bgzf(raw_chunks, threads))
+    if fmt == 'gzip':
+        return _iter_lines(_inflate_gzip(raw_chunks))
+    return _iter_lines(_inflate_zstd(raw_chunks))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Bounded memory external merge sort of formatted records by an integer key.
+
+Records are collected in a compact run: the data of all records in a single buffer and the keys
+and offsets in arrays, without a Python object per record. Runs larger than the memory budget are
+sorted and spilled to temporary files, which are merged with the last run at the end. Records with
+equal keys keep their input order.
+"""
+
+from array import array
+import heapq
+import struct
+import tempfile
+
+import numpy as np
+
+# Default memory budget of the in-memory run:
+DEFAULT_SORT_MEMORY = 768 << 20
+# Reference index used for unmapped records, which sort last:
+UNMAPPED_REF_ID = 0x7fffffff
+# Size of batches of records yielded by the merge:
+_MERGE_BATCH_SIZE = 1 << 16
+_RUN_ENTRY = struct.Struct('<qI')
+
+
+def coordinate_key(ref_id, pos):
+    """ Build sort key from reference index (-1: unmapped) and one-based position. """
+    if ref_id < 0:
+        ref_id = UNMAPPED_REF_ID
+    return (ref_id << 32) | pos
+
+
+def _read_run(handle):
+    """ Iterate over (key, data) pairs in a spilled run. """
+    handle.seek(0)
+    entry_size = _RUN_ENTRY.size
+    while True:
+        entry = handle.read(entry_size)
+        if len(entry) < entry_size:
+            return
+        key, length = _RUN_ENTRY.unpack(entry)
+        yield key, handle.read(length)
+
+
+def _tag_run(run, index):
+    """ Add the run index to (key, data) pairs. It breaks ties between runs, so equal keys keep their input order. """
+    for key, data in run:
+        yield key, index, data
+
+
+class ExternalSorter:
+
+    """ Sort records by integer keys using runs bounded in memory and spilled to temporary files. """
+
+    def __init__(self, memory=DEFAULT_SORT_MEMORY, tmp_dir=None):
+        """ Initialise external sorter object.
+
+        :param memory: Memory budget of the in-memory run in bytes.
+        :param tmp_dir: Directory of the temporary files (default: system temporary directory).
+        """
+        self.memory = memory
+        self.tmp_dir = tmp_dir
+        self.runs = []
+        self._new_run()
+
+    def _new_run(self):
+        """ Start a new, empty in-memory run. """
+        self.keys = array('l')
+        self.offsets = array('l', [0])
+        self.data = bytearray()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, data):
+        """Add a record.
+
+        :param self: object
+        :param key: Integer sort key.
+        :param data: Formatted record.
+        :returns: None
+        """
+        self.keys.append(key)
+        self.data += data
+        self.offsets.append(len(self.data))
+        if len(self.data) + 16 * len(self.keys) >= self.memory:
+            self._spill()
+
+    def _sorted_run(self):
+        """ Iterate over the (key, data) pairs in the in-memory run in sorted order. """
+        keys, offsets, data = self.keys, self.offsets, self.data
+        order = np.argsort(np.frombuffer(keys, dtype='l'), kind='mergesort') if len(keys) > 0 else []
+        for i in order:
+            yield keys[i], str(data[offsets[i]:offsets[i + 1]])
+
+    def _spill(self):
+        """ Write the sorted in-memory run to a temporary file. """
+        handle = tempfile.TemporaryFile(prefix='uncle_psl_sort', dir=self.tmp_dir)
+        pack = _RUN_ENTRY.pack
+        batch = []
+        for key, data in self._sorted_run():
+            batch.append(pack(key, len(data)))
+            batch.append(data)
+            if len(batch) >= 2 * 4096:
+                handle.write("".join(batch))
+                batch = []
+        handle.write("".join(batch))
+        self.runs.append(handle)
+        self._new_run()
+
+    def merged(self):
+        """Iterate over the sorted records, joined into batches.
+
+        :param self: object
+        :returns: Generator of strings of concatenated records.
+        """
+        if len(self.runs) == 0:
+            records = self._sorted_run()
+        else:
+            runs = [_read_run(handle) for handle in self.runs] + [self._sorted_run()]
+            records = ((key, data) for key, _, data in heapq.merge(*[_tag_run(run, index)
+                                                                     for index, run in enumerate(runs)]))
+        batch, size = [], 0
+        for _, data in records:
+            batch.append(data)
+            size += len(data)
+            if size >= _MERGE_BATCH_SIZE:
+                yield "".join(batch)
+                batch, size = [], 0
+        if len(batch) > 0:
+            yield "".join(batch)
+
+    def close(self):
+        """Remove temporary files and release memory.
+
+        :param self: object
+        :returns: None
+        """
+        for handle in self.runs:
+            handle.close()
+        self.runs = []
+        self._new_run()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+# Reference on the FASTA index format: http://www.htslib.org/doc/faidx.html
+
+import mmap
+import os
+
+from uncle_PSL.lru_cache import LRUCache
+
+# Size of reference windows cached by ReferenceWindows:
+DEFAULT_WINDOW_SIZE = 1 << 16
+
+
+def _build_fai(fasta):
+    """ Scan a FASTA file and build a samtools-compatible index.
+
+    :param fasta: Path to FASTA file.
+    :returns: List of (name, length, offset, linebases, linewidth) tuples.
+    :rtype: list
+    """
+    index = []
+    name = None
+    pos, length, seq_offset, linebases, linewidth = 0, 0, 0, None, None
+    short_line = False
+    with open(fasta, 'rb') as handle:
+        for line in handle:
+            if line.startswith('>'):
+                if name is not None:
+                    index.append((name, length, seq_offset, linebases, linewidth))
+                name = line[1:].split(None, 1)[0] if len(line[1:].strip()) > 0 else ''
+                seq_offset = pos + len(line)
+                length, linebases, linewidth = 0, None, None
+                short_line = False
+            elif name is not None:
+                bases = len(line.rstrip('\r\n'))
+                if bases == 0:
+                    # Only allowed after the last line of a record:
+                    short_line = True
+                    pos += len(line)
+                    continue
+                if short_line or (linebases is not None and bases > linebases):
+                    raise Exception('Different line length in FASTA record: {}'.format(name))
+                if linebases is None:
+                    linebases, linewidth = bases, len(line)
+                elif bases < linebases or len(line) != linewidth:
+                    short_line = True
+                length += bases
+            pos += len(line)
+    if name is not None:
+        index.append((name, length, seq_offset, linebases, linewidth))
+    return [(n, l, o, lb if lb is not None else 0, lw if lw is not None else 0) for n, l, o, lb, lw in index]
+
+
+def _read_fai(fai):
+    """ Read a FASTA index file. """
+    index = []
+    with open(fai, 'r') as handle:
+        for line in handle:
+            fields = line.split("\t")
+            index.append((fields[0], int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4])))
+    return index
+
+
+def _write_fai(fai, index):
+    """ Write a FASTA index file. """
+    with open(fai, 'w') as handle:
+        for record in index:
+            handle.write("\t".join(str(x) for x in record) + "\n")
+
+
+def read_references(path, write_index=True):
+    """ Get sequence names and lengths from a FASTA index or a FASTA file (indexed if necessary).
+
+    :param path: Path to a .fai index or a FASTA file.
+    :param write_index: Save a newly built index if true.
+    :returns: List of (name, length) tuples in file order.
+    :rtype: list
+    """
+    if path.endswith('.fai'):
+        index = _read_fai(path)
+    else:
+        store = FastaStore(path, write_index=write_index)
+        index = [(name, store.length(name)) for name in store.names]
+        store.close()
+    return [record[:2] for record in index]
+
+
+class FastaStore:
+
+    """ Memory mapped FASTA file with a samtools-compatible .fai index.
+
+    Sequences are returned as strings, without building Biopython objects. The memory map is read-only and
+    lookups do not use the file position, so a store can be shared by forked worker processes.
+    """
+
+    def __init__(self, fasta, fai=None, write_index=True):
+        """ Initialise FASTA store object.
+
+        :param fasta: Path to FASTA file.
+        :param fai: Path to index (default: fasta + '.fai'). The index is built if missing or older than the FASTA.
+        :param write_index: Save a newly built index if true.
+        """
+        self.fasta = fasta
+        self.fai = fai if fai is not None else fasta + '.fai'
+        if os.path.exists(self.fai) and os.path.getmtime(self.fai) >= os.path.getmtime(fasta):
+            index = _read_fai(self.fai)
+        else:
+            index = _build_fai(fasta)
+            if write_index:
+                try:
+                    _write_fai(self.fai, index)
+                except IOError:
+                    pass  # Read-only location, keep the index in memory.
+        self.names = [record[0] for record in index]
+        self.index = dict((record[0], record[1:]) for record in index)
+        self.handle = open(fasta, 'rb')
+        self.mm = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(fasta) > 0 else ''
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def keys(self):
+        """ Sequence names in file order. """
+        return list(self.names)
+
+    def length(self, name):
+        """Get the length of a sequence.
+
+        :param self: object
+        :param name: Sequence name.
+        :returns: Sequence length.
+        :rtype: int
+        """
+        return self.index[name][0]
+
+    def _file_offset(self, name, pos):
+        """ Translate sequence position into a file offset. """
+        length, offset, linebases, linewidth = self.index[name]
+        if linebases == 0:
+            return offset
+        return offset + (pos // linebases) * linewidth + pos % linebases
+
+    def fetch(self, name, start=0, end=None):
+        """Get a slice of a sequence.
+
+        :param self: object
+        :param name: Sequence name.
+        :param start: Zero-based start position.
+        :param end: End position (exclusive, default: end of sequence).
+        :returns: Sequence slice.
+        :rtype: str
+        """
+        length, offset, linebases, linewidth = self.index[name]
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+        if start >= end:
+            return ''
+        data = self.mm[self._file_offset(name, start):self._file_offset(name, end)]
+        if linewidth > linebases:
+            # Remove line breaks if the slice spans several lines:
+            data = data.replace("\n", "")
+            if linewidth - linebases > 1:
+                data = data.replace("\r", "")
+        return data
+
+    def __getitem__(self, name):
+        """ Get the full sequence by name. """
+        return self.fetch(name)
+
+    def get(self, name, default=None):
+        """ Get the full sequence by name or return default if missing. """
+        if name not in self.index:
+            return default
+        return self.fetch(name)
+
+    def close(self):
+        """Close memory map and file.
+
+        :param self: object
+        :returns: None
+        """
+        if len(self.mm) > 0:
+            self.mm.close()
+        self.handle.close()
+
+
+class ReferenceWindows:
+
+    """ Random access to reference sequences through an LRU cache of fixed size, upper case windows.
+
+    Alignments on the same target are usually close to each other, so most lookups hit a window which
+    has already been cut out of the memory map and decoded.
+    """
+
+    def __init__(self, store, window_size=DEFAULT_WINDOW_SIZE, max_windows=64):
+        """ Initialise reference windows object.
+
+        :param store: FastaStore object.
+        :param window_size: Size of cached windows.
+        :param max_windows: Maximum number of cached windows.
+        """
+        self.store = store
+        self.window_size = window_size
+        self.cache = LRUCache(max_windows)
+
+    def __contains__(self, name):
+        return name in self.store
+
+    def _window(self, name, index):
+        """ Get a window by sequence name and window index. """
+        key = (name, index)
+        window = self.cache.get(key)
+        if window is None:
+            start = index * self.window_size
+            window = self.store.fetch(name, start, start + self.window_size).upper()
+            self.cache.put(key, window)
+        return window
+
+    def fetch(self, name, start, end):
+        """Get a slice of a sequence in upper case.
+
+        :param self: object
+        :param name: Sequence name.
+        :param start: Zero-based start position.
+        :param end: End position (exclusive).
+        :returns: Sequence slice.
+        :rtype: str
+        """
+        size = self.window_size
+        first, last = start // size, (end - 1) // size
+        if first == last:
+            offset = first * size
+            return self._window(name, first)[start - offset:end - offset]
+        parts = [self._window(name, index) for index in xrange(first, last + 1)]
+        return ''.join(parts)[start - first * size:end - first * size]
+
+    def close(self):
+        """Close the underlying store.
+
+        :param self: object
+        :returns: None
+        """
+        self.store.close()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    """ Size bounded cache evicting the least recently used item, with hit and miss counters. """
+
+    def __init__(self, max_size, sizeof=None):
+        """ Initialise LRU cache object.
+
+        :param max_size: Maximum number of cached items, or their maximum total size if sizeof is given.
+        :param sizeof: Function giving the size of an item (default: every item has size one).
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        """Get cached item and mark it as recently used.
+
+        :param self: object
+        :param key: Key of item.
+        :param default: Value returned if the key is not cached.
+        :returns: Cached item or default.
+        """
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        """Cache an item, evicting the least recently used one if the cache is full.
+
+        :param self: object
+        :param key: Key of item.
+        :param value: Item.
+        :returns: None
+        """
+        if self.sizeof is None:
+            if key in self.items:
+                del self.items[key]
+            elif len(self.items) >= self.max_size:
+                self.items.popitem(last=False)
+            self.items[key] = value
+            return
+        if key in self.items:
+            self.size -= self.sizeof(self.items.pop(key))
+        self.size += self.sizeof(value)
+        # Evict items, but always keep the newest one:
+        while self.size > self.max_size and len(self.items) > 0:
+            self.size -= self.sizeof(self.items.popitem(last=False)[1])
+        self.items[key] = value
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Exact MD and NM tags computed by comparing the aligned blocks to the reference.
+
+The blocks of a record are compared in a single vectorised step, the Python loop only runs over the
+blocks and the mismatches. As in samtools calmd, N bases never match and skipped regions (N CIGAR
+operations) are not part of the MD string nor the edit distance. The comparison of the blocks
+(compare_blocks) also serves the block sequences of pslx records.
+"""
+
+import numpy as np
+
+_N = ord('N')
+
+
+def md_nm(seq, reference, target, blockSizes, qStarts, tStarts, blockCount, n_limit=None):
+    """ Compute MD string and edit distance of an alignment.
+
+    :param seq: Read sequence in target orientation (before clipping).
+    :param reference: ReferenceWindows object.
+    :param target: Target name.
+    :param blockSizes: Block sizes in target orientation.
+    :param qStarts: Block starts in the read.
+    :param tStarts: Block starts on the forward strand of the target.
+    :param blockCount: Number of blocks.
+    :param n_limit: Deletion size limit for using N operation.
+    :returns: MD string and edit distance.
+    :rtype: tuple
+    """
+    span_start, span_end = tStarts[0], tStarts[-1] + blockSizes[-1]
+    if span_end - span_start <= reference.window_size:
+        # Fetch the whole aligned region at once and slice the blocks and deletions out of it:
+        region = reference.fetch(target, span_start, span_end)
+        ref_blocks = ''.join([region[tStarts[i] - span_start:tStarts[i] - span_start + blockSizes[i]]
+                              for i in xrange(blockCount)])
+    else:
+        region, span_start = None, 0
+        ref_blocks = ''.join([reference.fetch(target, tStarts[i], tStarts[i] + blockSizes[i])
+                              for i in xrange(blockCount)])
+    read_blocks = ''.join([seq[qStarts[i]:qStarts[i] + blockSizes[i]] for i in xrange(blockCount)]).upper()
+    if len(ref_blocks) != len(read_blocks):
+        raise Exception('Alignment blocks exceed the sequence of target: {}'.format(target))
+
+    def deleted(start, end):
+        if region is not None:
+            return region[start - span_start:end - span_start]
+        return reference.fetch(target, start, end)
+
+    return compare_blocks(read_blocks, ref_blocks, blockSizes, qStarts, tStarts, blockCount, n_limit, deleted)
+
+
+def compare_blocks(read_blocks, ref_blocks, blockSizes, qStarts, tStarts, blockCount, n_limit=None, deleted=None):
+    """ Compute MD string and edit distance from the concatenated aligned blocks of the read and the reference.
+
+    :param read_blocks: Aligned read bases in upper case.
+    :param ref_blocks: Aligned reference bases in upper case.
+    :param blockSizes: Block sizes in target orientation.
+    :param qStarts: Block starts in the read.
+    :param tStarts: Block starts on the forward strand of the target.
+    :param blockCount: Number of blocks.
+    :param n_limit: Deletion size limit for using N operation.
+    :param deleted: Function of the start and end of a deletion on the target, returning the deleted bases (None:
+    deleted bases unknown).
+    :returns: MD string (None if it needs unknown deleted bases) and edit distance.
+    :rtype: tuple
+    """
+    aligned = len(read_blocks)
+    has_n = 'N' in ref_blocks or 'N' in read_blocks
+    if ref_blocks == read_blocks and not has_n:
+        mismatches = []
+    else:
+        ref_codes = np.frombuffer(ref_blocks, dtype=np.uint8)
+        read_codes = np.frombuffer(read_blocks, dtype=np.uint8)
+        different = ref_codes != read_codes
+        if has_n:
+            different |= (ref_codes == _N) | (read_codes == _N)
+        mismatches = np.flatnonzero(different).tolist()
+
+    # Mismatches and inserted bases:
+    nm = len(mismatches) + (qStarts[-1] + blockSizes[-1] - qStarts[0]) - aligned
+    md = []
+    last = 0  # End of the last mismatch or deletion in the concatenated blocks
+    k = 0  # Next mismatch
+    offset = blockSizes[0]  # Start of the current block in the concatenated blocks
+    # Insertions and skipped regions do not interrupt runs of matches, so only the deletions are visited:
+    for i in xrange(1, blockCount):
+        deletion = tStarts[i] - tStarts[i - 1] - blockSizes[i - 1]
+        if deletion > 0 and (n_limit is None or deletion < n_limit):
+            nm += deletion
+            if deleted is None:
+                md = None
+            if md is None:
+                continue
+            while k < len(mismatches) and mismatches[k] < offset:
+                pos = mismatches[k]
+                md.append("{}{}".format(pos - last, ref_blocks[pos]))
+                last = pos + 1
+                k += 1
+            md.append("{}^{}".format(offset - last, deleted(tStarts[i] - deletion, tStarts[i])))
+            last = offset
+        offset += blockSizes[i]
+    if md is None:
+        return None, nm
+    for pos in mismatches[k:]:
+        md.append("{}{}".format(pos - last, ref_blocks[pos]))
+        last = pos + 1
+    md.append(str(offset - last))
+    return ''.join(md), nm
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Classification of the hits of a query into primary, secondary and supplementary alignments.
+
+The hits are scored like in pslReps (matches + repMatches / 2 - misMatches - number of gaps). The best hit is
+the primary alignment. Hits covering a part of the query not already covered by the primary or an earlier
+supplementary alignment are supplementary (chimeric) alignments, the rest are secondary alignments. The
+mapping quality of primary and supplementary alignments is derived from the score gap to the best secondary
+hit overlapping them.
+
+Hits are processed one query at a time, which needs the PSL input grouped by query name. Input claimed to be
+grouped is checked, raising an exception when the hits of a query come back after those of another query.
+Ungrouped input is first partitioned into temporary files by a hash of the query name, then each partition is
+grouped in memory, so the memory use grows with the size of the input divided by the number of partitions.
+"""
+
+from collections import OrderedDict
+import itertools
+import tempfile
+import zlib
+
+FLAG_REVERSE = 16
+FLAG_SECONDARY = 256
+FLAG_SUPPLEMENTARY = 2048
+MAX_MAPQ = 60
+# Hits overlapping the already covered part of the query by at least this fraction of their length are secondary:
+MAX_OVERLAP = 0.5
+DEFAULT_PARTITIONS = 64
+
+
+def score(psl):
+    """ Score PSL record as pslReps does. """
+    return psl.matches + (psl.repMatches >> 1) - psl.misMatches - psl.qNumInsert - psl.tNumInsert
+
+
+def _overlap(a_start, a_end, b_start, b_end):
+    """ Length of overlap between two intervals. """
+    return max(0, min(a_end, b_end) - max(a_start, b_start))
+
+
+def _mapq(best, competitor):
+    """ Mapping quality from the score gap between a hit and its best competitor. """
+    if best <= 0:
+        return 0
+    if competitor is None:
+        return MAX_MAPQ
+    return max(0, min(MAX_MAPQ, int(round(MAX_MAPQ * (1.0 - float(competitor) / best)))))
+
+
+def classify_hits(psls):
+    """ Classify the hits of a query.
+
+    :param psls: List of PslRecord objects of the same query.
+    :returns: List of (flag, mapq) pairs in input order, the flag holds the secondary/supplementary bits only.
+    :rtype: list
+    """
+    scores = [score(psl) for psl in psls]
+    # Best first, ties broken by input order:
+    order = sorted(xrange(len(psls)), key=lambda i: -scores[i])
+    representative = []  # Primary and supplementary hits
+    secondary = []
+    for i in order:
+        psl = psls[i]
+        length = max(psl.qEnd - psl.qStart, 1)
+        covered = sum(_overlap(psl.qStart, psl.qEnd, psls[j].qStart, psls[j].qEnd) for j in representative)
+        if len(representative) == 0 or covered < MAX_OVERLAP * length:
+            representative.append(i)
+        else:
+            secondary.append(i)
+
+    result = [None] * len(psls)
+    for rank, i in enumerate(representative):
+        psl = psls[i]
+        competitors = [scores[j] for j in secondary
+                       if _overlap(psl.qStart, psl.qEnd, psls[j].qStart, psls[j].qEnd) > 0]
+        result[i] = (FLAG_SUPPLEMENTARY if rank > 0 else 0,
+                     _mapq(scores[i], max(competitors) if len(competitors) > 0 else None))
+    for i in secondary:
+        result[i] = (FLAG_SECONDARY, 0)
+    return result
+
+
+def _nm(tags):
+    """ Get edit distance from the tags of a record. """
+    for tag in tags.split("\t"):
+        if tag.startswith('NM:i:'):
+            return tag[5:]
+    return '0'
+
+
+def annotate_hits(psls, sams):
+    """ Set flags, mapping qualities and SA tags of the SAM records converted from the hits of a query.
+
+    :param psls: List of PslRecord objects of the same query.
+    :param sams: List of SamRecord objects converted from the PSL records.
+    :returns: None
+    """
+    classes = classify_hits(psls)
+    for sam, (flag, mapq) in zip(sams, classes):
+        sam.flag |= flag
+        sam.mapq = mapq
+    chimeric = [sam for sam, (flag, _) in zip(sams, classes) if flag & FLAG_SECONDARY == 0]
+    if len(chimeric) < 2:
+        return
+    parts = ["{},{},{},{},{},{};".format(sam.rname, sam.pos, '-' if sam.flag & FLAG_REVERSE else '+', sam.cigar,
+                                         sam.mapq, _nm(sam.tags)) for sam in chimeric]
+    for i, sam in enumerate(chimeric):
+        sam.tags += "\tSA:Z:" + ''.join(parts[:i] + parts[i + 1:])
+
+
+def iter_query_groups(psls):
+    """ Group consecutive PSL records by query name.
+
+    :param psls: Iterable of PslRecord objects.
+    :returns: Generator of lists of PslRecord objects.
+    """
+    for _, group in itertools.groupby(psls, key=lambda psl: psl.qName):
+        yield list(group)
+
+
+def line_query(line):
+    """ Get query name from a PSL line split at any whitespace, like psl2sam._iter_fields (None for lines with less
+    than 11 fields). """
+    fields = line.split(None, 10)
+    return fields[9] if len(fields) > 10 else None
+
+
+def check_grouped(lines):
+    """ Pass on PSL lines, raising an exception if the lines of a query are not consecutive. The names of the
+    queries seen so far are kept in memory.
+
+    :param lines: Iterable of PSL lines.
+    :returns: Generator of PSL lines.
+    """
+    seen = set()
+    last = None
+    for line in lines:
+        # Records start with the number of matches, the header lines do not:
+        query = line_query(line) if line.lstrip()[:1].isdigit() else None
+        if query is not None and query != last:
+            if query in seen:
+                raise Exception('The PSL records are not grouped by query name, hits of {} found after those of '
+                                'other queries (partition the input first, e.g. --unsorted).'.format(query))
+            seen.add(query)
+            last = query
+        yield line
+
+
+def partition_by_query(lines, partitions=DEFAULT_PARTITIONS, tmp_dir=None):
+    """ Reorder PSL lines so that the lines of a query are consecutive, using temporary partition files.
+
+    :param lines: Iterable of PSL lines.
+    :param partitions: Number of partitions. Memory usage is bounded by the size of the largest partition, about
+    the size of the input divided by the number of partitions.
+    :param tmp_dir: Directory of the temporary files (default: system temporary directory).
+    :returns: Generator of PSL lines grouped by query name. Lines without a query name (header and malformed lines)
+    are passed on in the first partition, so that the parser can skip and count them.
+    """
+    handles = [tempfile.TemporaryFile(prefix='uncle_psl_part', dir=tmp_dir) for _ in xrange(partitions)]
+    try:
+        for line in lines:
+            query = line_query(line)
+            if not line.endswith("\n"):
+                line += "\n"
+            handles[zlib.crc32(query) % partitions if query is not None else 0].write(line)
+        for handle in handles:
+            handle.seek(0)
+            groups = OrderedDict()
+            for line in handle:
+                groups.setdefault(line_query(line), []).append(line)
+            handle.close()
+            for group in groups.itervalues():
+                for line in group:
+                    yield line
+    finally:
+        for handle in handles:
+            handle.close()
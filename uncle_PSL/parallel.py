@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Process pool helpers for converting chunks of PSL lines in parallel, and thread helpers for running the
+reading, conversion and writing stages as a pipeline. """
+
+import itertools
+import multiprocessing
+import Queue
+import sys
+import threading
+import traceback
+
+DEFAULT_CHUNK_SIZE = 5000
+# Number of chunks or record batches held in a queue between pipeline stages:
+DEFAULT_QUEUE_SIZE = 8
+# Interval in seconds of checking for failed and killed workers while waiting for results:
+POLL_INTERVAL = 0.5
+
+# State shared with the workers. It is set in the parent before the pool is created,
+# so forked workers inherit it without pickling (e.g. the reads index is not rebuilt):
+_worker_state = {}
+
+
+def worker_state(key):
+    """ Get a value from the state shared with worker processes.
+
+    :param key: Name of the value.
+    :returns: The shared value.
+    """
+    return _worker_state[key]
+
+
+def iter_chunks(handle, chunk_size=DEFAULT_CHUNK_SIZE, key=None):
+    """ Split lines from a handle into lists of lines.
+
+    :param handle: File handle or iterable of lines.
+    :param chunk_size: Number of lines in a chunk.
+    :param key: Function of a line. If given, a chunk is extended until the key changes, so that consecutive
+    lines with the same key end up in the same chunk.
+    :returns: Generator of lists of lines.
+    """
+    handle = iter(handle)
+    carry = []
+    while True:
+        chunk = carry + list(itertools.islice(handle, chunk_size))
+        carry = []
+        if len(chunk) == 0:
+            return
+        if key is not None:
+            last = key(chunk[-1])
+            for line in handle:
+                if key(line) != last:
+                    carry = [line]
+                    break
+                chunk.append(line)
+        yield chunk
+
+
+def _producer(items, queue):
+    """ Put items on a queue, ending with None (or an exception). """
+    try:
+        for item in items:
+            queue.put((item,))
+        queue.put(None)
+    except Exception:
+        queue.put(sys.exc_info())
+
+
+def prefetch(items, queue_size=DEFAULT_QUEUE_SIZE):
+    """ Iterate over items produced on a separate thread, e.g. chunks of lines read from slow storage.
+
+    The thread starts on the first iteration and blocks when queue_size items are waiting.
+
+    :param items: Iterable of items.
+    :param queue_size: Maximum number of items read ahead.
+    :returns: Generator of items.
+    """
+    queue = Queue.Queue(queue_size)
+    thread = threading.Thread(target=_producer, args=(items, queue))
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        if len(item) > 1:
+            raise item[0], item[1], item[2]
+        yield item[0]
+    thread.join()
+
+
+class BackgroundConsumer:
+
+    """ Pass items to a function on a separate thread, e.g. batches of records to a writer.
+
+    Putting an item blocks when queue_size items are waiting, so a slow consumer throttles the producer.
+    """
+
+    def __init__(self, func, queue_size=DEFAULT_QUEUE_SIZE):
+        """ Initialise background consumer object and start its thread.
+
+        :param func: Function called with each item.
+        :param queue_size: Maximum number of items waiting.
+        """
+        self.func = func
+        self.queue = Queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._consume)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _consume(self):
+        """ Consume items until None. After an error, the items are dropped so that put does not block. """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    self.func(item)
+                except Exception:
+                    self.error = sys.exc_info()
+
+    def _check(self):
+        """ Re-raise an exception of the consumer thread. """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    def put(self, item):
+        """Queue an item for the consumer.
+
+        :param self: object
+        :param item: Item.
+        :returns: None
+        """
+        self._check()
+        self.queue.put(item)
+
+    def close(self):
+        """Wait until all items are consumed.
+
+        :param self: object
+        :returns: None
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+
+def _reopen_reads(reads):
+    """ Give a worker its own file handle on an inherited Biopython index.
+
+    The forked workers would otherwise share the file offset of the handle and race on seek/read.
+    """
+    proxy = getattr(reads, '_proxy', None)
+    if proxy is not None and hasattr(proxy, '_handle'):
+        proxy._handle = open(proxy._handle.name, 'rb')
+
+
+def _init_worker():
+    """ Initialise worker process. """
+    _reopen_reads(_worker_state.get('reads'))
+
+
+def _run_chunk(func, index, chunk):
+    """ Run function on a chunk, return exceptions as formatted strings. """
+    try:
+        return index, None, func(chunk)
+    except Exception:
+        return index, traceback.format_exc(), None
+
+
+def _next_result(pool, results, async_results, workers):
+    """ Wait for the next result, polling so that lost chunks are detected and the wait can be interrupted.
+
+    A chunk is lost without calling the callback if its result can not be sent back (e.g. fails to pickle) or if
+    its worker is killed (e.g. out of memory), the pool then replaces the worker.
+    """
+    while True:
+        try:
+            return results.get(timeout=POLL_INTERVAL)
+        except Queue.Empty:
+            pass
+        for async_result in async_results.values():
+            if async_result.ready() and not async_result.successful():
+                try:
+                    async_result.get()
+                except Exception as e:
+                    raise RuntimeError('Worker process failed to return a result: {!r}'.format(e))
+        if set(process.pid for process in pool._pool) != workers or \
+                any(process.exitcode is not None for process in pool._pool):
+            raise RuntimeError('Worker process died, a chunk of the input was lost.')
+
+
+def map_chunks(func, chunks, state, processes, ordered=True, max_pending=None):
+    """ Apply function to chunks in a pool of worker processes.
+
+    :param func: Module level function taking a chunk as its only argument.
+    :param chunks: Iterable of chunks.
+    :param state: Dictionary of values shared with the workers, accessed through worker_state.
+    :param processes: Number of worker processes.
+    :param ordered: Yield results in the order of the input chunks if true.
+    :param max_pending: Maximum number of chunks in flight (default: four times the number of processes).
+    :returns: Generator of results.
+    """
+    if max_pending is None:
+        max_pending = 4 * processes
+    _worker_state.clear()
+    _worker_state.update(state)
+
+    results = Queue.Queue()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    workers = set(process.pid for process in pool._pool)
+    # Pending results by chunk index:
+    async_results = {}
+    try:
+        # Results which arrived ahead of their turn:
+        waiting = {}
+        next_index = 0
+        submitted = 0
+        in_flight = 0
+        chunks = iter(chunks)
+        exhausted = False
+        while not exhausted or in_flight > 0:
+            # Keep the workers busy, but bound the number of chunks held in memory:
+            while not exhausted and in_flight + len(waiting) < max_pending:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                async_results[submitted] = pool.apply_async(_run_chunk, (func, submitted, chunk),
+                                                            callback=results.put)
+                submitted += 1
+                in_flight += 1
+            if in_flight == 0:
+                break
+            index, error, result = _next_result(pool, results, async_results, workers)
+            del async_results[index]
+            in_flight -= 1
+            if error is not None:
+                raise RuntimeError('Worker process failed:\n{}'.format(error))
+            if not ordered:
+                yield result
+                continue
+            waiting[index] = result
+            while next_index in waiting:
+                yield waiting.pop(next_index)
+                next_index += 1
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _worker_state.clear()
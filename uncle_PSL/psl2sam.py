@@ -9,54 +9,47 @@
 # Reference on the PSL format: http://www.ensembl.org/info/website/upload/psl.html
 # Reference on the SAM format: https://samtools.github.io/hts-specs/SAMv1.pdf
 
-from collections import OrderedDict
+from collections import deque
+from cStringIO import StringIO
+import functools
 import itertools
 
-from uncle_PSL.sam_writer import SamWriter
-from uncle_PSL.seq_util import reverse_complement
-
-
-def _prepare_psl_dict():
-    """ Create and empty structure to hold PSL records. """
-    fields_text = """matches
-misMatches
-repMatches
-nCount
-qNumInsert
-qBaseInsert
-tNumInsert
-tBaseInsert
-strand
-qName
-qSize
-qStart
-qEnd
-tName
-tSize
-tStart
-tEnd
-blockCount
-blockSizes
-qStarts
-tStarts"""
-    fields = fields_text.split("\n")
-    fields_dict = OrderedDict()
-    for field in fields:
-        fields_dict[field] = None
-    return fields_dict
-
-
-def _iter_fields(handle, nr_fields=21):
-    """ Iterate over lines in PSL file. """
+from uncle_PSL import multi_hit
+from uncle_PSL import parallel
+from uncle_PSL.bam_writer import BamRecordBuffer, BamWriter
+from uncle_PSL.md_tag import compare_blocks, md_nm
+from uncle_PSL.read_cache import ReadCache, read_sequence
+from uncle_PSL.read_stream import ReadStream
+from uncle_PSL.records import FIELD_COUNTS, PslRecord
+from uncle_PSL.sam_writer import DEFAULT_BUFFER_SIZE, LONG_FIELD_SIZE, SamWriter
+from uncle_PSL.seq_util import UnknownBaseCounter, reverse_complement
+from uncle_PSL.stats import CountingHandle, Stats, clock
+
+# Number of converted records passed to the writer at a time:
+WRITE_BATCH_SIZE = 1000
+
+
+def _is_header(line):
+    """ Check if line is part of the psLayout header or blank. """
+    stripped = line.strip()
+    return len(stripped) == 0 or stripped.startswith(('psLayout', 'match', '---'))
+
+
+def _iter_fields(handle, nr_fields=FIELD_COUNTS, stats=None):
+    """ Iterate over lines in PSL (or pslx) file, counting the skipped malformed lines if a Stats object is given. """
     for line in handle:
         fields = line.split()
-        if len(fields) != nr_fields:
+        if len(fields) not in nr_fields:
+            if stats is not None and not _is_header(line):
+                stats.count('skipped_lines')
             continue
         yield fields
 
 
-def _generate_cigar(qStart, blockSizes, qStarts, tStarts, blockCount, qSize, qEnd, strand, soft_clip=True, n_limit=None):
-    """ Construct CIGAR string from PSL record information. See the psl_rec2sam_rec function for the arguments. """
+def _generate_cigar(qStart, blockSizes, qStarts, tStarts, blockCount, qSize, qEnd, strand, soft_clip=True, n_limit=None,
+                    junctions=None):
+    """ Construct CIGAR string from PSL record information. See the psl_rec2sam_rec function for the arguments. The
+    (start, end) target intervals of the N operations are appended to the junctions list if given. """
     # Construct the CIGAR string, here we go:
     cigar = []
     indels = 0
@@ -82,6 +75,8 @@ def _generate_cigar(qStart, blockSizes, qStarts, tStarts, blockCount, qSize, qEn
             # Use N operation if deleltion is larger than limit:
             if (n_limit is not None) and (deletion >= n_limit):
                 del_op = 'N'
+                if junctions is not None:
+                    junctions.append((tStarts[i - 1] + bs, tStarts[i]))
             cigar.append("{}{}".format(deletion, del_op))
         indels += deletion
         indels += insertion
@@ -100,16 +95,17 @@ def _generate_cigar(qStart, blockSizes, qStarts, tStarts, blockCount, qSize, qEn
     return cigar, indels
 
 
-def _extract_segment_info(psl, qSize, tSize):
+def _extract_segment_info(psl, target_strand):
     """ Extract and process aligned segment information. """
     # Extract segement information:
-    blockCount = int(psl['blockCount'])
-    blockSizes = [int(bs) for bs in psl['blockSizes'].split(',') if len(bs) > 0]
-    qStarts = [int(qs) for qs in psl['qStarts'].split(',') if len(qs) > 0]
-    tStarts = [int(ts) for ts in psl['tStarts'].split(',') if len(ts) > 0]
+    blockCount = psl.blockCount
+    blockSizes = [int(bs) for bs in psl.blockSizes.split(',') if len(bs) > 0]
+    qStarts = [int(qs) for qs in psl.qStarts.split(',') if len(qs) > 0]
+    tStarts = [int(ts) for ts in psl.tStarts.split(',') if len(ts) > 0]
+    qSize, tSize = psl.qSize, psl.tSize
 
-    # Reverse and transform segment information if strand is '-':
-    if psl['strand'][1] == '-':
+    # Reverse and transform segment information if target strand is '-':
+    if target_strand == '-':
         blockSizes = blockSizes[::-1]
         qStarts = qStarts[::-1]
         tStarts = tStarts[::-1]
@@ -120,86 +116,496 @@ def _extract_segment_info(psl, qSize, tSize):
     return blockCount, blockSizes, qStarts, tStarts
 
 
-def psl_rec2sam_rec(psl, sam_writer, reads, soft_clip, n_limit):
+def _clip(seq, five_clip, three_clip):
+    """ Hard clip a sequence, as a buffer view instead of a copy for long sequences. """
+    if len(seq) < LONG_FIELD_SIZE:
+        seq = seq[five_clip:]
+        return seq[:len(seq) - three_clip]
+    start = min(five_clip, len(seq))
+    return buffer(seq, start, max(0, len(seq) - start - three_clip))
+
+
+def _pslx_blocks(psl, target_strand, blockSizes):
+    """ Get the query and target block sequences of a pslx record in target orientation and upper case (None if
+    they do not match the block sizes, e.g. for protein alignments). """
+    q_blocks = [seq for seq in psl.qSeqs.upper().split(',') if len(seq) > 0]
+    t_blocks = [seq for seq in psl.tSeqs.upper().split(',') if len(seq) > 0]
+    if target_strand == '-':
+        q_blocks = [reverse_complement(seq) for seq in reversed(q_blocks)]
+        t_blocks = [reverse_complement(seq) for seq in reversed(t_blocks)]
+    sizes = [len(seq) for seq in q_blocks]
+    if sizes != blockSizes or [len(seq) for seq in t_blocks] != blockSizes:
+        return None, None
+    return q_blocks, t_blocks
+
+
+def _pslx_sequence(q_blocks, blockSizes, qStarts, qSize, soft_clip):
+    """ Build the (hard clipped) read sequence from the query blocks of a pslx record. The bases of insertions and
+    soft clipped flanks are not part of pslx records, so the sequence is '*' if any of them are needed. """
+    contiguous = all(qStarts[i] == qStarts[i - 1] + blockSizes[i - 1] for i in xrange(1, len(qStarts)))
+    if not contiguous or (soft_clip and (qStarts[0] != 0 or qStarts[-1] + blockSizes[-1] != qSize)):
+        return '*'
+    return ''.join(q_blocks)
+
+
+def _timed_read_sequence(reads, name, strand, unknown_bases, stats):
+    """ Get (reverse complemented) read sequence and qualities, timing the lookup and the reverse complement. """
+    start = clock()
+    if isinstance(reads, ReadCache):
+        read = reads.oriented(name, strand == '-', unknown_bases)
+        stats.add_time('reads_lookup', clock() - start)
+        if read is None:
+            stats.count('missing_reads')
+            return '*', None
+        return read
+    if name not in reads:
+        stats.count('missing_reads')
+        stats.add_time('reads_lookup', clock() - start)
+        return '*', None
+    seq, qual = read_sequence(reads, name)
+    if strand == '-':
+        middle = clock()
+        stats.add_time('reads_lookup', middle - start)
+        seq = reverse_complement(seq, unknown_bases)
+        qual = qual[::-1] if qual is not None else None
+        stats.add_time('reverse_complement', clock() - middle)
+    else:
+        stats.add_time('reads_lookup', clock() - start)
+    return seq, qual
+
+
+def psl_rec2sam_rec(psl, sam_writer, reads, soft_clip, n_limit, unknown_bases=None, stats=None, reference=None,
+                    splice_junctions=None):
     """ Convert PSL record to SAM record.
 
-    :param psl: OrderedDict with PSL records.
+    :param psl: PslRecord object.
     :param sam_writer: SamWriter object.
-    :param reads: Input reads as dictionary of SeqRecord objects.
+    :param reads: Input reads as dictionary of SeqRecord objects or sequence strings (e.g. FastaStore). If None, the
+    sequence of pslx records is built from their query blocks.
     :param soft_clip: Soft clip if true.
     :param n_limit: Deletion size limit for using N operation.
+    :param unknown_bases: UnknownBaseCounter object counting bases without complement.
+    :param stats: Stats object collecting per-stage timings and counts (None: disabled).
+    :param reference: ReferenceWindows object for computing exact MD and NM tags (None: no MD, estimated NM). The tags
+    of pslx records are computed from their target blocks, with the deleted bases taken from the reference.
+    :param splice_junctions: SpliceJunctions object for setting the XS tag of spliced records (None: no XS).
     :returns: SAM record.
-    :rtype: OrderedDict.
+    :rtype: SamRecord
     """
     # Figure out strand:
-    if len(psl['strand']) == 1:
-        strand = psl['strand']  # Not sure if this is sane!
-        psl['strand'] = psl['strand'] + '+'  # Assume +
-    if len(psl['strand']) == 2:
-        strand = '+' if all(x == list(psl['strand'])[0] for x in list(psl['strand'])) else '-'
+    if len(psl.strand) == 1:
+        strand = psl.strand  # Not sure if this is sane!
+        target_strand = '+'  # Assume +
+    elif len(psl.strand) == 2:
+        strand = '+' if psl.strand[0] == psl.strand[1] else '-'
+        target_strand = psl.strand[1]
     else:
-        raise Exception('Invalid strand field in record: {}'.format(psl['qName']))
+        raise Exception('Invalid strand field in record: {}'.format(psl.qName))
 
-    # Type conversion of coordinates:
-    qStart, qEnd = int(psl['qStart']), int(psl['qEnd'])
-    tStart, tEnd = int(psl['tStart']), int(psl['tEnd'])
-    qSize, tSize = int(psl['qSize']), int(psl['tSize'])
+    qStart, qEnd = psl.qStart, psl.qEnd
+    qSize, tSize = psl.qSize, psl.tSize
 
     # Transform start and end coordinates if strand is '-':
     if strand == '-':
-        qStart = qSize - qEnd
-        qEnd = qSize - int(psl['qStart'])
+        qStart = qSize - psl.qEnd
+        qEnd = qSize - psl.qStart
+
+    if stats is not None:
+        stats.count('records')
+        if strand == '-':
+            stats.count('minus_strand')
+        start = clock()
 
     # Extract segement information:
-    blockCount, blockSizes, qStarts, tStarts = _extract_segment_info(psl, qSize, tSize)
+    blockCount, blockSizes, qStarts, tStarts = _extract_segment_info(psl, target_strand)
 
     # Generate CIGAR:
+    junctions = [] if splice_junctions is not None else None
     cigar, indels = _generate_cigar(
-        qStart, blockSizes, qStarts, tStarts, blockCount, qSize, qEnd, strand, soft_clip, n_limit)
+        qStart, blockSizes, qStarts, tStarts, blockCount, qSize, qEnd, strand, soft_clip, n_limit, junctions)
     cigar_string = ''.join(cigar)
-    NM = indels + int(psl['misMatches']) + int(psl['nCount'])
+    NM = indels + psl.misMatches + psl.nCount
+    if stats is not None:
+        stats.add_time('cigar', clock() - start)
 
     # Construct SAM record:
     flag = 0 if strand == '+' else 16  # Strand flag
-    # Construct sequence:
-    seq = '*'
-    if reads is not None and psl['qName'] in reads:
-        seq = str(reads[psl['qName']].seq)
+    # Construct sequence and base qualities:
+    seq, qual = '*', None
+    q_blocks, t_blocks = None, None
+    if psl.qSeqs is not None:
+        q_blocks, t_blocks = _pslx_blocks(psl, target_strand, blockSizes)
+    if reads is None and q_blocks is not None:
+        # Already hard clipped:
+        seq = _pslx_sequence(q_blocks, blockSizes, qStarts, qSize, soft_clip)
+        if seq == '*' and stats is not None:
+            stats.count('pslx_missing_bases')
+    elif reads is not None and stats is not None:
+        seq, qual = _timed_read_sequence(reads, psl.qName, strand, unknown_bases, stats)
+    elif isinstance(reads, ReadCache):
+        seq, qual = reads.oriented(psl.qName, strand == '-', unknown_bases) or ('*', None)
+    elif reads is not None and psl.qName in reads:
+        seq, qual = read_sequence(reads, psl.qName)
         if strand == '-':
-            seq = reverse_complement(seq)
-    # Deal with hard clipping (code could be cleaner):
-    # Clip 5':
-    first_op = cigar[0]
-    if first_op[-1] == 'H':
-        seq = seq[int(first_op[:-1]):]
-    last_op = cigar[-1]
-    # Clip 3':
-    if last_op[-1] == 'H':
-        seq = seq[:len(seq) - int(last_op[:-1])]
-
-    sam = sam_writer.new_sam_record(qname=psl['qName'], flag=flag, rname=psl['tName'], pos=int(psl['tStart']) + 1,
-                                    mapq=0, cigar=cigar_string, rnext='*', pnext=0, tlen=0, seq=seq, qual='*', tags='NM:i:{}'.format(NM))
+            seq = reverse_complement(seq, unknown_bases)
+            qual = qual[::-1] if qual is not None else None
+    tags = 'NM:i:{}'.format(NM)
+    # Compare aligned blocks to the reference:
+    if reference is not None and len(seq) == qSize:
+        if stats is not None:
+            start = clock()
+        MD, NM = md_nm(seq, reference, psl.tName, blockSizes, qStarts, tStarts, blockCount, n_limit)
+        tags = 'NM:i:{}\tMD:Z:{}'.format(NM, MD)
+        if stats is not None:
+            stats.add_time('md', clock() - start)
+    elif t_blocks is not None:
+        if stats is not None:
+            start = clock()
+        deleted = functools.partial(reference.fetch, psl.tName) if reference is not None else None
+        MD, NM = compare_blocks(''.join(q_blocks), ''.join(t_blocks), blockSizes, qStarts, tStarts, blockCount,
+                                n_limit, deleted)
+        tags = 'NM:i:{}'.format(NM) if MD is None else 'NM:i:{}\tMD:Z:{}'.format(NM, MD)
+        if stats is not None:
+            stats.add_time('md', clock() - start)
+    # Transcript strand from the splice motifs:
+    if junctions:
+        if stats is not None:
+            start = clock()
+        xs = splice_junctions.xs_strand(psl.tName, junctions)
+        if xs is not None:
+            tags += '\tXS:A:' + xs
+        if stats is not None:
+            stats.add_time('splice', clock() - start)
+    # Deal with hard clipping, 5' and 3':
+    if not soft_clip and (reads is not None or q_blocks is None):
+        seq = _clip(seq, qStart, qSize - qEnd)
+        qual = _clip(qual, qStart, qSize - qEnd) if qual is not None else None
+
+    sam_writer.add_reference(psl.tName, tSize)
+    sam = sam_writer.new_sam_record(qname=psl.qName, flag=flag, rname=psl.tName, pos=psl.tStart + 1,
+                                    mapq=0, cigar=cigar_string, rnext='*', pnext=0, tlen=0, seq=seq, qual=qual if qual is not None else '*', tags=tags)
     return sam
 
 
-def psl2sam(psl_handle, out_handle, reads, soft_clip=True, n_limit=None):
+def _iter_records(psl_handle, stats=None):
+    """ Iterate over PslRecord objects, timing the parsing if a Stats object is given. """
+    records = (PslRecord(fields) for fields in _iter_fields(psl_handle, stats=stats))
+    if stats is not None:
+        records = stats.timed_iter('parse', records)
+    return records
+
+
+def _write_batch(sam_writer, batch, stats=None):
+    """ Write batch of records, timing the writing if a Stats object is given. """
+    if stats is None:
+        sam_writer.write_many(batch)
+        return
+    start = clock()
+    sam_writer.write_many(batch)
+    stats.add_time('write', clock() - start)
+
+
+def _convert_records(psl_handle, sam_writer, reads, soft_clip, n_limit, unknown_bases=None, stats=None,
+                     reference=None, multi_hits=False, write_batch=_write_batch, splice_junctions=None):
+    """ Convert PSL lines from an iterable and write them using a SamWriter object (or hand the batches of records
+    to write_batch). """
+    batch = []
+    if multi_hits:
+        # Convert the hits of a query together:
+        for psls in multi_hit.iter_query_groups(_iter_records(psl_handle, stats)):
+            sams = [psl_rec2sam_rec(psl, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                                    splice_junctions) for psl in psls]
+            multi_hit.annotate_hits(psls, sams)
+            batch.extend(sams)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                write_batch(sam_writer, batch, stats)
+                batch = []
+        write_batch(sam_writer, batch, stats)
+        return
+    # Iterate PSL records:
+    for psl in _iter_records(psl_handle, stats):
+        # Convert PSL -> SAM:
+        batch.append(psl_rec2sam_rec(psl, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats,
+                                     reference, splice_junctions))
+        # Hand over records to the writer in batches:
+        if len(batch) >= WRITE_BATCH_SIZE:
+            write_batch(sam_writer, batch, stats)
+            batch = []
+    write_batch(sam_writer, batch, stats)
+
+
+def _convert_pipelined(psl_handle, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                       multi_hits, chunk_size, splice_junctions=None):
+    """ Convert PSL lines with reading, conversion and writing running on separate threads, connected by bounded
+    queues of chunks of lines and batches of records. """
+    writer = parallel.BackgroundConsumer(lambda batch: _write_batch(sam_writer, batch, stats))
+
+    def queue_batch(_, batch, __):
+        if len(batch) > 0:
+            writer.put(batch)
+
+    try:
+        chunks = parallel.prefetch(
+            parallel.iter_chunks(psl_handle, chunk_size, key=multi_hit.line_query if multi_hits else None))
+        for lines in chunks:
+            _convert_records(lines, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                             multi_hits, queue_batch, splice_junctions)
+    finally:
+        writer.close()
+
+
+def iter_sam_records(psl_source, reads=None, soft_clip=True, n_limit=None, reference=None, multi_hits=False,
+                     read_cache_size=None, chunk_size=parallel.DEFAULT_CHUNK_SIZE, stats=None, splice_junctions=None):
+    """ Convert PSL data into SAM records in the calling process, without formatting them.
+
+    :param psl_source: File handle or iterable of PSL lines.
+    :param reads: Input reads, see psl2sam.
+    :param soft_clip: Soft clip if true.
+    :param n_limit: Deletion size limit for using N operation.
+    :param reference: ReferenceWindows object for computing exact MD and NM tags (None: no MD, estimated NM).
+    :param multi_hits: Set primary/secondary/supplementary flags, MAPQ and SA tags from the hits of each query (PSL
+    records grouped by query name, an exception is raised otherwise).
+    :param read_cache_size: Size of the LRU read cache in bytes (None: no cache).
+    :param chunk_size: Number of PSL lines converted at a time.
+    :param stats: Stats object collecting per-stage timings and counts (None: disabled).
+    :param splice_junctions: SpliceJunctions object for setting the XS tag of spliced records (None: no XS).
+    :returns: Generator of lists of SamRecord objects in input order.
+    """
+    if read_cache_size is not None and reads is not None:
+        reads = ReadCache(reads, read_cache_size)
+    # Only collects the references, nothing is written:
+    sam_writer = SamWriter(None)
+    unknown_bases = UnknownBaseCounter()
+    batches = []
+
+    def collect_batch(_, batch, __):
+        if len(batch) > 0:
+            batches.append(batch)
+
+    if multi_hits:
+        psl_source = multi_hit.check_grouped(psl_source)
+    for lines in parallel.iter_chunks(psl_source, chunk_size, key=multi_hit.line_query if multi_hits else None):
+        _convert_records(lines, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference, multi_hits,
+                         collect_batch, splice_junctions)
+        for batch in batches:
+            yield batch
+        del batches[:]
+    if stats is not None:
+        if isinstance(reads, ReadCache):
+            stats.count('read_cache_hits', reads.hits)
+            stats.count('read_cache_misses', reads.misses)
+        stats.count('unknown_bases', unknown_bases.count)
+    unknown_bases.warn()
+
+
+def _convert_checkpointed(psl_handle, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                          multi_hits, chunk_size, checkpointer, splice_junctions=None):
+    """ Convert PSL lines chunk by chunk, saving a checkpoint when one is due after a chunk is written. """
+    written = []
+
+    def count_batch(sam_writer, batch, stats):
+        written.append(len(batch))
+        _write_batch(sam_writer, batch, stats)
+
+    for lines in parallel.iter_chunks(psl_handle, chunk_size, key=multi_hit.line_query if multi_hits else None):
+        _convert_records(lines, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference, multi_hits,
+                         count_batch, splice_junctions)
+        if checkpointer.advance(sum(len(line) for line in lines), sum(written)):
+            sam_writer.flush()
+            checkpointer.save()
+        del written[:]
+
+
+def _iter_chunk_sizes(chunks, sizes):
+    """ Pass on chunks of lines, appending their sizes in bytes to a deque. """
+    for lines in chunks:
+        sizes.append(sum(len(line) for line in lines))
+        yield lines
+
+
+def _convert_chunk(chunk):
+    """ Convert a chunk of PSL lines in a worker process. The chunk holds the lines and the reads of the chunk, or
+    None if the worker uses the shared reads index.
+
+    :returns: SAM text (or encoded BAM records) with the references, the number of bases without complement, the
+    statistics dictionary (or None) and the junction read counts (or None).
+    """
+    if parallel.worker_state('bam'):
+        sam_writer = BamRecordBuffer()
+    else:
+        out_buffer = StringIO()
+        sam_writer = SamWriter(out_buffer)
+    lines, reads = chunk
+    if reads is None:
+        reads = parallel.worker_state('reads')
+    elif parallel.worker_state('read_cache_size') is not None:
+        reads = ReadCache(reads, parallel.worker_state('read_cache_size'))
+    unknown_bases = UnknownBaseCounter()
+    stats = Stats() if parallel.worker_state('stats') else None
+    cache_counts = (reads.hits, reads.misses) if isinstance(reads, ReadCache) else None
+    splice_junctions = parallel.worker_state('splice_junctions')
+    _convert_records(lines, sam_writer, reads,
+                     parallel.worker_state('soft_clip'), parallel.worker_state('n_limit'), unknown_bases, stats,
+                     parallel.worker_state('reference'), parallel.worker_state('multi_hits'),
+                     splice_junctions=splice_junctions)
+    junction_counts = None
+    if splice_junctions is not None and splice_junctions.counts is not None:
+        # The counts of the worker are sent with each chunk and merged in the parent:
+        junction_counts = splice_junctions.counts.items()
+        splice_junctions.counts.clear()
+    if stats is not None:
+        if cache_counts is not None:
+            # The cache of the shared reads lives as long as the worker, so count the lookups of this chunk only:
+            stats.count('read_cache_hits', reads.hits - cache_counts[0])
+            stats.count('read_cache_misses', reads.misses - cache_counts[1])
+        stats = stats.as_dict()
+    if parallel.worker_state('bam'):
+        return sam_writer.getvalue(), unknown_bases.count, stats, junction_counts
+    return (out_buffer.getvalue(), sam_writer.references.items()), unknown_bases.count, stats, junction_counts
+
+
+def psl2sam(psl_handle, out_handle, reads, soft_clip=True, n_limit=None, processes=None, ordered=True,
+            chunk_size=parallel.DEFAULT_CHUNK_SIZE, bam=False, bam_threads=1, buffer_size=DEFAULT_BUFFER_SIZE,
+            stats=None, header=None, reference=None, sort_memory=None, multi_hits=False, partitions=None,
+            read_cache_size=None, pipeline=False, checkpointer=None, splice_junctions=None):
     """ Convert PSL data (BLAT output) into SAM format.
 
     :param psl_handle: File handle for reading PSL data.
     :param out_handle: File handle to write SAM output.
-    :param reads: Input reads as dictionary of SeqRecord objects.
+    :param reads: Input reads as dictionary of SeqRecord objects or sequence strings (e.g. FastaStore), or a
+    ReadStream of reads in the order of the PSL records. If None, the sequences of pslx records are built from
+    their query blocks.
     :param soft_clip: Soft clip if true.
     :param n_limit: Deletion size limit for using N operation.
+    :param processes: Number of worker processes (None or 1 means conversion in the calling process).
+    :param ordered: Keep the order of input records when using multiple processes.
+    :param chunk_size: Number of PSL lines sent to a worker at a time.
+    :param bam: Write BAM output if true.
+    :param bam_threads: Number of BGZF compression threads.
+    :param buffer_size: Size of the SAM output buffer (None: write records one by one).
+    :param stats: Stats object collecting per-stage timings and counts (None: disabled).
+    :param header: SAM header structure (None: no header in SAM output). If it has no @SQ records, they are collected
+    from the target columns of the PSL records and the output is spooled to a temporary file until the end.
+    :param reference: ReferenceWindows object for computing exact MD and NM tags (None: no MD, estimated NM).
+    :param sort_memory: Sort output by coordinate, keeping runs of this many bytes in memory before spilling them to
+    temporary files (None: input order).
+    :param multi_hits: Set primary/secondary/supplementary flags, MAPQ and SA tags from the hits of each query. The
+    PSL records must be grouped by query name, unless partitions is given (an exception is raised otherwise).
+    :param partitions: Group the PSL records by query name through this many temporary partition files first.
+    :param read_cache_size: Keep recently used reads in both orientations in an LRU cache of this many bytes
+    (None: no cache).
+    :param pipeline: Read the input and write the output on separate threads, overlapping them with the conversion.
+    :param checkpointer: Checkpointer object saving checkpoints of the conversion (None: no checkpoints). It needs
+    SAM output in input order, with the @SQ records given in the header if there is one. When resuming, the output
+    already holds the header.
+    :param splice_junctions: SpliceJunctions object for setting the XS tag of spliced records (None: no XS). The
+    junctions are N operations, so n_limit has to be given.
     :returns: None
     """
+    if checkpointer is not None:
+        if bam or sort_memory is not None or partitions is not None or pipeline or not ordered or \
+                (header is not None and len(header.get('SQ', [])) == 0):
+            raise Exception('Checkpoints need SAM output in input order, with the @SQ records given in the header.')
+        if checkpointer.resumed:
+            header = None
+        out_handle = checkpointer.wrap(out_handle)
+    if multi_hits and partitions is not None:
+        psl_handle = multi_hit.partition_by_query(psl_handle, partitions)
+    elif multi_hits:
+        psl_handle = multi_hit.check_grouped(psl_handle)
+    if stats is not None:
+        out_handle = CountingHandle(out_handle, stats)
     # Create SamWriter object:
-    sam_writer = SamWriter(out_handle)
-    # Iterate PSL records:
-    for fields in _iter_fields(psl_handle):
-        psl_fields = _prepare_psl_dict()
-        # Fill PSL structure:
-        for pos, key in enumerate(psl_fields.keys()):
-            psl_fields[key] = fields[pos]
-        # Convert PSL -> SAM:
-        sam_rec = psl_rec2sam_rec(psl_fields, sam_writer, reads, soft_clip, n_limit)
-        sam_writer.write(sam_rec)
+    if bam:
+        sam_writer = BamWriter(out_handle, header=header, threads=bam_threads, sort_memory=sort_memory)
+    else:
+        sam_writer = SamWriter(out_handle, header=header, buffer_size=buffer_size, sort_memory=sort_memory)
+    unknown_bases = UnknownBaseCounter()
+    serial = processes is None or processes < 2
+    stream = isinstance(reads, ReadStream)
+    # The reads of a stream are cached per chunk in the workers:
+    if read_cache_size is not None and reads is not None and (serial or not stream):
+        reads = ReadCache(reads, read_cache_size)
+    if serial:
+        if pipeline:
+            _convert_pipelined(psl_handle, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                               multi_hits, chunk_size, splice_junctions)
+        elif checkpointer is not None:
+            _convert_checkpointed(psl_handle, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                                  multi_hits, chunk_size, checkpointer, splice_junctions)
+        else:
+            _convert_records(psl_handle, sam_writer, reads, soft_clip, n_limit, unknown_bases, stats, reference,
+                             multi_hits, splice_junctions=splice_junctions)
+        if stats is not None and isinstance(reads, ReadCache):
+            stats.count('read_cache_hits', reads.hits)
+            stats.count('read_cache_misses', reads.misses)
+        _finish(sam_writer, unknown_bases, stats, checkpointer)
+        return
+
+    # Convert chunks of lines in worker processes, the reads index and its cache are inherited on fork:
+    state = {'reads': None if stream else reads, 'soft_clip': soft_clip, 'n_limit': n_limit, 'bam': bam,
+             'stats': stats is not None, 'reference': reference, 'multi_hits': multi_hits,
+             'read_cache_size': read_cache_size, 'splice_junctions': splice_junctions}
+    # The hits of a query must not be split between chunks:
+    chunks = parallel.iter_chunks(psl_handle, chunk_size, key=multi_hit.line_query if multi_hits else None)
+    if pipeline:
+        chunks = parallel.prefetch(chunks)
+    if checkpointer is not None:
+        # The results are in input order, so the sizes of the chunks are taken in the same order:
+        chunk_sizes = deque()
+        chunks = _iter_chunk_sizes(chunks, chunk_sizes)
+    if stream:
+        # A stream can not be shared, so the reads are sent to the workers with the chunks:
+        chunks = ((lines, reads.fetch_chunk([fields[9] for fields in _iter_fields(lines)])) for lines in chunks)
+    else:
+        chunks = ((lines, None) for lines in chunks)
+    results = parallel.map_chunks(_convert_chunk, chunks, state, processes, ordered)
+    if stats is not None:
+        results = stats.timed_iter('wait_workers', results)
+    if not pipeline:
+        for result in results:
+            _write_result(sam_writer, result, bam, unknown_bases, stats, splice_junctions)
+            if checkpointer is not None and checkpointer.advance(chunk_sizes.popleft(), result[0][0].count("\n")):
+                sam_writer.flush()
+                checkpointer.save()
+        _finish(sam_writer, unknown_bases, stats, checkpointer)
+        return
+    writer = parallel.BackgroundConsumer(lambda result: _write_result(sam_writer, result, bam, unknown_bases, stats,
+                                                                      splice_junctions))
+    try:
+        for result in results:
+            writer.put(result)
+    finally:
+        writer.close()
+    _finish(sam_writer, unknown_bases, stats)
+
+
+def _write_result(sam_writer, result, bam, unknown_bases, stats=None, splice_junctions=None):
+    """ Write the result of a worker process. """
+    result, unknown_count, chunk_stats, junction_counts = result
+    if junction_counts is not None:
+        splice_junctions.merge(junction_counts)
+    if stats is not None:
+        stats.merge(chunk_stats)
+        start = clock()
+    if bam:
+        sam_writer.write_encoded(*result)
+    else:
+        sam_writer.write_formatted(*result)
+    if stats is not None:
+        stats.add_time('write', clock() - start)
+    unknown_bases.count += unknown_count
+
+
+def _finish(sam_writer, unknown_bases, stats=None, checkpointer=None):
+    """ Flush the writer, save the final checkpoint and report the bases without complement. """
+    if stats is None:
+        sam_writer.finish()
+    else:
+        start = clock()
+        sam_writer.finish()
+        stats.add_time('write', clock() - start)
+        stats.count('unknown_bases', unknown_bases.count)
+    if checkpointer is not None:
+        checkpointer.save(complete=True)
+    unknown_bases.warn()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Columnar parsing of PSL data from memory mapped files and large byte buffers.
+
+A chunk of whole lines is parsed into the columnar batches of batch_cigar without splitting lines into Python
+strings: the tab and newline positions are located with numpy, the byte ranges of the integer columns and of the
+comma separated block columns are checked for non-digits and decoded with a single numpy call per column, and only
+the strand and name fields are sliced out.
+
+Lines which are not 21 (or 23, pslx) tab separated fields with valid integers and block lists matching the block
+count are dropped, counting them as skipped lines unless they belong to the psLayout header. The block sequences of
+pslx lines are ignored. If a chunk holds lines with 21 or 23 fields separated by other whitespace, the chunk is
+parsed line by line instead, like psl2sam does.
+"""
+
+import mmap
+import os
+import stat
+
+import numpy as np
+
+from uncle_PSL.batch_cigar import ALL_INT_COLUMNS, BLOCK_COLUMNS, columns_from_fields
+from uncle_PSL.psl2sam import _is_header
+from uncle_PSL.records import FIELD_COUNTS
+
+# Default size of the parsed chunks in bytes:
+DEFAULT_CHUNK_BYTES = 16 << 20
+
+_TAB, _NEWLINE, _RETURN, _COMMA, _ZERO = 9, 10, 13, 44, 48
+_INT_POSITIONS = [pos for _, pos in ALL_INT_COLUMNS]
+# Numeric fields as runs of consecutive columns (first, last): the integers before the strand, between the query
+# name and the target name, and after the target name up to the block lists:
+_RUNS = ((0, 7), (10, 12), (14, 20))
+_BLOCK_POSITIONS = (18, 19, 20)
+# Longest name gathered into a fixed width array, longer names are sliced one by one:
+_MAX_NAME_WIDTH = 256
+
+
+def _in_ranges(size, lows, highs):
+    """ Mark the indices in sorted, non-overlapping [low, high) ranges. """
+    bounds = np.column_stack((lows, highs)).ravel()
+    lengths = np.diff(np.concatenate(([0], bounds, [size])))
+    return np.repeat(np.tile([False, True], len(lows) + 1)[:len(lengths)], lengths)
+
+
+def _line_bounds(buf):
+    """ Get the start and end offsets (without newline and carriage return) of the lines of a byte array. """
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    ends = newlines if len(buf) == 0 or buf[-1] == _NEWLINE else np.append(newlines, len(buf))
+    starts = np.concatenate(([0], newlines + 1))[:len(ends)]
+    returns = (ends > starts) & (buf[np.maximum(ends - 1, 0)] == _RETURN)
+    return starts, ends - returns
+
+
+def _slices(data, offset, starts, ends):
+    """ Slice fields out of a buffer. """
+    return [data[offset + start:offset + end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+
+def _strings(data, offset, buf, starts, ends):
+    """ Get fields as strings, gathering short fields into a fixed width array at once. """
+    widths = ends - starts
+    width = widths.max() if len(widths) > 0 else 0
+    if width == 0 or width > _MAX_NAME_WIDTH:
+        return _slices(data, offset, starts, ends)
+    chars = buf[np.minimum(starts[:, None] + np.arange(width), len(buf) - 1)]
+    # Trailing NUL bytes are dropped when converting to strings:
+    chars[np.arange(width) >= widths[:, None]] = 0
+    return chars.view('S{}'.format(width)).ravel().tolist()
+
+
+def _valid_fields(fields):
+    """ Check the integer fields and the block lists of a line split into fields, like the checks of the tab
+    separated lines. """
+    if not all(fields[pos].isdigit() for pos in _INT_POSITIONS):
+        return False
+    for pos in _BLOCK_POSITIONS:
+        field = fields[pos][:-1] if fields[pos].endswith(',') else fields[pos]
+        values = field.split(',')
+        if len(values) != int(fields[17]) or not all(value.isdigit() for value in values):
+            return False
+    return True
+
+
+def _parse_by_lines(data, offset, line_starts, line_ends, stats):
+    """ Parse the lines of a chunk split at any whitespace, like psl2sam._iter_fields, dropping the malformed
+    lines. """
+    records = []
+    for line in _slices(data, offset, line_starts, line_ends):
+        fields = line.split()
+        if len(fields) in FIELD_COUNTS and _valid_fields(fields):
+            records.append(fields)
+        elif stats is not None and not _is_header(line):
+            stats.count('skipped_lines')
+    return columns_from_fields(records)
+
+
+def _split_fields(buf, line_starts, line_ends, tabs, rows):
+    """ Get the start and end offsets of the first 21 fields of lines with 21 or 23 (pslx) tab separated fields. """
+    first_tabs = np.searchsorted(tabs, line_starts[rows])
+    field_tabs = tabs[first_tabs[:, None] + np.arange(20)]
+    # The last field of pslx lines ends at the tab before the block sequences:
+    last_ends = line_ends[rows]
+    pslx = np.flatnonzero(np.searchsorted(tabs, last_ends) - first_tabs == 22)
+    if len(pslx) > 0:
+        last_ends[pslx] = tabs[first_tabs[pslx] + 20]
+    return np.column_stack((line_starts[rows], field_tabs + 1)), np.column_stack((field_tabs, last_ends))
+
+
+def _numeric_ranges(buf, field_starts, field_ends):
+    """ Get the byte ranges of the numeric runs of lines, the number of elements of their block lists and a flag
+    for lines with well formed numeric fields (apart from the bytes in them).
+
+    The ranges end after the separator following the run, unless the last block list ends with a comma.
+    """
+    commas = np.flatnonzero(buf == _COMMA)
+    lows = field_starts[:, [first for first, _ in _RUNS]]
+    highs = field_ends[:, [last for _, last in _RUNS]] + 1
+    # A list has an element after its last comma unless it ends with a comma (or is empty):
+    list_starts = field_starts[:, _BLOCK_POSITIONS]
+    list_ends = field_ends[:, _BLOCK_POSITIONS]
+    open_end = (list_ends > list_starts) & (buf[np.maximum(list_ends - 1, 0)] != _COMMA)
+    counts = np.searchsorted(commas, list_ends) - np.searchsorted(commas, list_starts) + open_end
+    highs[:, -1] = np.minimum(list_ends[:, -1] + open_end[:, -1], len(buf))
+    # Integer fields are not empty and hold no commas:
+    int_ends = field_ends[:, [last for _, last in _RUNS[:-1]] + [17]]
+    int_commas = np.searchsorted(commas, int_ends) - np.searchsorted(commas, lows)
+    valid = (field_ends[:, _INT_POSITIONS] > field_starts[:, _INT_POSITIONS]).all(axis=1) & \
+        (int_commas == 0).all(axis=1) & (counts[:, 0] > 0) & (counts[:, 0] == counts[:, 1]) & \
+        (counts[:, 0] == counts[:, 2])
+    # Carriage returns are only expected before the newline:
+    returns = np.flatnonzero(buf == _RETURN)
+    if len(returns) > 0:
+        valid &= np.searchsorted(returns, field_ends[:, -1]) == np.searchsorted(returns, field_starts[:, 0])
+    return lows, highs, counts[:, 0], valid
+
+
+def _decode(buf, lows, highs, counts):
+    """ Decode the numeric runs of lines.
+
+    :returns: Integer columns as rows and the values of the block lists concatenated line by line, or None and the
+    indices of the lines holding bytes other than digits and separators.
+    """
+    text = buf[_in_ranges(len(buf), lows.ravel(), highs.ravel())]
+    other = np.flatnonzero((text - _ZERO > 9) & (text != _TAB) & (text != _COMMA) & (text != _NEWLINE) &
+                           (text != _RETURN))
+    if len(other) > 0:
+        line_offsets = np.cumsum((highs - lows).sum(axis=1))
+        return None, np.unique(np.searchsorted(line_offsets, other, side='right'))
+    # Separators after a comma ending a block list are dropped, the others become commas:
+    separators = (text == _TAB) | (text == _NEWLINE) | (text == _RETURN)
+    after_comma = np.concatenate(([False], text[:-1] == _COMMA))
+    text[separators] = _COMMA
+    values = np.fromstring(text[~(separators & after_comma)].tostring(), dtype=np.int64, sep=',')
+    # Every line holds the integers followed by the three block lists:
+    sizes = len(_INT_POSITIONS) + 3 * counts
+    line_offsets = np.cumsum(sizes) - sizes
+    if len(values) != sizes.sum():
+        raise Exception('Failed to decode PSL data.')
+    ints = values[line_offsets[:, None] + np.arange(len(_INT_POSITIONS))]
+    return ints, (values, line_offsets, counts)
+
+
+def _block_column(values, line_offsets, counts, index):
+    """ Get one block column from the values of the block lists concatenated line by line. """
+    starts = line_offsets + len(_INT_POSITIONS) + index * counts
+    return values[np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+
+
+def parse_buffer(data, start=0, end=None, stats=None):
+    """ Parse the PSL lines in a range of a buffer into columnar form.
+
+    :param data: Buffer (str or mmap object) holding whole lines in the range.
+    :param start: Offset of the first line.
+    :param end: Offset after the last line (None: end of buffer).
+    :param stats: Stats object counting the skipped malformed lines (None: disabled).
+    :returns: Columnar batch, see batch_cigar.columns_from_fields.
+    :rtype: dict
+    """
+    end = len(data) if end is None else end
+    buf = np.frombuffer(data, dtype=np.uint8, count=end - start, offset=start) if end > start \
+        else np.zeros(0, dtype=np.uint8)
+    line_starts, line_ends = _line_bounds(buf)
+    tabs = np.flatnonzero(buf == _TAB)
+    tab_counts = np.searchsorted(tabs, line_ends) - np.searchsorted(tabs, line_starts)
+    rows = np.flatnonzero((tab_counts == 20) | (tab_counts == 22))
+    field_starts, field_ends = _split_fields(buf, line_starts, line_ends, tabs, rows)
+    lows, highs, counts, valid = _numeric_ranges(buf, field_starts, field_ends)
+    while True:
+        ints, blocks = _decode(buf, lows[valid], highs[valid], counts[valid])
+        if ints is not None:
+            # Lines with block lists not matching the block count:
+            bad = np.flatnonzero(ints[:, -1] != counts[valid])
+            if len(bad) == 0:
+                break
+        else:
+            bad = blocks
+        # Drop the malformed lines (rare) and decode again:
+        valid[np.flatnonzero(valid)[bad]] = False
+
+    # Skip the header and count the malformed lines:
+    rejected = np.ones(len(line_starts), dtype=bool)
+    rejected[rows[valid]] = False
+    rejected = np.flatnonzero(rejected)
+    if len(rejected) > 0:
+        lines = _slices(data, start, line_starts[rejected], line_ends[rejected])
+        if any(count not in (20, 22) and len(line.split()) in FIELD_COUNTS
+               for count, line in zip(tab_counts[rejected], lines)):
+            # Not tab separated, parse like the line based parser:
+            return _parse_by_lines(data, start, line_starts, line_ends, stats)
+        if stats is not None:
+            for line in lines:
+                if not _is_header(line):
+                    stats.count('skipped_lines')
+
+    columns = {}
+    for name, pos in zip(('strand', 'qName', 'tName'), (8, 9, 13)):
+        columns[name] = _strings(data, start, buf, field_starts[valid, pos], field_ends[valid, pos])
+    for index, (name, _) in enumerate(ALL_INT_COLUMNS):
+        columns[name] = ints[:, index]
+    for index, name in enumerate(BLOCK_COLUMNS):
+        columns[name] = _block_column(blocks[0], blocks[1], blocks[2], index)
+    offsets = np.zeros(len(ints) + 1, dtype=np.int64)
+    np.cumsum(columns['blockCount'], out=offsets[1:])
+    columns['offsets'] = offsets
+    return columns
+
+
+def _map_file(handle):
+    """ Memory map a regular file opened for reading, return None if not possible. """
+    try:
+        info = os.fstat(handle.fileno())
+        if not stat.S_ISREG(info.st_mode) or info.st_size == 0:
+            return None
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        return None
+
+
+def _iter_joined(lines, chunk_bytes):
+    """ Join lines from an iterable into strings of about chunk_bytes. """
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if len(chunk) > 0:
+        yield ''.join(chunk)
+
+
+def iter_column_batches(source, chunk_bytes=DEFAULT_CHUNK_BYTES, stats=None):
+    """ Parse PSL data into columnar batches of about chunk_bytes of input each.
+
+    A regular file is memory mapped and parsed from its current position in place, other sources (e.g. the lines
+    of compressed input) are joined into chunks first.
+
+    :param source: File handle or iterable of PSL lines.
+    :param chunk_bytes: Approximate size of the input of a batch in bytes.
+    :param stats: Stats object counting the skipped malformed lines (None: disabled).
+    :returns: Generator of columnar batches, see batch_cigar.columns_from_fields.
+    """
+    data = _map_file(source)
+    if data is None:
+        for chunk in _iter_joined(source, chunk_bytes):
+            yield parse_buffer(chunk, stats=stats)
+        return
+    try:
+        offset = source.tell()
+        while offset < len(data):
+            # Extend the chunk to the end of its last line:
+            end = data.find("\n", min(offset + chunk_bytes, len(data)) - 1)
+            end = len(data) if end < 0 else end + 1
+            yield parse_buffer(data, offset, end, stats)
+            offset = end
+    finally:
+        data.close()
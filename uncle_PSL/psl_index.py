@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Sidecar index of a PSL file by target region, for converting the records of a region without reading the
+whole file.
+
+The records are binned by target name and the bin of their target start. For every bin, the index holds the byte
+ranges of the runs of consecutive lines in that bin, so a target sorted file needs a few ranges per bin, while an
+unsorted file needs up to one range per record. The longest target span of a target bounds how far before a
+region the bins are searched.
+
+The index is a tab separated text file (the PSL path + '.psi'):
+
+    #uncle_psl_index  bin_size
+    T  target  max_span  section_size
+    B  target  bin  start_offset  end_offset
+
+The section size is the size of the following B lines of the target, so that a reader can skip the targets it
+does not need.
+"""
+
+import bisect
+from collections import OrderedDict
+import os
+import re
+
+from uncle_PSL.records import FIELD_COUNTS
+
+DEFAULT_BIN_SIZE = 1 << 14
+INDEX_SUFFIX = '.psi'
+_MAGIC = '#uncle_psl_index'
+
+
+def parse_region(region):
+    """ Parse a samtools style region string: target, target:start or target:start-end (one-based, inclusive).
+
+    :param region: Region string.
+    :returns: Target name, zero-based start and exclusive end (None: end of target).
+    :rtype: tuple
+    """
+    match = re.match(r'^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$', region)
+    if match is None:
+        raise Exception('Invalid region: {}'.format(region))
+    name, start, end = match.groups()
+    start = int(start.replace(',', '')) - 1 if start is not None else 0
+    end = int(end.replace(',', '')) if end is not None else None
+    if start < 0 or (end is not None and end <= start):
+        raise Exception('Invalid region: {}'.format(region))
+    return name, start, end
+
+
+def _parse_target(line):
+    """ Get target name, start and end of a PSL (or pslx) line (None for header and malformed lines). """
+    fields = line.split()
+    if len(fields) not in FIELD_COUNTS:
+        return None
+    try:
+        return fields[13], int(fields[15]), int(fields[16])
+    except ValueError:
+        return None
+
+
+class PslIndex:
+
+    """ Byte ranges of PSL records by target and bin of the target start. """
+
+    def __init__(self, bin_size=DEFAULT_BIN_SIZE):
+        """ Initialise empty PSL index object.
+
+        :param bin_size: Size of the target bins.
+        """
+        self.bin_size = bin_size
+        self.max_spans = OrderedDict()
+        # Sorted bins and their lists of [start, end) byte ranges by target:
+        self.bins = {}
+        self.ranges = {}
+
+    def _add(self, name, bin_index, start, end):
+        """ Add the byte range of a line, extending the last range of the bin if it ends at the line. """
+        bins = self.bins.setdefault(name, [])
+        ranges = self.ranges.setdefault(name, {})
+        if bin_index not in ranges:
+            bisect.insort(bins, bin_index)
+            ranges[bin_index] = []
+        bin_ranges = ranges[bin_index]
+        if len(bin_ranges) > 0 and bin_ranges[-1][1] == start:
+            bin_ranges[-1][1] = end
+        else:
+            bin_ranges.append([start, end])
+
+    def add_record(self, name, t_start, t_end, start, end):
+        """Add a PSL record.
+
+        :param self: object
+        :param name: Target name.
+        :param t_start: Target start.
+        :param t_end: Target end.
+        :param start: Offset of the line.
+        :param end: Offset after the line.
+        :returns: None
+        """
+        self.max_spans[name] = max(self.max_spans.get(name, 0), t_end - t_start)
+        self._add(name, t_start // self.bin_size, start, end)
+
+    def ranges_of(self, name, start=0, end=None):
+        """Get the byte ranges holding the records which may overlap a region.
+
+        :param self: object
+        :param name: Target name.
+        :param start: Zero-based start of the region.
+        :param end: Exclusive end of the region (None: end of target).
+        :returns: Sorted, non-overlapping list of (start, end) byte ranges.
+        :rtype: list
+        """
+        if name not in self.bins:
+            return []
+        bins = self.bins[name]
+        first = bisect.bisect_left(bins, max(0, start - self.max_spans[name]) // self.bin_size)
+        last = bisect.bisect_right(bins, (end - 1) // self.bin_size) if end is not None else len(bins)
+        ranges = sorted(tuple(r) for bin_index in bins[first:last] for r in self.ranges[name][bin_index])
+        merged = []
+        for range_start, range_end in ranges:
+            if len(merged) > 0 and range_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+            else:
+                merged.append((range_start, range_end))
+        return merged
+
+    def write(self, path):
+        """Write index file.
+
+        :param self: object
+        :param path: Path to index file.
+        :returns: None
+        """
+        with open(path, 'w') as handle:
+            handle.write("{}\t{}\n".format(_MAGIC, self.bin_size))
+            for name, max_span in self.max_spans.iteritems():
+                section = "".join("B\t{}\t{}\t{}\t{}\n".format(name, bin_index, start, end)
+                                  for bin_index in self.bins[name] for start, end in self.ranges[name][bin_index])
+                handle.write("T\t{}\t{}\t{}\n".format(name, max_span, len(section)))
+                handle.write(section)
+
+
+def build_index(psl, bin_size=DEFAULT_BIN_SIZE):
+    """ Index a PSL file in a single pass.
+
+    :param psl: Path to plain text PSL file.
+    :param bin_size: Size of the target bins.
+    :returns: PslIndex object.
+    :rtype: PslIndex
+    """
+    index = PslIndex(bin_size)
+    offset = 0
+    with open(psl, 'rb') as handle:
+        for line in handle:
+            target = _parse_target(line)
+            if target is not None:
+                index.add_record(target[0], target[1], target[2], offset, offset + len(line))
+            offset += len(line)
+    return index
+
+
+def read_index(path, names=None):
+    """ Read an index file.
+
+    :param path: Path to index file.
+    :param names: Read only the sections of these targets (None: all targets).
+    :returns: PslIndex object.
+    :rtype: PslIndex
+    """
+    with open(path, 'rb') as handle:
+        magic = handle.readline().rstrip("\n").split("\t")
+        if magic[0] != _MAGIC:
+            raise Exception('Not a PSL index file: {}'.format(path))
+        index = PslIndex(int(magic[1]))
+        while True:
+            line = handle.readline()
+            if len(line) == 0:
+                break
+            _, name, max_span, section_size = line.rstrip("\n").split("\t")
+            if names is not None and name not in names:
+                handle.seek(int(section_size), 1)
+                continue
+            index.max_spans[name] = int(max_span)
+            bins = index.bins[name] = []
+            ranges = index.ranges[name] = {}
+            for line in handle.read(int(section_size)).splitlines():
+                fields = line.split("\t")
+                bin_index = int(fields[2])
+                if bin_index not in ranges:
+                    bins.append(bin_index)
+                    ranges[bin_index] = []
+                ranges[bin_index].append([int(fields[3]), int(fields[4])])
+    return index
+
+
+def open_index(psl, write_index=True, names=None):
+    """ Read the index of a PSL file, building it if missing or older than the PSL file.
+
+    :param psl: Path to plain text PSL file.
+    :param write_index: Save a newly built index if true.
+    :param names: Read only the sections of these targets from an existing index (None: all targets).
+    :returns: PslIndex object.
+    :rtype: PslIndex
+    """
+    path = psl + INDEX_SUFFIX
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(psl):
+        return read_index(path, names)
+    index = build_index(psl)
+    if write_index:
+        try:
+            index.write(path)
+        except IOError:
+            pass  # Read-only location, keep the index in memory.
+    return index
+
+
+def iter_region(handle, index, name, start=0, end=None):
+    """ Iterate over the PSL lines of records overlapping a region, in file order.
+
+    :param handle: Seekable file handle of the indexed PSL file.
+    :param index: PslIndex object.
+    :param name: Target name.
+    :param start: Zero-based start of the region.
+    :param end: Exclusive end of the region (None: end of target).
+    :returns: Generator of PSL lines.
+    """
+    for offset, range_end in index.ranges_of(name, start, end):
+        handle.seek(offset)
+        while offset < range_end:
+            line = handle.readline()
+            if len(line) == 0:
+                break
+            offset += len(line)
+            target = _parse_target(line)
+            if target is not None and target[0] == name and target[2] > start and \
+                    (end is None or target[1] < end):
+                yield line
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+import numpy as np
+
+from uncle_PSL.lru_cache import LRUCache
+from uncle_PSL.seq_util import reverse_complement
+
+# Default limit of the total size of cached reads in bytes:
+DEFAULT_READ_CACHE_SIZE = 64 << 20
+
+
+def read_sequence(reads, name):
+    """ Get read sequence and base qualities (None if missing) as strings.
+
+    The reads can be a dictionary of SeqRecord objects, sequence strings (e.g. a FastaStore) or (sequence, qualities)
+    tuples (e.g. a ReadStream).
+    """
+    read = reads[name]
+    if isinstance(read, str):
+        return read, None
+    if isinstance(read, tuple):
+        return read
+    quals = read.letter_annotations.get('phred_quality')
+    # Encode the qualities without a string object per base:
+    return str(read.seq), (np.array(quals, dtype=np.uint8) + 33).tostring() if quals is not None else None
+
+
+def _entry_size(entry):
+    """ Size of a cache entry, counting the reverse complement whether it is computed already or not. """
+    if entry is None:
+        return 1
+    return 2 * (len(entry[0]) + (len(entry[1]) if entry[1] is not None else 0))
+
+
+class ReadCache:
+
+    """ LRU cache of read sequences and qualities in both orientations, keyed by read name.
+
+    The hits of a read are usually consecutive in BLAT output, so the index lookup and the reverse
+    complement of a read are done once instead of once per hit.
+    """
+
+    def __init__(self, reads, max_size=DEFAULT_READ_CACHE_SIZE):
+        """ Initialise read cache object.
+
+        :param reads: Dictionary-like reads, see read_sequence.
+        :param max_size: Limit of the total size of the cached reads in bytes.
+        """
+        self.reads = reads
+        self.cache = LRUCache(max_size, sizeof=_entry_size)
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def oriented(self, name, reverse, unknown_bases=None):
+        """Get read sequence and qualities in the orientation of an alignment.
+
+        :param self: object
+        :param name: Read name.
+        :param reverse: Reverse complement the sequence and reverse the qualities if true.
+        :param unknown_bases: UnknownBaseCounter object counting bases without complement.
+        :returns: Sequence and qualities (None if missing), or None if the read is missing.
+        :rtype: tuple
+        """
+        entry = self.cache.get(name)
+        if entry is None and name not in self.cache:
+            if name in self.reads:
+                seq, qual = read_sequence(self.reads, name)
+                entry = [seq, qual, None, None]
+            self.cache.put(name, entry)
+        if entry is None:
+            return None
+        if not reverse:
+            return entry[0], entry[1]
+        if entry[2] is None:
+            entry[2] = reverse_complement(entry[0], unknown_bases)
+            entry[3] = entry[1][::-1] if entry[1] is not None else None
+        return entry[2], entry[3]
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Forward-only FASTA/FASTQ reader joined to PSL records in the same query order.
+
+Instead of random access through an index, the reads are consumed as a stream: a lookup advances the
+stream to the requested read, skipping reads without alignments. No index is built and the input is
+never seeked, so it can be a pipe or a compressed file.
+
+The skipped reads are kept in a lookahead buffer of bounded size, so a read missing from the stream does
+not consume the rest of it: the lookup fails once the buffer is full (or at the end of the stream), and
+the following reads are found in the buffer. Reads without alignments are only found if the reads
+skipped before them fit into the buffer.
+"""
+
+from collections import OrderedDict
+
+# Default size of the buffer of skipped reads in bytes:
+DEFAULT_LOOKAHEAD = 64 << 20
+
+
+def iter_reads(handle):
+    """ Iterate over reads in FASTA or FASTQ format.
+
+    :param handle: File handle or iterable of lines.
+    :returns: Generator of (name, sequence, qualities) tuples, qualities are None for FASTA.
+    """
+    lines = iter(handle)
+    line = next(lines, '')
+    while len(line) > 0:
+        if line.startswith('>'):
+            name = line[1:].split(None, 1)[0]
+            seq = []
+            line = next(lines, '')
+            while len(line) > 0 and not line.startswith('>'):
+                seq.append(line.strip())
+                line = next(lines, '')
+            yield name, ''.join(seq), None
+        elif line.startswith('@'):
+            name = line[1:].split(None, 1)[0]
+            seq = []
+            line = next(lines, '')
+            while len(line) > 0 and not line.startswith('+'):
+                seq.append(line.strip())
+                line = next(lines, '')
+            seq = ''.join(seq)
+            qual = []
+            length = 0
+            # Quality lines can start with '@', so read them by length:
+            while length < len(seq):
+                line = next(lines, '')
+                if len(line) == 0:
+                    raise Exception('Truncated FASTQ record: {}'.format(name))
+                qual.append(line.strip())
+                length += len(qual[-1])
+            yield name, seq, ''.join(qual)
+            line = next(lines, '')
+        elif len(line.strip()) == 0:
+            line = next(lines, '')
+        else:
+            raise Exception('Invalid FASTA/FASTQ line: {}'.format(line.rstrip()))
+
+
+def _read_size(read):
+    """ Size of a (sequence, qualities) tuple in bytes. """
+    return len(read[0]) + (len(read[1]) if read[1] is not None else 0)
+
+
+class ReadStream:
+
+    """ Dictionary-like access to a stream of reads in the order of the PSL records.
+
+    The values are (sequence, qualities) tuples. Only the current read and the skipped reads of the
+    lookahead buffer are kept in memory, so the lookups must follow the order of the reads. Several
+    consecutive lookups of the same read (e.g. its hits) are served from memory.
+    """
+
+    def __init__(self, handle, lookahead=DEFAULT_LOOKAHEAD):
+        """ Initialise read stream object.
+
+        :param handle: File handle or iterable of FASTA/FASTQ lines.
+        :param lookahead: Size of the buffer of skipped reads in bytes, also the amount of reads scanned before a
+        read is considered missing.
+        """
+        self.handle = handle
+        self.reads = iter_reads(handle)
+        self.lookahead = lookahead
+        self.name = None
+        self.read = None
+        self.missing = None
+        self.pending = OrderedDict()
+        self.pending_size = 0
+
+    def _pop_pending(self):
+        """ Remove the oldest skipped read from the buffer. """
+        name, read = self.pending.popitem(last=False)
+        self.pending_size -= _read_size(read)
+        return name, read
+
+    def _advance(self, name):
+        """ Advance the stream to a read, returning False if it is missing. """
+        if name == self.name:
+            return True
+        if name == self.missing:
+            return False
+        if name in self.pending:
+            # The reads skipped before it have no alignments:
+            read_name, read = self._pop_pending()
+            while read_name != name:
+                read_name, read = self._pop_pending()
+            self.name, self.read = name, read
+            return True
+        scanned = 0
+        for read_name, seq, qual in self.reads:
+            if read_name == name:
+                self.pending.clear()
+                self.pending_size = 0
+                self.name, self.read = name, (seq, qual)
+                return True
+            self.pending[read_name] = (seq, qual)
+            size = _read_size((seq, qual))
+            self.pending_size += size
+            scanned += size
+            while self.pending_size > self.lookahead:
+                self._pop_pending()
+            if scanned > self.lookahead:
+                break
+        self.missing = name
+        return False
+
+    def __contains__(self, name):
+        return self._advance(name)
+
+    def __getitem__(self, name):
+        if not self._advance(name):
+            raise KeyError(name)
+        return self.read
+
+    def fetch_chunk(self, names):
+        """Get the reads of a chunk of PSL records, e.g. to send them to a worker process.
+
+        :param self: object
+        :param names: Query names in PSL order.
+        :returns: Dictionary of (sequence, qualities) tuples.
+        :rtype: dict
+        """
+        chunk = {}
+        for name in names:
+            if name not in chunk and name in self:
+                chunk[name] = self.read
+        return chunk
+
+    def close(self):
+        """Close the underlying handle.
+
+        :param self: object
+        :returns: None
+        """
+        if hasattr(self.handle, 'close'):
+            self.handle.close()
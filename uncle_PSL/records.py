@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Compact PSL and SAM record types. """
+
+# PSL columns in file order:
+PSL_FIELDS = ('matches', 'misMatches', 'repMatches', 'nCount', 'qNumInsert', 'qBaseInsert', 'tNumInsert',
+              'tBaseInsert', 'strand', 'qName', 'qSize', 'qStart', 'qEnd', 'tName', 'tSize', 'tStart', 'tEnd',
+              'blockCount', 'blockSizes', 'qStarts', 'tStarts')
+# Extra pslx columns, the comma separated sequences of the query and target blocks:
+PSLX_FIELDS = ('qSeqs', 'tSeqs')
+# Number of fields of PSL and pslx lines:
+FIELD_COUNTS = (len(PSL_FIELDS), len(PSL_FIELDS) + len(PSLX_FIELDS))
+# SAM columns in file order:
+SAM_FIELDS = ('qname', 'flag', 'rname', 'pos', 'mapq', 'cigar', 'rnext', 'pnext', 'tlen', 'seq', 'qual', 'tags')
+
+
+class PslRecord(object):
+
+    """ PSL record with the integer columns parsed. The block columns are kept as comma separated strings, as are
+    the block sequences of pslx records (None for PSL records). """
+
+    __slots__ = PSL_FIELDS + PSLX_FIELDS
+
+    def __init__(self, fields):
+        """ Initialise PSL record from a line split into 21 (PSL) or 23 (pslx) fields.
+
+        :param fields: List of fields.
+        """
+        self.matches = int(fields[0])
+        self.misMatches = int(fields[1])
+        self.repMatches = int(fields[2])
+        self.nCount = int(fields[3])
+        self.qNumInsert = int(fields[4])
+        self.qBaseInsert = int(fields[5])
+        self.tNumInsert = int(fields[6])
+        self.tBaseInsert = int(fields[7])
+        self.strand = fields[8]
+        self.qName = fields[9]
+        self.qSize = int(fields[10])
+        self.qStart = int(fields[11])
+        self.qEnd = int(fields[12])
+        self.tName = fields[13]
+        self.tSize = int(fields[14])
+        self.tStart = int(fields[15])
+        self.tEnd = int(fields[16])
+        self.blockCount = int(fields[17])
+        self.blockSizes = fields[18]
+        self.qStarts = fields[19]
+        self.tStarts = fields[20]
+        self.qSeqs, self.tSeqs = (fields[21], fields[22]) if len(fields) > 21 else (None, None)
+
+    def fields(self):
+        """Get the record as a list of string fields.
+
+        :param self: object
+        :returns: List of fields in PSL column order (followed by the pslx columns for pslx records).
+        :rtype: list
+        """
+        fields = PSL_FIELDS if self.qSeqs is None else PSL_FIELDS + PSLX_FIELDS
+        return [str(getattr(self, field)) for field in fields]
+
+    def __repr__(self):
+        return 'PslRecord({})'.format(self.fields())
+
+
+class SamRecord(object):
+
+    """ SAM record holding the eleven mandatory columns and the optional tags as a tab separated string. """
+
+    __slots__ = SAM_FIELDS
+
+    def __init__(self, qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual, tags):
+        """ Initialise SAM record. See SamWriter.new_sam_record for the arguments. """
+        self.qname = qname
+        self.flag = flag
+        self.rname = rname
+        self.pos = pos
+        self.mapq = mapq
+        self.cigar = cigar
+        self.rnext = rnext
+        self.pnext = pnext
+        self.tlen = tlen
+        self.seq = seq
+        self.qual = qual
+        self.tags = tags
+
+    def format(self):
+        """Format record as a SAM line (without newline).
+
+        :param self: object
+        :returns: SAM line.
+        :rtype: str
+        """
+        return "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format(
+            self.qname, self.flag, self.rname, self.pos, self.mapq, self.cigar, self.rnext, self.pnext, self.tlen,
+            self.seq, self.qual, self.tags)
+
+    def __repr__(self):
+        return 'SamRecord({!r})'.format(self.format())
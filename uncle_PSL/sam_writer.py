@@ -7,28 +7,161 @@
 # (c) 2016 Oxford Nanopore Technologies Ltd.
 
 from collections import OrderedDict
+import shutil
+import tempfile
+
+from uncle_PSL import __version__
+from uncle_PSL.external_sort import ExternalSorter, coordinate_key
+from uncle_PSL.records import SamRecord
+
+# Default size of the output buffer in buffered mode:
+DEFAULT_BUFFER_SIZE = 1 << 20
+# Sequences at least this long are written piece by piece instead of being copied into the formatted line (and
+# hard clipped as buffer views):
+LONG_FIELD_SIZE = 1 << 16
+
+
+def format_header(header):
+    """ Format SAM header structure as text.
+
+    :param header: OrderedDict of header record types, each with a list of OrderedDicts.
+    :returns: Header text.
+    :rtype: str
+    """
+    lines = []
+    for record_type, records in header.iteritems():
+        for record in records:
+            lines.append("\t".join(["@{}".format(record_type)] +
+                                   ["{}:{}".format(key, value) for key, value in record.iteritems()]))
+            lines.append("\n")
+    return "".join(lines)
+
+
+def new_header(references=None, command_line=None, sort_order='unsorted'):
+    """ Create SAM header structure with @HD, @SQ and @PG records.
+
+    :param references: Iterable of (name, length) tuples (None: @SQ records are collected by the writer).
+    :param command_line: Command line for the @PG record.
+    :param sort_order: Sort order in the @HD record.
+    :returns: SAM header structure.
+    :rtype: OrderedDict
+    """
+    header = OrderedDict([('HD', [OrderedDict([('VN', '1.6'), ('SO', sort_order)])])])
+    if references is not None:
+        header['SQ'] = [OrderedDict([('SN', name), ('LN', length)]) for name, length in references]
+    program = OrderedDict([('ID', 'uncle_psl'), ('PN', 'uncle_psl'), ('VN', __version__)])
+    if command_line is not None:
+        program['CL'] = command_line
+    header['PG'] = [program]
+    return header
 
 
 class SamWriter:
 
-    """ Simple class to write SAM files. """
+    """ Simple class to write SAM files.
+
+    If the header has no @SQ records, the references are collected from the records through add_reference and
+    the records are spooled to a temporary file until the header can be written by finish.
+    If sort_memory is given, the records are sorted by coordinate (in the order of the references) with an external
+    merge sort and written by finish.
+    """
 
-    def __init__(self, out_file, header=None):
-        """ Initialise SAM writer object """
+    def __init__(self, out_file, header=None, buffer_size=None, sort_memory=None):
+        """ Initialise SAM writer object.
+
+        :param out_file: Output file handle.
+        :param header: SAM header structure.
+        :param buffer_size: Collect output in a buffer and write it in chunks of this size (None: no buffering).
+        :param sort_memory: Sort records by coordinate, keeping runs of this many bytes in memory (None: no sorting).
+        """
         self.out_file = out_file
         self.header = header
         self.out_handler = out_file
-        if header is not None:
-            self._write_header()
+        self.references = OrderedDict()
+        self.ref_ids = {}
+        self.fixed_references = False
+        self.spool = None
+        self.sort = sort_memory is not None
+        self.sorter = ExternalSorter(sort_memory) if self.sort else None
+        self.buffer_size = buffer_size
+        self.buffer = bytearray() if buffer_size is not None else None
+        if header is None:
+            return
+        if len(header.get('SQ', [])) > 0:
+            for sq in header['SQ']:
+                self.ref_ids[sq['SN']] = len(self.references)
+                self.references[sq['SN']] = sq['LN']
+            self.fixed_references = True
+            if not self.sort:
+                self._write_header()
+        elif not self.sort:
+            self.spool = tempfile.TemporaryFile(prefix='uncle_psl_sam')
+            self.out_handler = self.spool
+
+    def _complete_header(self):
+        """ Get the header with the @SQ records collected from the alignments inserted after @HD. """
+        header = self.header
+        if len(header.get('SQ', [])) == 0:
+            header = OrderedDict((key, value) for key, value in self.header.iteritems() if key == 'HD')
+            header['SQ'] = [OrderedDict([('SN', name), ('LN', length)])
+                            for name, length in self.references.iteritems()]
+            header.update((key, value) for key, value in self.header.iteritems() if key not in ('HD', 'SQ'))
+        if self.sort and len(header.get('HD', [])) > 0:
+            header = OrderedDict(header)
+            header['HD'] = [OrderedDict(header['HD'][0], SO='coordinate')] + header['HD'][1:]
+        return header
 
     def _write_header(self):
         """Write SAM header."""
-        for record_type, records in self.header.iteritems():
-            for record in records:
-                self.out_handler.write("@{}".format(record_type))
-                for key, value in record.iteritems():
-                    self.out_handler.write("\t{}:{}".format(key, value))
-                self.out_handler.write("\n")
+        self._write_data(format_header(self._complete_header()))
+
+    def _write_data(self, data):
+        """ Write formatted data (a string or buffer) to the file or the buffer. """
+        if self.buffer is None:
+            self.out_handler.write(data)
+            return
+        if len(data) >= self.buffer_size:
+            # Do not copy large data into the buffer:
+            self._flush_buffer()
+            self.out_handler.write(data)
+            return
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self._flush_buffer()
+
+    def _write_long(self, record):
+        """ Write a record with a long sequence, writing the sequence and the qualities from their source. """
+        self._write_data("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t".format(
+            record.qname, record.flag, record.rname, record.pos, record.mapq, record.cigar, record.rnext,
+            record.pnext, record.tlen))
+        self._write_data(record.seq)
+        self._write_data("\t")
+        self._write_data(record.qual)
+        self._write_data("\t{}\n".format(record.tags))
+
+    def _flush_buffer(self):
+        """ Write buffered data to the file. """
+        if self.buffer is not None and len(self.buffer) > 0:
+            self.out_handler.write(self.buffer)
+            del self.buffer[:]
+
+    def add_reference(self, name, length):
+        """Register a reference sequence seen in the records.
+
+        :param self: object
+        :param name: Reference name.
+        :param length: Reference length.
+        :returns: None
+        """
+        if name not in self.references:
+            if self.fixed_references:
+                raise Exception('Reference not in SAM header: {}'.format(name))
+            self.ref_ids[name] = len(self.references)
+            self.references[name] = length
+
+    def _sort_key(self, rname, pos):
+        """ Get coordinate sort key of a record. """
+        return coordinate_key(self.ref_ids.get(rname, -1), pos)
 
     def new_sam_record(self, qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual, tags):
         """Create new SAM record structure.
@@ -46,24 +179,9 @@ class SamWriter:
         :param qual: Base qualities.
         :param tags: Optional tags.
         :returns: SAM record.
-        :rtype: OrderedDict
+        :rtype: SamRecord
         """
-        record = OrderedDict()
-
-        record['QNAME'] = qname
-        record['FLAG'] = flag
-        record['RNAME'] = rname
-        record['POS'] = pos
-        record['MAPQ'] = mapq
-        record['CIGAR'] = cigar
-        record['RNEXT'] = rnext
-        record['PNEXT'] = pnext
-        record['TLEN'] = tlen
-        record['SEQ'] = seq
-        record['QUAL'] = qual
-        record['TAGS'] = tags
-
-        return record
+        return SamRecord(qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual, tags)
 
     def write(self, record):
         """Write SAM record to file.
@@ -73,7 +191,78 @@ class SamWriter:
         :returns: None
         :rtype: object
         """
-        self.out_handler.write("{}\n".format("\t".join(map(lambda x: str(x), record.itervalues()))))
+        if self.sorter is not None:
+            self.sorter.add(self._sort_key(record.rname, record.pos), record.format() + "\n")
+        elif len(record.seq) >= LONG_FIELD_SIZE:
+            self._write_long(record)
+        else:
+            self._write_data(record.format() + "\n")
+
+    def write_many(self, records):
+        """Write a batch of SAM records to file.
+
+        :param self: object
+        :param records: List of SAM records.
+        :returns: None
+        """
+        if self.sorter is not None or any(len(record.seq) >= LONG_FIELD_SIZE for record in records):
+            for record in records:
+                self.write(record)
+            return
+        if len(records) > 0:
+            self._write_data("\n".join([record.format() for record in records]) + "\n")
+
+    def write_formatted(self, text, references=()):
+        """Write SAM lines which are already formatted (e.g. by a worker process).
+
+        :param self: object
+        :param text: SAM lines.
+        :param references: (name, length) tuples of the references used by the lines.
+        :returns: None
+        """
+        for name, length in references:
+            self.add_reference(name, length)
+        if self.sorter is not None:
+            for line in text.splitlines(True):
+                fields = line.split("\t", 4)
+                self.sorter.add(self._sort_key(fields[2], int(fields[3])), line)
+            return
+        self._write_data(text)
+
+    def flush(self):
+        """Write the buffered records to the file. Sorted and spooled records are only written by finish.
+
+        :param self: object
+        :returns: None
+        """
+        self._flush_buffer()
+        self.out_handler.flush()
+
+    def finish(self):
+        """Flush pending output without closing the file.
+
+        :param self: object
+        :returns: None
+        """
+        self._flush_buffer()
+        if self.sorter is not None:
+            if self.header is not None:
+                self._write_header()
+            for data in self.sorter.merged():
+                self._write_data(data)
+            self._flush_buffer()
+            self.sorter.close()
+            self.sorter = None
+        if self.spool is not None:
+            # All references are known, write header and the spooled records:
+            self.out_handler = self.out_file
+            self._write_header()
+            self._flush_buffer()
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, self.out_handler)
+            self.spool.close()
+            self.spool = None
+        self.out_handler.flush()
 
     def close(self):
         """Close SAM file.
@@ -82,5 +271,5 @@ class SamWriter:
         :returns: None
         :rtype: object
         """
-        self.out_handler.flush()
+        self.finish()
         self.out_handler.close()
@@ -6,20 +6,59 @@
 
 # (c) 2016 Oxford Nanopore Technologies Ltd.
 
+import string
 import sys
 
-# Reverse complements of bases, taken from dragonet:
+# Complements of bases, covering the IUPAC alphabet (U is complemented to A):
 comp = {
-    'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C', 'X': 'X', 'N': 'N',
-    'a': 't', 't': 'a', 'c': 'g', 'g': 'c', 'x': 'x', 'n': 'n',
-    '-': '-'
+    'A': 'T', 'T': 'A', 'U': 'A', 'C': 'G', 'G': 'C',
+    'R': 'Y', 'Y': 'R', 'K': 'M', 'M': 'K', 'S': 'S', 'W': 'W',
+    'B': 'V', 'V': 'B', 'D': 'H', 'H': 'D', 'X': 'X', 'N': 'N',
+    '-': '-', '.': '.', '*': '*'
 }
+comp.update([(k.lower(), v.lower()) for k, v in comp.items() if k.isalpha()])
+
+# Translation table and the set of bases it knows about:
+_COMP_TABLE = string.maketrans(''.join(comp.keys()), ''.join(comp.values()))
+_KNOWN_BASES = ''.join(comp.keys())
+# Separator used when reverse complementing batches of sequences:
+_BATCH_SEP = '\n'
+
+
+class UnknownBaseCounter:
+
+    """ Aggregate count of bases without a complement. """
+
+    def __init__(self):
+        """ Initialise counter object """
+        self.count = 0
+
+    def add(self, seq, ignore=''):
+        """Count unknown bases in a sequence.
+
+        :param self: object
+        :param seq: Sequence (str or bytearray).
+        :param ignore: Additional characters which are not counted.
+        :returns: None
+        """
+        self.count += len(seq.translate(None, _KNOWN_BASES + ignore))
+
+    def warn(self, handle=sys.stderr):
+        """Write a single warning if unknown bases were seen.
+
+        :param self: object
+        :param handle: Handle to write the warning to.
+        :returns: None
+        """
+        if self.count > 0:
+            handle.write("WARNING: No reverse complement found for {} bases, these were left unchanged.\n".format(
+                self.count))
 
 
 def base_complement(k):
     """ Return complement of base.
 
-    Performs the subsitutions: A<=>T, C<=>G, X=>X for both upper and lower
+    Performs the subsitutions of the IUPAC alphabet (A<=>T, C<=>G, R<=>Y, etc.) for both upper and lower
     case. The return value is identical to the argument for all other values.
 
     :param k: A base.
@@ -27,22 +66,42 @@ def base_complement(k):
     :rtype: str
 
     """
-    try:
-        return comp[k]
-    except KeyError:
-        sys.stderr.write(
-            "WARNING: No reverse complement for {} found, returning argument.".format(k))
-        return k
+    return comp.get(k, k)
 
 
-def reverse_complement(seq):
+def reverse_complement(seq, unknown=None):
     """ Return reverse complement of a string (base) sequence.
 
-    :param seq: Input sequence.
+    :param seq: Input sequence (str or bytearray).
+    :param unknown: UnknownBaseCounter object to count bases without complement.
     :returns: Reverse complement of input sequence.
     :rtype: str
 
     """
-    if len(seq) == 0:
-        return seq
-    return reduce(lambda x, y: x + y, map(base_complement, seq[::-1]))
+    if unknown is not None:
+        unknown.add(seq)
+    if isinstance(seq, bytearray):
+        res = seq.translate(_COMP_TABLE)
+        res.reverse()
+        return res
+    return seq.translate(_COMP_TABLE)[::-1]
+
+
+def reverse_complement_many(seqs, unknown=None):
+    """ Return reverse complements of a list of sequences in a single pass.
+
+    :param seqs: List of input sequences (str), these must not contain newlines.
+    :param unknown: UnknownBaseCounter object to count bases without complement.
+    :returns: Reverse complements of input sequences.
+    :rtype: list
+
+    """
+    if len(seqs) == 0:
+        return []
+    joined = _BATCH_SEP.join(seqs)
+    if unknown is not None:
+        unknown.add(joined, ignore=_BATCH_SEP)
+    # The separator is left alone by the table, reversing the whole batch reverses the order of sequences:
+    res = joined.translate(_COMP_TABLE)[::-1].split(_BATCH_SEP)
+    res.reverse()
+    return res
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Deterministic sharding of a PSL file by byte ranges and merging of the shard outputs.
+
+Shard i of n starts at the first line starting at or after byte (i - 1) * size / n, so every line belongs to
+exactly one shard and no shard needs to read the others. If the lines are grouped by a key (e.g. the query name),
+a boundary is moved past the lines continuing the group of the line before it, so a group is never split.
+
+The SAM outputs of the shards are merged into the output of a single run: the header of the first shard is kept
+with the @SQ records of all shards, and the records are concatenated (or merged by coordinate if sorted).
+"""
+
+import heapq
+import os
+import re
+
+from uncle_PSL.external_sort import coordinate_key
+
+# Size of the blocks read when searching a line start backwards:
+_BLOCK_SIZE = 1 << 16
+
+
+def parse_shard(shard):
+    """ Parse shard string i/n (one-based shard index and number of shards).
+
+    :param shard: Shard string.
+    :returns: Shard index and number of shards.
+    :rtype: tuple
+    """
+    match = re.match(r'^(\d+)/(\d+)$', shard)
+    if match is None or not 0 < int(match.group(1)) <= int(match.group(2)):
+        raise Exception('Invalid shard: {}'.format(shard))
+    return int(match.group(1)), int(match.group(2))
+
+
+def _previous_line(handle, offset):
+    """ Get the line ending right before a line start offset. """
+    end = offset
+    data = ''
+    while offset > 0:
+        start = max(0, offset - _BLOCK_SIZE)
+        handle.seek(start)
+        data = handle.read(offset - start) + data
+        offset = start
+        # Look for the newline before the previous line, skipping its own newline:
+        newline = data.rfind("\n", 0, len(data) - 1)
+        if newline >= 0:
+            return data[newline + 1:]
+    return data[:end]
+
+
+def _boundary(handle, size, index, count, key=None):
+    """ Get the start offset of shard index (zero-based) of count. """
+    nominal = size * index // count
+    if nominal == 0:
+        return 0
+    if nominal >= size:
+        return size
+    # Skip the rest of the line holding the byte before the nominal boundary:
+    handle.seek(nominal - 1)
+    offset = nominal - 1 + len(handle.readline())
+    if key is None or offset >= size:
+        return offset
+    group = key(_previous_line(handle, offset))
+    if group is None:
+        return offset
+    handle.seek(offset)
+    for line in iter(handle.readline, ''):
+        if key(line) != group:
+            break
+        offset += len(line)
+    return offset
+
+
+def shard_range(handle, index, count, key=None):
+    """ Get the byte range of a shard.
+
+    :param handle: Seekable file handle.
+    :param index: One-based shard index.
+    :param count: Number of shards.
+    :param key: Function of a line. If given, lines with the same key around a boundary stay in the same shard.
+    :returns: Start and end offsets.
+    :rtype: tuple
+    """
+    size = os.fstat(handle.fileno()).st_size
+    return _boundary(handle, size, index - 1, count, key), _boundary(handle, size, index, count, key)
+
+
+def iter_shard(handle, index, count, key=None):
+    """ Iterate over the lines of a shard.
+
+    :param handle: Seekable file handle.
+    :param index: One-based shard index.
+    :param count: Number of shards.
+    :param key: Function of a line. If given, lines with the same key around a boundary stay in the same shard.
+    :returns: Generator of lines.
+    """
+    offset, end = shard_range(handle, index, count, key)
+    handle.seek(offset)
+    while offset < end:
+        line = handle.readline()
+        if len(line) == 0:
+            break
+        offset += len(line)
+        yield line
+
+
+def _read_header(handle):
+    """ Read the header lines of a SAM file, returning them with the first record line. """
+    header = []
+    for line in iter(handle.readline, ''):
+        if not line.startswith('@'):
+            return header, line
+        header.append(line)
+    return header, None
+
+
+def _iter_body(first_line, handle):
+    """ Iterate over the record lines of a SAM file. """
+    if first_line is not None:
+        yield first_line
+        for line in handle:
+            yield line
+
+
+def _sq_name(line):
+    """ Get the reference name of an @SQ line. """
+    for field in line.rstrip("\n").split("\t")[1:]:
+        if field.startswith('SN:'):
+            return field[3:]
+    raise Exception('No SN field in @SQ line: {}'.format(line.rstrip()))
+
+
+def _merge_headers(headers):
+    """ Build the header of a single run from the shard headers: the header of the first shard with the @SQ
+    records of all shards in order of their first appearance. """
+    references = []
+    seen = set()
+    for header in headers:
+        for line in header:
+            if line.startswith('@SQ\t') and _sq_name(line) not in seen:
+                seen.add(_sq_name(line))
+                references.append(line)
+    first = headers[0]
+    if len(first) == 0:
+        return references
+    prefix = [line for line in first if line.startswith('@HD\t')]
+    rest = [line for line in first if not line.startswith(('@HD\t', '@SQ\t'))]
+    return prefix + references + rest
+
+
+def _iter_sorted_records(body, ref_ids, index):
+    """ Add coordinate sort keys and the shard index to record lines. """
+    for line in body:
+        fields = line.split("\t", 4)
+        yield coordinate_key(ref_ids.get(fields[2], -1), int(fields[3])), index, line
+
+
+def merge_shards(handles, out_handle):
+    """ Merge the SAM outputs of the shards of a PSL file into the output of a single run.
+
+    :param handles: SAM file handles of the shards in shard order.
+    :param out_handle: Output file handle.
+    :returns: None
+    """
+    headers, bodies = [], []
+    for handle in handles:
+        header, first_line = _read_header(handle)
+        headers.append(header)
+        bodies.append(_iter_body(first_line, handle))
+    header = _merge_headers(headers)
+    out_handle.writelines(header)
+    if not any(line.startswith('@HD\t') and '\tSO:coordinate' in line for line in header):
+        for body in bodies:
+            out_handle.writelines(body)
+        return
+    # Sorted shards can only be merged if they sort by the same references:
+    references = [[line for line in shard_header if line.startswith('@SQ\t')] for shard_header in headers]
+    if any(shard_references != references[0] for shard_references in references):
+        raise Exception('Coordinate sorted shards need the same @SQ records.')
+    ref_ids = dict((_sq_name(line), ref_id) for ref_id, line in enumerate(references[0]))
+    # Ties are broken by the shard index, keeping the order of a single run:
+    merged = heapq.merge(*[_iter_sorted_records(body, ref_ids, index) for index, body in enumerate(bodies)])
+    for _, _, line in merged:
+        out_handle.write(line)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Generator of synthetic PSL alignments with matching reads and reference sequences. """
+
+import numpy as np
+
+from uncle_PSL.seq_util import reverse_complement
+
+_BASES = np.frombuffer('ACGT', dtype=np.uint8)
+
+PSL_HEADER = """psLayout version 3
+
+match\tmis- \trep. \tN's\tQ gap\tQ gap\tT gap\tT gap\tstrand\tQ        \tQ   \tQ    \tQ  \tT        \tT   \tT    \tT  \tblock\tblockSizes \tqStarts\t tStarts
+     \tmatch\tmatch\t   \tcount\tbases\tcount\tbases\t      \tname     \tsize\tstart\tend\tname     \tsize\tstart\tend\tcount
+---------------------------------------------------------------------------------------------------------------------------------------------------------------
+"""
+
+
+def _random_seq(rng, length):
+    """ Generate random DNA sequence. """
+    return _BASES[rng.randint(0, 4, size=length)].tostring()
+
+
+def _mutate(rng, seq, rate):
+    """ Introduce substitutions into a sequence, return mutated sequence and number of mismatches. """
+    if rate <= 0 or len(seq) == 0:
+        return seq, 0
+    codes = np.searchsorted(_BASES, np.frombuffer(seq, dtype=np.uint8))
+    positions = np.flatnonzero(rng.random_sample(len(seq)) < rate)
+    # Shift the base by 1-3 positions in ACGT, so it always changes:
+    codes[positions] = (codes[positions] + rng.randint(1, 4, size=len(positions))) % 4
+    return _BASES[codes].tostring(), len(positions)
+
+
+def simulate(nr_records=1000, read_length=1000, block_count=5, minus_fraction=0.5, max_clip=50, intron_length=0,
+             mismatch_rate=0.01, nr_targets=10, target_length=None, seed=1, pslx=False):
+    """ Simulate PSL records with the matching reads and reference sequences.
+
+    :param nr_records: Number of PSL records.
+    :param read_length: Approximate length of the reads.
+    :param block_count: Number of alignment blocks per record.
+    :param minus_fraction: Fraction of records on the minus strand.
+    :param max_clip: Maximum length of unaligned 5' and 3' flanks.
+    :param intron_length: Length of large target gaps added between every second pair of blocks (0: none).
+    :param mismatch_rate: Substitution rate in aligned blocks.
+    :param nr_targets: Number of target sequences.
+    :param target_length: Length of target sequences (default: large enough for the alignments).
+    :param seed: Random seed.
+    :param pslx: Add the query and target block sequences (in lower case, as written by BLAT) as pslx columns.
+    :returns: List of PSL lines, dictionary of reads and dictionary of target sequences.
+    :rtype: tuple
+    """
+    rng = np.random.RandomState(seed)
+    if target_length is None:
+        target_length = 2 * read_length + block_count * (intron_length + 20) + 1000
+    targets = dict(('target{}'.format(i), _random_seq(rng, target_length)) for i in xrange(nr_targets))
+    target_names = sorted(targets.keys())
+    lines = []
+    reads = {}
+    for rec in xrange(nr_records):
+        qname = 'read{}'.format(rec)
+        tname = target_names[rng.randint(0, nr_targets)]
+        target = targets[tname]
+        strand = '-' if rng.random_sample() < minus_fraction else '+'
+        five, three = rng.randint(0, max_clip + 1), rng.randint(0, max_clip + 1)
+        aligned = max(read_length - five - three, block_count)
+        sizes = [aligned // block_count] * block_count
+        sizes[-1] += aligned - sum(sizes)
+
+        # Walk the target, building the query in target orientation:
+        t_pos = rng.randint(0, max(target_length - aligned - block_count * (intron_length + 20), 1))
+        query = [_random_seq(rng, five)]
+        q_pos = five
+        q_starts, t_starts = [], []
+        q_blocks, t_blocks = [], []
+        matches = mismatches = 0
+        q_num = q_bases = t_num = t_bases = 0
+        for i, size in enumerate(sizes):
+            if i > 0:
+                insertion = rng.randint(1, 6) if rng.random_sample() < 0.3 else 0
+                deletion = rng.randint(1, 6) if rng.random_sample() < 0.3 else 0
+                if intron_length > 0 and i % 2 == 1:
+                    deletion = intron_length
+                if insertion == 0 and deletion == 0:
+                    # Adjacent blocks would be merged by the aligner:
+                    deletion = 1
+                if insertion > 0:
+                    query.append(_random_seq(rng, insertion))
+                    q_num, q_bases = q_num + 1, q_bases + insertion
+                if deletion > 0:
+                    t_num, t_bases = t_num + 1, t_bases + deletion
+                q_pos += insertion
+                t_pos += deletion
+            block, block_mismatches = _mutate(rng, target[t_pos:t_pos + size], mismatch_rate)
+            query.append(block)
+            q_blocks.append(block)
+            t_blocks.append(target[t_pos:t_pos + size])
+            q_starts.append(q_pos)
+            t_starts.append(t_pos)
+            matches += size - block_mismatches
+            mismatches += block_mismatches
+            q_pos += size
+            t_pos += size
+        query.append(_random_seq(rng, three))
+        query = ''.join(query)
+        q_size = len(query)
+        q_start, q_end = five, q_size - three
+        if strand == '-':
+            q_start, q_end = q_size - q_end, q_size - q_start
+            reads[qname] = reverse_complement(query)
+        else:
+            reads[qname] = query
+
+        fields = [matches, mismatches, 0, 0, q_num, q_bases, t_num, t_bases, strand, qname, q_size, q_start, q_end,
+                  tname, target_length, t_starts[0], t_starts[-1] + sizes[-1], block_count,
+                  ''.join('{},'.format(x) for x in sizes), ''.join('{},'.format(x) for x in q_starts),
+                  ''.join('{},'.format(x) for x in t_starts)]
+        if pslx:
+            # The query blocks of minus strand records are taken from the reverse complemented query:
+            fields += [''.join('{},'.format(x.lower()) for x in q_blocks),
+                       ''.join('{},'.format(x.lower()) for x in t_blocks)]
+        lines.append("\t".join(str(x) for x in fields) + "\n")
+    return lines, reads, targets
+
+
+def write_fasta(seqs, handle, line_width=None):
+    """ Write dictionary of sequences in FASTA format.
+
+    :param seqs: Dictionary of sequences.
+    :param handle: Output file handle.
+    :param line_width: Wrap sequences at this width (None: single line).
+    :returns: None
+    """
+    for name in sorted(seqs.keys()):
+        seq = seqs[name]
+        handle.write(">{}\n".format(name))
+        if line_width is None:
+            handle.write(seq + "\n")
+            continue
+        for pos in xrange(0, len(seq), line_width):
+            handle.write(seq[pos:pos + line_width] + "\n")
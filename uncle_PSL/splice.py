@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Splice junction motifs of skipped regions (N CIGAR operations) and the XS strand tag.
+
+The dinucleotides at the ends of a junction are read from the reference and matched against the canonical
+(GT-AG) and non-canonical (GC-AG, AT-AC) intron motifs on both strands. A spliced record gets the XS tag if all
+its junctions with a known motif agree on the strand. Junctions are usually shared by many reads, so their motifs
+are kept in an LRU cache.
+"""
+
+from collections import OrderedDict
+
+from uncle_PSL.lru_cache import LRUCache
+
+# Strand of the intron motifs, donor-acceptor on the forward strand of the target:
+MOTIF_STRANDS = {'GT-AG': '+', 'GC-AG': '+', 'AT-AC': '+', 'CT-AC': '-', 'CT-GC': '-', 'GT-AT': '-'}
+# Default number of cached junction motifs:
+DEFAULT_CACHE_SIZE = 1 << 16
+
+
+class SpliceJunctions:
+
+    """ Motifs and read counts of the splice junctions seen in the records. """
+
+    def __init__(self, reference, cache_size=DEFAULT_CACHE_SIZE, count=False, tags=True):
+        """ Initialise splice junctions object.
+
+        :param reference: ReferenceWindows object.
+        :param cache_size: Number of cached junction motifs.
+        :param count: Count the reads of each junction if true (e.g. for a junction BED file).
+        :param tags: Set the XS tags of the records if true, otherwise the junctions are only counted.
+        """
+        self.reference = reference
+        self.cache = LRUCache(cache_size)
+        self.counts = OrderedDict() if count else None
+        self.tags = tags
+
+    def motif(self, target, start, end):
+        """Get the donor-acceptor motif of a junction on the forward strand of the target.
+
+        :param self: object
+        :param target: Target name.
+        :param start: Zero-based start of the skipped region.
+        :param end: End of the skipped region (exclusive).
+        :returns: Motif string, e.g. GT-AG.
+        :rtype: str
+        """
+        key = (target, start, end)
+        motif = self.cache.get(key)
+        if motif is None:
+            motif = self.reference.fetch(target, start, start + 2) + '-' + self.reference.fetch(target, end - 2, end)
+            self.cache.put(key, motif)
+        return motif
+
+    def xs_strand(self, target, junctions):
+        """Get the transcript strand of a spliced record and count its junctions.
+
+        :param self: object
+        :param target: Target name.
+        :param junctions: List of (start, end) tuples of the skipped regions of the record.
+        :returns: '+' or '-', or None if no junction has a known motif, the motifs disagree or no tags are set.
+        """
+        if self.counts is not None:
+            for start, end in junctions:
+                key = (target, start, end)
+                self.counts[key] = self.counts.get(key, 0) + 1
+        if not self.tags:
+            return None
+        strands = set()
+        for start, end in junctions:
+            strand = MOTIF_STRANDS.get(self.motif(target, start, end))
+            if strand is not None:
+                strands.add(strand)
+        return strands.pop() if len(strands) == 1 else None
+
+    def merge(self, counts):
+        """Add junction read counts, e.g. from a worker process.
+
+        :param self: object
+        :param counts: List of ((target, start, end), count) pairs.
+        :returns: None
+        """
+        for key, count in counts:
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def write_bed(self, handle):
+        """Write the junctions as BED: the skipped region, the motif as name, the read count as score and the strand of
+        the motif ('.' if unknown).
+
+        :param self: object
+        :param handle: Output file handle.
+        :returns: None
+        """
+        for (target, start, end), count in self.counts.iteritems():
+            motif = self.motif(target, start, end)
+            handle.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(target, start, end, motif, count,
+                                                           MOTIF_STRANDS.get(motif, '.')))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# (c) 2016 Oxford Nanopore Technologies Ltd.
+
+""" Opt-in runtime statistics: cumulative per-stage timers and counters.
+
+Instrumented code takes a Stats object or None and only does the bookkeeping if it is not None,
+so the overhead is a single comparison per stage when statistics are disabled. The updates are locked, so a
+Stats object can be shared by the threads of a pipeline (e.g. the converter and the writer).
+"""
+
+from collections import OrderedDict
+import json
+import resource
+import threading
+from timeit import default_timer as clock
+
+
+class CountingHandle(object):
+
+    """ File handle wrapper counting the bytes written. """
+
+    def __init__(self, handle, stats, counter='bytes_written'):
+        """ Initialise counting handle object.
+
+        :param handle: Wrapped file handle.
+        :param stats: Stats object.
+        :param counter: Name of counter.
+        """
+        self.handle = handle
+        self.stats = stats
+        self.counter = counter
+
+    def write(self, data):
+        self.stats.count(self.counter, len(data))
+        self.handle.write(data)
+
+    def __getattr__(self, attr):
+        return getattr(self.handle, attr)
+
+
+class Stats:
+
+    """ Cumulative timers and counters. """
+
+    def __init__(self):
+        """ Initialise statistics object """
+        self.timers = OrderedDict()
+        self.counters = OrderedDict()
+        self.start = clock()
+        self.lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        """Add time spent in a stage.
+
+        :param self: object
+        :param stage: Name of stage.
+        :param seconds: Time spent.
+        :returns: None
+        """
+        with self.lock:
+            self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """Increment a counter.
+
+        :param self: object
+        :param name: Name of counter.
+        :param value: Increment.
+        :returns: None
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timed_iter(self, stage, iterable):
+        """Iterate over an iterable, adding the time spent in producing the items to a stage.
+
+        :param self: object
+        :param stage: Name of stage.
+        :param iterable: Iterable to time.
+        :returns: Generator of items.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, clock() - start)
+                return
+            self.add_time(stage, clock() - start)
+            yield item
+
+    def as_dict(self):
+        """Get timers and counters as a dictionary.
+
+        :param self: object
+        :returns: Dictionary with the timers and counters.
+        :rtype: OrderedDict
+        """
+        with self.lock:
+            return OrderedDict([('timers', OrderedDict(self.timers)), ('counters', OrderedDict(self.counters))])
+
+    def merge(self, other):
+        """Add timers and counters from another Stats object or its dictionary form (e.g. from a worker).
+
+        :param self: object
+        :param other: Stats object or dictionary.
+        :returns: None
+        """
+        if isinstance(other, Stats):
+            other = other.as_dict()
+        for stage, seconds in other['timers'].iteritems():
+            self.add_time(stage, seconds)
+        for name, value in other['counters'].iteritems():
+            self.count(name, value)
+
+    def report(self):
+        """Get final report including total wall time and peak memory.
+
+        :param self: object
+        :returns: Report dictionary.
+        :rtype: OrderedDict
+        """
+        report = self.as_dict()
+        report['wall_time'] = clock() - self.start
+        # ru_maxrss is in kilobytes on Linux:
+        report['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        report['peak_rss_children_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        return report
+
+    def write_json(self, handle):
+        """Write report in JSON format.
+
+        :param self: object
+        :param handle: Output file handle.
+        :returns: None
+        """
+        json.dump(self.report(), handle, indent=2)
+        handle.write("\n")
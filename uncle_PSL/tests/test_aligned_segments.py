@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os import path
+from cStringIO import StringIO
+
+from Bio import SeqIO
+
+from uncle_PSL import aligned_segments
+from uncle_PSL import psl2sam
+from uncle_PSL.fasta_store import read_references
+from uncle_PSL.sam_writer import new_header
+
+
+class IterSamRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        top = path.dirname(__file__)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines()
+        self.psl_lines = psl_lines[:5] + psl_lines[5:] * 10
+        self.reads = SeqIO.index(path.join(top, "data/reads.fas"), 'fasta')
+        self.references = read_references(path.join(top, "data/ref.fas"), write_index=False)
+
+    def tearDown(self):
+        self.reads.close()
+
+    def test_iter_sam_records(self):
+        """ Test that the records match the formatted output, in batches of the chunks. """
+        expected = StringIO()
+        psl2sam.psl2sam(self.psl_lines, expected, self.reads, soft_clip=False, n_limit=3)
+        batches = list(psl2sam.iter_sam_records(self.psl_lines, self.reads, soft_clip=False, n_limit=3,
+                                                chunk_size=7, read_cache_size=1 << 20))
+        self.assertTrue(len(batches) > 1)
+        self.assertTrue(all(0 < len(batch) <= 7 for batch in batches))
+        self.assertEqual(''.join(record.format() + "\n" for batch in batches for record in batch),
+                         expected.getvalue())
+
+    @unittest.skipIf(aligned_segments.pysam is None, 'pysam module not installed')
+    def test_aligned_segments(self):
+        """ Test that the AlignedSegment objects match the formatted output. """
+        header = new_header(self.references)
+        expected = StringIO()
+        psl2sam.psl2sam(self.psl_lines, expected, self.reads, header=header)
+        segments = [segment for batch in aligned_segments.iter_aligned_segments(self.psl_lines, header, self.reads)
+                    for segment in batch]
+        self.assertEqual(''.join(segment.to_string() + "\n" for segment in segments),
+                         ''.join(line for line in StringIO(expected.getvalue()) if not line.startswith('@')))
+
+    def test_parse_tags(self):
+        """ Test parsing of optional tags. """
+        self.assertEqual(aligned_segments._parse_tags("NM:i:3\tMD:Z:10^AC5\tSA:Z:ref,1,+,5M,60,0;"),
+                         [('NM', 3, 'i'), ('MD', '10^AC5', 'Z'), ('SA', 'ref,1,+,5M,60,0;', 'Z')])
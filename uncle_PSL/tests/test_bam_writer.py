@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import gzip
+import struct
+import unittest
+from os import path
+import tempfile
+from cStringIO import StringIO
+
+from Bio import SeqIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+
+
+def _read_bam(fname):
+    """ Simple decoding of BAM files into header text, references and core record fields. """
+    data = gzip.open(fname, 'rb').read()
+    assert data[:4] == 'BAM\1'
+    l_text = struct.unpack_from('<i', data, 4)[0]
+    text = data[8:8 + l_text]
+    pos = 8 + l_text
+    n_ref = struct.unpack_from('<i', data, pos)[0]
+    pos += 4
+    refs = []
+    for _ in xrange(n_ref):
+        l_name = struct.unpack_from('<i', data, pos)[0]
+        refs.append((data[pos + 4:pos + 3 + l_name], struct.unpack_from('<i', data, pos + 4 + l_name)[0]))
+        pos += 8 + l_name
+    records = []
+    while pos < len(data):
+        block_size, ref_id, rpos, l_name, mapq, _, n_cigar, flag, l_seq = struct.unpack_from('<iiiBBHHHi', data, pos)
+        name = data[pos + 36:pos + 35 + l_name]
+        cigar = struct.unpack_from('<{}I'.format(n_cigar), data, pos + 36 + l_name)
+        cigar = ''.join('{}{}'.format(c >> 4, 'MIDNSHP=X'[c & 0xf]) for c in cigar)
+        seq_start = pos + 36 + l_name + 4 * n_cigar
+        packed = bytearray(data[seq_start:seq_start + (l_seq + 1) // 2])
+        seq = ''.join('=ACMGRSVTWYHKDBN'[(packed[i // 2] >> (4 * (1 - i % 2))) & 0xf] for i in xrange(l_seq))
+        records.append([name, str(flag), refs[ref_id][0], str(rpos + 1), str(mapq), cigar, seq])
+        pos += block_size + 4
+    return text, refs, records
+
+
+class BamWriterTest(unittest.TestCase):
+
+    def _convert(self, **kwargs):
+        """ Convert test data into BAM and SAM format. """
+        top = path.dirname(__file__)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines() * 20
+        reads = SeqIO.index(path.join(top, "data/reads.fas"), 'fasta')
+        sam = StringIO()
+        psl2sam.psl2sam(psl_lines, sam, reads)
+        bam = tempfile.NamedTemporaryFile(prefix='test_bam_writer', suffix='.bam')
+        psl2sam.psl2sam(psl_lines, bam, reads, bam=True, **kwargs)
+        bam.flush()
+        reads.close()
+        expected = [l.split('\t')[:6] + [l.split('\t')[9]] for l in sam.getvalue().splitlines()]
+        return _read_bam(bam.name), expected
+
+    def test_bam_output(self):
+        """ Test BAM output against SAM output. """
+        (text, refs, records), expected = self._convert(bam_threads=3)
+        self.assertEqual(text, '@SQ\tSN:ref\tLN:171\n')
+        self.assertEqual(refs, [('ref', 171)])
+        self.assertEqual(records, expected)
+
+    def test_bam_output_parallel(self):
+        """ Test BAM output with worker processes. """
+        (_, refs, records), expected = self._convert(processes=2, chunk_size=3)
+        self.assertEqual(refs, [('ref', 171)])
+        self.assertEqual(records, expected)
+
+    def test_bam_output_long_reads(self):
+        """ Test BAM output of hard clipped long reads. """
+        lines, reads, _ = simulate.simulate(nr_records=4, read_length=100000, block_count=3, max_clip=500)
+        sam = StringIO()
+        psl2sam.psl2sam(lines, sam, reads, soft_clip=False)
+        bam = tempfile.NamedTemporaryFile(prefix='test_bam_writer', suffix='.bam')
+        psl2sam.psl2sam(lines, bam, reads, soft_clip=False, bam=True)
+        bam.flush()
+        expected = [l.split('\t')[:6] + [l.split('\t')[9]] for l in sam.getvalue().splitlines()]
+        self.assertEqual(_read_bam(bam.name)[2], expected)
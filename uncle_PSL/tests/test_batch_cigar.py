@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from os import path
+
+from uncle_PSL import psl2sam
+from uncle_PSL import batch_cigar
+from uncle_PSL.records import PslRecord
+
+
+def _random_psl_fields(rng):
+    """ Generate a random, consistent PSL record split into fields. """
+    block_count = rng.randint(1, 6)
+    block_sizes = [rng.randint(1, 50) for _ in xrange(block_count)]
+    q_starts, t_starts = [], []
+    qs, ts = rng.randint(0, 30), rng.randint(0, 30)
+    for bs in block_sizes:
+        q_starts.append(qs)
+        t_starts.append(ts)
+        qs += bs + rng.choice([0, 0, rng.randint(1, 10)])
+        ts += bs + rng.choice([0, 0, rng.randint(1, 200)])
+    q_size = qs + rng.randint(0, 30)
+    t_size = ts + rng.randint(0, 30)
+    strand = rng.choice(['+', '-', '++', '+-', '-+', '--'])
+    join = lambda x: ','.join(str(v) for v in x) + ','
+    return ['100', str(rng.randint(0, 5)), '0', str(rng.randint(0, 2)), '0', '0', '0', '0', strand, 'q', str(q_size),
+            str(q_starts[0]), str(q_starts[-1] + block_sizes[-1]), 't', str(t_size), str(t_starts[0]),
+            str(t_starts[-1] + block_sizes[-1]), str(block_count), join(block_sizes), join(q_starts), join(t_starts)]
+
+
+class BatchCigarTest(unittest.TestCase):
+
+    def _per_record(self, fields, soft_clip, n_limit):
+        """ Compute CIGAR and NM through the per-record path. """
+        sam = psl2sam.psl_rec2sam_rec(PslRecord(fields), psl2sam.SamWriter(None), None, soft_clip, n_limit)
+        return sam.cigar, sam.tags
+
+    def test_batch_cigar(self):
+        """ Test that batch CIGAR and NM computation matches the per-record path. """
+        rng = random.Random(42)
+        records = [_random_psl_fields(rng) for _ in xrange(300)]
+        top = path.dirname(__file__)
+        records.extend(list(psl2sam._iter_fields(open(path.join(top, "data/blat_top.psl"), 'r'))))
+        for soft_clip, n_limit in ((True, None), (False, 3), (True, 100)):
+            res = batch_cigar.batch_cigar(batch_cigar.columns_from_fields(records), soft_clip, n_limit)
+            batch = [(cigar, 'NM:i:{}'.format(nm)) for cigar, nm in zip(res['cigar'], res['NM'])]
+            expected = [self._per_record(list(fields), soft_clip, n_limit) for fields in records]
+            self.assertEqual(expected, batch)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import json
+import shutil
+import tempfile
+import unittest
+import zlib
+from os import path
+
+from uncle_PSL import checkpoint
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.sam_writer import new_header
+
+
+class FailingReads(dict):
+
+    """ Reads failing after a number of lookups, to interrupt a conversion. """
+
+    def __init__(self, reads, lookups):
+        dict.__init__(self, reads)
+        self.lookups = lookups
+
+    def __contains__(self, name):
+        self.lookups -= 1
+        if self.lookups < 0:
+            raise IOError('Interrupted')
+        return dict.__contains__(self, name)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_checkpoint')
+        lines, self.reads, targets = simulate.simulate(nr_records=500, read_length=200, block_count=3)
+        self.header = new_header(sorted((name, len(seq)) for name, seq in targets.iteritems()))
+        self.psl = path.join(self.tmp_dir, 'input.psl')
+        with open(self.psl, 'w') as handle:
+            handle.write("psLayout version 3\n\n")
+            handle.writelines(lines)
+        self.out = path.join(self.tmp_dir, 'output.sam')
+        self.ckpt = self.out + '.ckpt'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _convert(self, reads, checkpointer, resume=False, processes=None):
+        with open(self.psl, 'rb') as psl_handle, open(self.out, 'r+b' if resume else 'wb') as out_handle:
+            if resume:
+                checkpointer = checkpoint.resume(self.ckpt, psl_handle, out_handle, interval=40)
+            psl2sam.psl2sam(psl_handle, out_handle, reads, processes=processes, chunk_size=30, header=self.header,
+                            checkpointer=checkpointer)
+
+    def test_resume(self):
+        """ Test that a resumed conversion gives the output and checksum of a conversion from scratch. """
+        self._convert(self.reads, None)
+        expected = open(self.out, 'rb').read()
+        for processes in (None, 3):
+            self._convert(self.reads, checkpoint.Checkpointer(self.ckpt, interval=40), processes=processes)
+            self.assertEqual(open(self.out, 'rb').read(), expected)
+            state = json.load(open(self.ckpt))
+            self.assertEqual((state['complete'], state['records'], state['output_offset'], state['crc32']),
+                             (True, 500, len(expected), zlib.crc32(expected) & 0xffffffff))
+
+        self.assertRaises(IOError, self._convert, FailingReads(self.reads, 333),
+                          checkpoint.Checkpointer(self.ckpt, interval=40))
+        state = json.load(open(self.ckpt))
+        self.assertFalse(state['complete'])
+        self.assertTrue(0 < state['records'] < 333)
+        self._convert(self.reads, None, resume=True)
+        self.assertEqual(open(self.out, 'rb').read(), expected)
+        self.assertEqual(json.load(open(self.ckpt))['crc32'], zlib.crc32(expected) & 0xffffffff)
+
+    def test_requirements(self):
+        """ Test that checkpoints are refused for outputs written at the end. """
+        with open(self.psl, 'rb') as psl_handle, open(self.out, 'wb') as out_handle:
+            self.assertRaises(Exception, psl2sam.psl2sam, psl_handle, out_handle, None, header=new_header(),
+                              checkpointer=checkpoint.Checkpointer(self.ckpt))
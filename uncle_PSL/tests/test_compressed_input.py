@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import gzip
+import shutil
+import tempfile
+import unittest
+from os import path
+
+from uncle_PSL import compressed_input
+from uncle_PSL.bam_writer import BgzfWriter
+
+
+class _Pipe(object):
+    """ Non-seekable handle. """
+
+    def __init__(self, fname):
+        self.handle = open(fname, 'rb')
+
+    def read(self, size=-1):
+        return self.handle.read(size)
+
+    def readline(self):
+        return self.handle.readline()
+
+    def __iter__(self):
+        return iter(self.handle)
+
+
+class CompressedInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_compressed_input')
+        psl = path.join(path.dirname(__file__), "data/blat_top.psl")
+        self.lines = open(psl, 'rb').readlines() * 3000
+        self.data = "".join(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _check(self, fname, fmt, threads=1):
+        """ Check format detection and decompressed lines. """
+        self.assertEqual(compressed_input.detect_format(open(fname, 'rb').read(18)), fmt)
+        self.assertEqual(list(compressed_input.open_input(fname, threads)), self.lines)
+
+    def test_plain(self):
+        """ Test plain input from files and non-seekable handles. """
+        fname = path.join(self.tmp_dir, 'plain.psl')
+        open(fname, 'wb').write(self.data)
+        self._check(fname, 'plain')
+        self.assertEqual(list(compressed_input.open_input(_Pipe(fname))), self.lines)
+
+    def test_gzip(self):
+        """ Test multi-member gzip input. """
+        fname = path.join(self.tmp_dir, 'input.psl.gz')
+        half = len(self.data) // 2
+        for part, mode in ((self.data[:half], 'wb'), (self.data[half:], 'ab')):
+            handle = gzip.open(fname, mode)
+            handle.write(part)
+            handle.close()
+        self._check(fname, 'gzip')
+        self.assertEqual(list(compressed_input.open_input(_Pipe(fname))), self.lines)
+
+    def test_bgzf(self):
+        """ Test BGZF input with parallel block decompression. """
+        fname = path.join(self.tmp_dir, 'input.psl.bgz')
+        handle = open(fname, 'wb')
+        writer = BgzfWriter(handle)
+        writer.write(self.data)
+        writer.finish()
+        handle.close()
+        self._check(fname, 'bgzf')
+        self._check(fname, 'bgzf', threads=3)
+
+    @unittest.skipIf(compressed_input.zstandard is None, 'zstandard module not installed')
+    def test_zstd(self):
+        """ Test zstd input. """
+        fname = path.join(self.tmp_dir, 'input.psl.zst')
+        open(fname, 'wb').write(compressed_input.zstandard.ZstdCompressor().compress(self.data))
+        self._check(fname, 'zstd')
+
+    @unittest.skipIf(compressed_input.zstandard is None, 'zstandard module not installed')
+    def test_zstd_frames(self):
+        """ Test zstd input of several frames, as written by pzstd or by concatenating files. """
+        fname = path.join(self.tmp_dir, 'input.psl.zst')
+        compressor = compressed_input.zstandard.ZstdCompressor()
+        third = len(self.lines) // 3
+        with open(fname, 'wb') as handle:
+            for part in (self.lines[:third], self.lines[third:2 * third], self.lines[2 * third:]):
+                handle.write(compressor.compress(''.join(part)))
+        self._check(fname, 'zstd')
+        self.assertEqual(list(compressed_input.open_input(_Pipe(fname))), self.lines)
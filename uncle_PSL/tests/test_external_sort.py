@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import random
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.external_sort import ExternalSorter, coordinate_key
+from uncle_PSL.sam_writer import new_header
+from uncle_PSL.tests.test_bam_writer import _read_bam
+
+
+class ExternalSortTest(unittest.TestCase):
+
+    def test_sorter(self):
+        """ Test that spilled and in-memory runs are merged in key order, keeping the input order of equal keys. """
+        rng = random.Random(7)
+        records = [(coordinate_key(rng.randint(-1, 3), rng.randint(1, 50)), 'record{}\n'.format(i))
+                   for i in xrange(2000)]
+        self.assertTrue(coordinate_key(-1, 1) > coordinate_key(3, 50))
+        for memory in (1 << 20, 500):
+            sorter = ExternalSorter(memory)
+            for key, data in records:
+                sorter.add(key, data)
+            self.assertEqual(len(sorter.runs) > 0, memory == 500)
+            merged = ''.join(sorter.merged())
+            sorter.close()
+            self.assertEqual(merged, ''.join(data for key, data in sorted(records, key=lambda record: record[0])))
+
+    def test_sorted_output(self):
+        """ Test coordinate sorted SAM and BAM output, with and without worker processes. """
+        lines, reads, _ = simulate.simulate(nr_records=500, read_length=100, block_count=2, nr_targets=4)
+        plain = StringIO()
+        psl2sam.psl2sam(lines, plain, reads)
+        records = [line.split("\t") for line in plain.getvalue().splitlines(True)]
+        order = []
+        for fields in records:
+            if fields[2] not in order:
+                order.append(fields[2])
+        expected = sorted(records, key=lambda fields: (order.index(fields[2]), int(fields[3])))
+        for processes in (None, 3):
+            out = StringIO()
+            psl2sam.psl2sam(lines, out, reads, processes=processes, chunk_size=40, sort_memory=4096,
+                            header=new_header())
+            sam_lines = out.getvalue().splitlines(True)
+            self.assertEqual(sam_lines[0], "@HD\tVN:1.6\tSO:coordinate\n")
+            self.assertEqual([line.split("\t")[1] for line in sam_lines[1:5]], ['SN:' + name for name in order])
+            self.assertEqual([line.split("\t") for line in sam_lines[6:]], expected)
+
+            bam = tempfile.NamedTemporaryFile(prefix='test_external_sort', suffix='.bam')
+            psl2sam.psl2sam(lines, bam, reads, processes=processes, chunk_size=40, sort_memory=4096, bam=True)
+            bam.flush()
+            bam_records = _read_bam(bam.name)[2]
+            bam.close()
+            self.assertEqual([(record[0], record[2], record[3]) for record in bam_records],
+                             [(fields[0], fields[2], fields[3]) for fields in expected])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from os import path
+from cStringIO import StringIO
+
+from Bio import SeqIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL.fasta_store import FastaStore
+
+
+class FastaStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_fasta_store')
+        self.fasta = path.join(self.tmp_dir, 'seqs.fas')
+        with open(self.fasta, 'w') as handle:
+            handle.write(">s1 description\nACGTA\nCGTAC\nGG\n>s2\nTTTT\n>s3\n\n>s4\nAC\r\nGT\r\nA\r\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_index(self):
+        """ Test building and reading samtools compatible index. """
+        store = FastaStore(self.fasta)
+        self.assertEqual(open(self.fasta + '.fai').read(),
+                         "s1\t12\t16\t5\t6\ns2\t4\t35\t4\t5\ns3\t0\t44\t0\t0\ns4\t5\t49\t2\t4\n")
+        store.close()
+        store = FastaStore(self.fasta)
+        self.assertEqual(store.keys(), ['s1', 's2', 's3', 's4'])
+        for rec in SeqIO.parse(self.fasta, 'fasta'):
+            self.assertEqual(store[rec.id], str(rec.seq))
+        self.assertEqual(store.fetch('s1', 3, 11), 'TACGTACG')
+        self.assertEqual(store.fetch('s4', 1, 4), 'CGT')
+        self.assertEqual(store.length('s1'), 12)
+        self.assertTrue('s2' in store)
+        self.assertFalse('s5' in store)
+        store.close()
+
+    def test_psl2sam(self):
+        """ Test conversion using a FASTA store against a Biopython index. """
+        top = path.dirname(__file__)
+        fasta = path.join(self.tmp_dir, 'reads.fas')
+        shutil.copy(path.join(top, 'data/reads.fas'), fasta)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines() * 10
+        bio_reads = SeqIO.index(fasta, 'fasta')
+        expected = StringIO()
+        psl2sam.psl2sam(psl_lines, expected, bio_reads)
+        bio_reads.close()
+        store = FastaStore(fasta)
+        for processes in (None, 2):
+            res = StringIO()
+            psl2sam.psl2sam(psl_lines, res, store, processes=processes, chunk_size=3)
+            self.assertEqual(expected.getvalue(), res.getvalue())
+        store.close()
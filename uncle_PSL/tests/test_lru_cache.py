@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from uncle_PSL.lru_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        """ Test that the least recently used item is evicted and hits/misses are counted. """
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        cache.put('c', 4)
+        self.assertEqual((len(cache), 'a' in cache, cache.get('c')), (2, True, 4))
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+    def test_sized_eviction(self):
+        """ Test eviction by total item size, keeping the newest item even if it is larger than the limit. """
+        cache = LRUCache(5, sizeof=len)
+        cache.put('a', 'xx')
+        cache.put('b', 'xxx')
+        cache.put('a', 'x')
+        self.assertEqual((cache.size, len(cache)), (4, 2))
+        cache.put('c', 'xxx')
+        self.assertEqual((cache.size, 'b' in cache, 'a' in cache), (4, False, True))
+        cache.put('d', 'xxxxxxx')
+        self.assertEqual((cache.size, list(cache.items)), (7, ['d']))
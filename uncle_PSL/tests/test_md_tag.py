@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import re
+import shutil
+import tempfile
+import unittest
+from os import path
+from cStringIO import StringIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.fasta_store import FastaStore, ReferenceWindows
+from uncle_PSL.md_tag import compare_blocks, md_nm
+
+
+def _walk_md(seq, target, pos, cigar):
+    """ Compute MD and NM by walking the CIGAR base by base. """
+    md, nm, matched = [], 0, 0
+    q_pos, t_pos = 0, pos
+    for length, op in cigar:
+        if op == 'M':
+            for a, b in zip(seq[q_pos:q_pos + length].upper(), target[t_pos:t_pos + length].upper()):
+                if a == b and a != 'N':
+                    matched += 1
+                else:
+                    md.append("{}{}".format(matched, b))
+                    matched, nm = 0, nm + 1
+        elif op == 'D':
+            md.append("{}^{}".format(matched, target[t_pos:t_pos + length].upper()))
+            matched, nm = 0, nm + length
+        elif op == 'I':
+            nm += length
+        if op in 'MIS':
+            q_pos += length
+        if op in 'MDN':
+            t_pos += length
+    md.append(str(matched))
+    return ''.join(md), nm
+
+
+class MdTagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_md_tag')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _reference(self, seqs, window_size):
+        """ Write sequences to FASTA and open them as reference windows. """
+        fasta = path.join(self.tmp_dir, 'ref.fas')
+        with open(fasta, 'w') as handle:
+            simulate.write_fasta(seqs, handle, line_width=7)
+        return ReferenceWindows(FastaStore(fasta), window_size=window_size, max_windows=3)
+
+    def test_md_nm(self):
+        """ Test MD and NM of a record with mismatches, N bases, an insertion, a deletion and a skipped region. """
+        reference = self._reference({'t': 'acgtACGTNNAACCGGTTacgtacgtacgtAAAA'}, 5)
+        seq = 'CCACGTACGANNAGTccggAAACG'
+        # Mismatch, two N bases, 2 base insertion, 1 base deletion, 14 base skipped region and a final mismatch:
+        blockSizes, qStarts, tStarts = [8, 3, 4, 4], [2, 10, 15, 19], [0, 8, 12, 30]
+        self.assertEqual(md_nm(seq, reference, 't', blockSizes, qStarts, tStarts, 4, n_limit=10),
+                         ('7T0N0N1^A7A0', 7))
+        # Without N limit the skipped region is a deletion:
+        self.assertEqual(md_nm(seq, reference, 't', blockSizes, qStarts, tStarts, 4),
+                         ('7T0N0N1^A4^TTACGTACGTACGT3A0', 21))
+        reference.close()
+
+    def test_compare_blocks(self):
+        """ Test MD and NM of concatenated blocks, with and without the deleted bases. """
+        target = 'acgtACGTNNAACCGGTTacgtacgtacgtAAAA'.upper()
+        seq = 'CCACGTACGANNAGTccggAAACG'.upper()
+        blockSizes, qStarts, tStarts = [8, 3, 4, 4], [2, 10, 15, 19], [0, 8, 12, 30]
+        read_blocks = ''.join(seq[q:q + size] for q, size in zip(qStarts, blockSizes))
+        ref_blocks = ''.join(target[t:t + size] for t, size in zip(tStarts, blockSizes))
+        deleted = lambda start, end: target[start:end]
+        self.assertEqual(compare_blocks(read_blocks, ref_blocks, blockSizes, qStarts, tStarts, 4, 10, deleted),
+                         ('7T0N0N1^A7A0', 7))
+        # The MD string needs the deleted bases, the edit distance does not:
+        self.assertEqual(compare_blocks(read_blocks, ref_blocks, blockSizes, qStarts, tStarts, 4, 10), (None, 7))
+        self.assertEqual(compare_blocks(read_blocks[:11], ref_blocks[:11], blockSizes[:2], qStarts[:2], tStarts[:2], 2),
+                         ('7T0N0N1', 3))
+
+    def test_simulated(self):
+        """ Test MD and NM of simulated alignments against walking the CIGAR. """
+        lines, reads, targets = simulate.simulate(nr_records=100, read_length=300, block_count=4, intron_length=100,
+                                                  mismatch_rate=0.05, target_length=2000)
+        reference = self._reference(targets, 256)
+        for processes in (None, 2):
+            out = StringIO()
+            psl2sam.psl2sam(lines, out, reads, n_limit=50, processes=processes, chunk_size=30, reference=reference)
+            for line in out.getvalue().splitlines():
+                fields = line.split("\t")
+                cigar = [(int(l), op) for l, op in re.findall(r'(\d+)([MIDNS])', fields[5])]
+                md, nm = _walk_md(fields[9], targets[fields[2]], int(fields[3]) - 1, cigar)
+                self.assertEqual(fields[11:], ['NM:i:{}'.format(nm), 'MD:Z:{}'.format(md)])
+        self.assertTrue(reference.cache.hits > 0)
+        reference.close()
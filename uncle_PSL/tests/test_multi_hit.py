@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from cStringIO import StringIO
+
+from uncle_PSL import multi_hit
+from uncle_PSL import parallel
+from uncle_PSL import psl2sam
+from uncle_PSL.stats import Stats
+
+# Query r1 has a primary hit, a chimeric hit of its other half and a weaker secondary hit of the first half:
+PSL_LINES = [
+    "100\t0\t0\t0\t0\t0\t0\t0\t+\tr1\t200\t0\t100\tt1\t5000\t1000\t1100\t1\t100,\t0,\t1000,\n",
+    "90\t10\t0\t0\t0\t0\t0\t0\t+\tr1\t200\t0\t100\tt3\t5000\t10\t110\t1\t100,\t0,\t10,\n",
+    "95\t5\t0\t0\t0\t0\t0\t0\t-\tr1\t200\t100\t200\tt2\t5000\t500\t600\t1\t100,\t0,\t500,\n",
+    "50\t0\t0\t0\t0\t0\t0\t0\t+\tr2\t50\t0\t50\tt1\t5000\t20\t70\t1\t50,\t0,\t20,\n",
+]
+
+
+class MultiHitTest(unittest.TestCase):
+
+    def _convert(self, lines, **kwargs):
+        """ Convert PSL lines in multi-hit mode, return SAM records split into fields. """
+        out = StringIO()
+        psl2sam.psl2sam(lines, out, None, multi_hits=True, **kwargs)
+        return [line.split("\t") for line in out.getvalue().splitlines()]
+
+    def test_annotate_hits(self):
+        """ Test flags, mapping qualities and SA tags. """
+        records = self._convert(PSL_LINES)
+        self.assertEqual([(r[0], r[1], r[2], r[4], r[5]) for r in records],
+                         [('r1', '0', 't1', '12', '100M100S'), ('r1', '256', 't3', '0', '100M100S'),
+                          ('r1', '2064', 't2', '60', '100M100S'), ('r2', '0', 't1', '60', '50M')])
+        self.assertEqual(records[0][11:], ['NM:i:0', 'SA:Z:t2,501,-,100M100S,60,5;'])
+        self.assertEqual(records[1][11:], ['NM:i:10'])
+        self.assertEqual(records[2][11:], ['NM:i:5', 'SA:Z:t1,1001,+,100M100S,12,0;'])
+        self.assertEqual(records[3][11:], ['NM:i:0'])
+
+    def test_grouping(self):
+        """ Test that partitioned, parallel and grouped conversion agree. """
+        rng = random.Random(3)
+        lines = []
+        for i in xrange(300):
+            for line in PSL_LINES[:rng.randint(1, 3)]:
+                lines.append(line.replace("\tr1\t", "\tq{}\t".format(i)))
+        grouped = self._convert(lines)
+        self.assertEqual(self._convert(lines, processes=3, chunk_size=7), grouped)
+        shuffled = list(lines)
+        rng.shuffle(shuffled)
+        partitioned = self._convert(shuffled, partitions=5)
+        self.assertEqual(sorted(partitioned), sorted(grouped))
+        # Ungrouped input is rejected unless partitioned:
+        for kwargs in ({}, {'processes': 3, 'chunk_size': 7}):
+            self.assertRaises(Exception, self._convert, shuffled, **kwargs)
+        self.assertRaises(Exception, list, psl2sam.iter_sam_records(shuffled, multi_hits=True))
+
+    def test_whitespace_separated(self):
+        """ Test that space separated lines are grouped and partitioned, and malformed lines counted as skipped. """
+        lines = ["psLayout version 3\n", "\n"] + [line.replace("\t", " ") for line in PSL_LINES] + \
+            ["malformed line\n", "1 2 3 4 5 6 7 8 + r3 x\n"]
+        self.assertEqual(multi_hit.line_query(lines[2]), 'r1')
+        expected = self._convert(PSL_LINES)
+        for kwargs in ({}, {'processes': 2, 'chunk_size': 1}, {'partitions': 4}):
+            stats = Stats()
+            records = self._convert(lines, stats=stats, **kwargs)
+            self.assertEqual(sorted(records), sorted(expected))
+            self.assertEqual(stats.counters['skipped_lines'], 2)
+
+    def test_chunks_keep_groups(self):
+        """ Test that chunks do not split the lines of a query. """
+        lines = ['a\n', 'a\n', 'b\n', 'b\n', 'b\n', 'c\n', 'd\n', 'd\n']
+        chunks = list(parallel.iter_chunks(lines, 2, key=lambda line: line))
+        self.assertEqual(chunks, [['a\n', 'a\n'], ['b\n', 'b\n', 'b\n'], ['c\n', 'd\n', 'd\n']])
+        self.assertEqual(multi_hit.line_query(PSL_LINES[0]), 'r1')
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import unittest
+
+from uncle_PSL import parallel
+
+
+def _square(chunk):
+    return chunk * chunk
+
+
+def _killed(chunk):
+    if chunk == 3:
+        os._exit(1)
+    return chunk
+
+
+def _unpicklable(chunk):
+    if chunk == 3:
+        return threading.Lock()
+    return chunk
+
+
+class ParallelTest(unittest.TestCase):
+
+    def test_map_chunks(self):
+        """ Test ordered results of worker processes. """
+        self.assertEqual(list(parallel.map_chunks(_square, xrange(50), {}, 3)), [x * x for x in xrange(50)])
+
+    def test_lost_chunks(self):
+        """ Test that chunks lost to killed workers or unpicklable results raise instead of blocking. """
+        for func in (_killed, _unpicklable):
+            self.assertRaises(RuntimeError, list, parallel.map_chunks(func, xrange(10), {}, 2))
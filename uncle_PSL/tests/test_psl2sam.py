@@ -1,8 +1,18 @@
+import re
+import shutil
 import unittest
 from os import path
 import tempfile
+from cStringIO import StringIO
 
+from Bio import SeqIO
+
+from uncle_PSL import __version__
 from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.fasta_store import FastaStore, ReferenceWindows, read_references
+from uncle_PSL.sam_writer import new_header
+from uncle_PSL.seq_util import reverse_complement
 
 
 class ExamplePsl2sam(unittest.TestCase):
@@ -29,3 +39,131 @@ class ExamplePsl2sam(unittest.TestCase):
         psl_records = self._parse_sam(res_sam.name)
         res_sam.close()
         self.assertEqual(bwa_records, psl_records)
+
+    def test_psl2sam_parallel(self):
+        """ Test that conversion with worker processes matches serial conversion. """
+        top = path.dirname(__file__)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines()
+        psl_lines = psl_lines[:5] + psl_lines[5:] * 50
+        reads = SeqIO.index(path.join(top, "data/reads.fas"), 'fasta')
+        serial = StringIO()
+        psl2sam.psl2sam(psl_lines, serial, reads, soft_clip=False, n_limit=3)
+        ordered = StringIO()
+        psl2sam.psl2sam(psl_lines, ordered, reads, soft_clip=False, n_limit=3, processes=3, chunk_size=7)
+        unordered = StringIO()
+        psl2sam.psl2sam(psl_lines, unordered, reads, soft_clip=False, n_limit=3, processes=3, ordered=False,
+                        chunk_size=7)
+        reads.close()
+        self.assertEqual(serial.getvalue(), ordered.getvalue())
+        self.assertEqual(sorted(serial.getvalue().splitlines()), sorted(unordered.getvalue().splitlines()))
+
+    def test_psl2sam_pipeline(self):
+        """ Test that pipelined conversion matches serial conversion and passes on errors. """
+        top = path.dirname(__file__)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines()
+        psl_lines = psl_lines[:5] + psl_lines[5:] * 50
+        reads = SeqIO.index(path.join(top, "data/reads.fas"), 'fasta')
+        serial = StringIO()
+        psl2sam.psl2sam(psl_lines, serial, reads, soft_clip=False, n_limit=3, header=new_header())
+        for processes in (None, 3):
+            out = StringIO()
+            psl2sam.psl2sam(psl_lines, out, reads, soft_clip=False, n_limit=3, processes=processes, chunk_size=7,
+                            header=new_header(), pipeline=True)
+            self.assertEqual(out.getvalue(), serial.getvalue())
+        reads.close()
+        fields = psl_lines[5].split("\t")
+        fields[8] = '+-+'
+        self.assertRaises(Exception, psl2sam.psl2sam, psl_lines + ["\t".join(fields)], StringIO(), None,
+                          chunk_size=7, pipeline=True)
+
+    def test_psl2sam_header(self):
+        """ Test @SQ records taken from the reference index and from the PSL records. """
+        top = path.dirname(__file__)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines()
+        references = read_references(path.join(top, "data/ref.fas"), write_index=False)
+        expected = "@HD\tVN:1.6\tSO:unsorted\n@SQ\tSN:ref\tLN:171\n@PG\tID:uncle_psl\tPN:uncle_psl\tVN:{}\n".format(
+            __version__)
+        plain = StringIO()
+        psl2sam.psl2sam(psl_lines, plain, None)
+        for references, processes in ((references, None), (None, None), (None, 3)):
+            out = StringIO()
+            psl2sam.psl2sam(psl_lines, out, None, processes=processes, chunk_size=7,
+                            header=new_header(references))
+            self.assertEqual(out.getvalue(), expected + plain.getvalue())
+
+    def test_psl2sam_long_reads(self):
+        """ Test hard clipping of long reads as buffer views and their output. """
+        lines, reads, _ = simulate.simulate(nr_records=8, read_length=100000, block_count=3, max_clip=500)
+        reads = dict((name, (seq, ''.join(chr(33 + i % 40) for i in xrange(len(seq)))))
+                     for name, seq in reads.iteritems())
+        soft = StringIO()
+        psl2sam.psl2sam(lines, soft, reads, soft_clip=True)
+        expected = []
+        for line in soft.getvalue().splitlines():
+            fields = line.split("\t")
+            clips = re.match(r'^(?:(\d+)S)?.*?(?:(\d+)S)?$', fields[5]).groups()
+            five, three = [int(clip) if clip is not None else 0 for clip in clips]
+            fields[5] = fields[5].replace('S', 'H')
+            fields[9], fields[10] = [field[five:len(field) - three] for field in fields[9:11]]
+            expected.append("\t".join(fields) + "\n")
+        records = sum(psl2sam.iter_sam_records(lines, reads, soft_clip=False), [])
+        self.assertTrue(all(isinstance(record.seq, buffer) for record in records))
+        for kwargs in ({}, {'buffer_size': None}, {'processes': 2, 'chunk_size': 3}):
+            hard = StringIO()
+            psl2sam.psl2sam(lines, hard, reads, soft_clip=False, **kwargs)
+            self.assertEqual(hard.getvalue(), ''.join(expected))
+
+    def _reverse_target(self, line):
+        """ Express a plus strand pslx line on the reverse strands of the query and the target. """
+        fields = line.rstrip("\n").split("\t")
+        q_size, t_size = int(fields[10]), int(fields[14])
+        sizes = [int(x) for x in fields[18].split(',')[:-1]]
+        q_starts = [q_size - int(x) - size for x, size in zip(fields[19].split(',')[:-1], sizes)]
+        t_starts = [t_size - int(x) - size for x, size in zip(fields[20].split(',')[:-1], sizes)]
+        fields[8] = '--'
+        fields[18:21] = [''.join('{},'.format(x) for x in column[::-1]) for column in (sizes, q_starts, t_starts)]
+        fields[21:23] = [''.join('{},'.format(reverse_complement(x)) for x in column.split(',')[-2::-1])
+                         for column in fields[21:23]]
+        return "\t".join(fields) + "\n"
+
+    def test_psl2sam_pslx(self):
+        """ Test conversion of pslx records without reads against the conversion with reads and reference. """
+        tmp_dir = tempfile.mkdtemp(prefix='test_psl2sam')
+        for block_count, max_clip in ((1, 0), (4, 30)):
+            lines, reads, targets = simulate.simulate(nr_records=60, read_length=300, block_count=block_count,
+                                                      max_clip=max_clip, intron_length=100, pslx=True)
+            fasta = path.join(tmp_dir, 'targets.fas')
+            with open(fasta, 'w') as handle:
+                simulate.write_fasta(targets, handle)
+            reference = ReferenceWindows(FastaStore(fasta))
+            # The same records on the reverse strands convert into the same SAM records:
+            reversed_lines = [self._reverse_target(line) if line.split("\t")[8] == '+' else line for line in lines]
+            for soft_clip in (True, False):
+                expected = StringIO()
+                psl2sam.psl2sam(lines, expected, reads, soft_clip, n_limit=50, reference=reference)
+                expected = [line.split("\t") for line in expected.getvalue().splitlines()]
+                outputs = []
+                for kwargs in ({'reference': reference}, {}, {'processes': 2, 'chunk_size': 7}):
+                    for psl_lines in (lines, reversed_lines):
+                        out = StringIO()
+                        psl2sam.psl2sam(psl_lines, out, None, soft_clip, n_limit=50, **kwargs)
+                        outputs.append(out.getvalue())
+                        records = [line.split("\t") for line in out.getvalue().splitlines()]
+                        self.assertEqual(len(records), len(expected))
+                        for record, truth in zip(records, expected):
+                            self.assertEqual(record[:9] + record[10:12], truth[:9] + truth[10:12])
+                            self.assertTrue(record[9] in ('*', truth[9]))
+                            # The MD string needs the deleted bases, which are not part of pslx records:
+                            if 'reference' in kwargs or 'D' not in record[5]:
+                                self.assertEqual(record[12:], truth[12:])
+                            else:
+                                self.assertEqual(record[12:], [])
+                        seqs = [record[9] for record in records]
+                        if block_count == 1:
+                            self.assertTrue('*' not in seqs)
+                        elif not soft_clip:
+                            self.assertTrue(0 < seqs.count('*') < len(seqs))
+                self.assertEqual(outputs[0], outputs[1])
+                self.assertEqual(outputs[2:], outputs[3:4] * 4)
+            reference.close()
+        shutil.rmtree(tmp_dir)
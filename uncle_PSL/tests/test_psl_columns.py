@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+
+from uncle_PSL import batch_cigar
+from uncle_PSL import psl2sam
+from uncle_PSL import psl_columns
+from uncle_PSL import simulate
+from uncle_PSL.stats import Stats
+
+VALID_LINE = "1\t0\t0\t0\t0\t0\t0\t0\t+\tq\t10\t0\t10\tt\t100\t0\t10\t1\t10,\t0,\t0,\n"
+# Invalid integers, block lists not matching the block count or holding invalid elements:
+MALFORMED_LINES = [
+    "malformed line\n",
+    VALID_LINE.replace("\t0\t10\tt", "\t0\tx\tt"),
+    VALID_LINE.replace("\t0\t10\tt", "\t0\t1,0\tt"),
+    VALID_LINE.replace("\t0\t10\tt", "\t0\t\tt"),
+    VALID_LINE.replace("\t1\t10,", "\t2\t10,"),
+    VALID_LINE.replace("\t1\t10,\t0,\t0,", "\t0\t\t\t"),
+    VALID_LINE.replace("\t0,\t0,", "\t0,\t0,1,"),
+    VALID_LINE.replace("\t0,\t0,", "\t0,\t,0"),
+    VALID_LINE.replace("\t0,\t0,", "\t0,\t0a,"),
+    VALID_LINE.replace("\t0,\t0,", "\t0,\t0\r0,"),
+]
+
+
+class PslColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_psl_columns')
+        lines, _, _ = simulate.simulate(nr_records=300, read_length=200, block_count=4, intron_length=1000)
+        top = path.dirname(__file__)
+        self.lines = simulate.PSL_HEADER.splitlines(True) + lines + \
+            open(path.join(top, "data/blat_top.psl")).readlines()
+        self.psl = path.join(self.tmp_dir, 'input.psl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertColumnsEqual(self, columns, expected):
+        self.assertEqual(sorted(columns.keys()), sorted(expected.keys()))
+        for name, column in expected.iteritems():
+            self.assertEqual(list(columns[name]), list(column), name)
+
+    def _expected(self, lines):
+        return batch_cigar.columns_from_fields(list(psl2sam._iter_fields(lines)))
+
+    def test_parse_buffer(self):
+        """ Test that the columns match the line based parser, skipping the header and counting malformed lines. """
+        stats = Stats()
+        lines = self.lines[:100] + MALFORMED_LINES + self.lines[100:]
+        self.assertColumnsEqual(psl_columns.parse_buffer(''.join(lines), stats=stats), self._expected(self.lines))
+        self.assertEqual(stats.counters['skipped_lines'], len(MALFORMED_LINES))
+        # Carriage returns, no final newline and parsing from the middle of a buffer:
+        data = 'x' + ''.join(line.replace("\n", "\r\n") for line in self.lines).rstrip("\r\n")
+        self.assertColumnsEqual(psl_columns.parse_buffer(data, 1, len(data)), self._expected(self.lines))
+        self.assertColumnsEqual(psl_columns.parse_buffer(''), self._expected([]))
+        # Long names and lists without trailing commas:
+        lines = [VALID_LINE.replace("\tq\t", "\t" + "q" * 1000 + "\t"), VALID_LINE.replace(",", "")]
+        self.assertColumnsEqual(psl_columns.parse_buffer(''.join(lines)), self._expected(lines))
+
+    def test_whitespace_separated(self):
+        """ Test that lines separated by other whitespace are parsed like the line based parser. """
+        lines = self.lines[:50] + [self.lines[50].replace("\t", " ")] + self.lines[51:]
+        self.assertColumnsEqual(psl_columns.parse_buffer(''.join(lines)), self._expected(lines))
+
+    def test_whitespace_separated_malformed(self):
+        """ Test that malformed lines are dropped and counted in chunks parsed line by line. """
+        stats = Stats()
+        spaced = VALID_LINE.replace("\t", " ")
+        lines = [spaced] + MALFORMED_LINES + [spaced.replace(" q ", " q2 ")]
+        columns = psl_columns.parse_buffer(''.join(lines), stats=stats)
+        self.assertEqual(columns['qName'], ['q', 'q2'])
+        self.assertEqual((columns['blockCount'].tolist(), columns['tStarts'].tolist()), ([1, 1], [0, 0]))
+        self.assertEqual(stats.counters['skipped_lines'], len(MALFORMED_LINES))
+
+    def test_batches(self):
+        """ Test memory mapped and joined line batches against the line based parser and batch_cigar. """
+        with open(self.psl, 'w') as handle:
+            handle.writelines(self.lines)
+        expected = self._expected(self.lines)
+        with open(self.psl, 'rb') as handle:
+            mapped = list(psl_columns.iter_column_batches(handle, chunk_bytes=5000))
+        joined = list(psl_columns.iter_column_batches(iter(self.lines), chunk_bytes=5000))
+        for batches in (mapped, joined):
+            self.assertTrue(len(batches) > 5)
+            self.assertEqual(sum(len(batch['qName']) for batch in batches), len(expected['qName']))
+            self.assertEqual(np.concatenate([batch['tStarts'] for batch in batches]).tolist(),
+                             expected['tStarts'].tolist())
+            cigars = sum((batch_cigar.batch_cigar(batch, n_limit=100)['cigar'] for batch in batches), [])
+            self.assertEqual(cigars, batch_cigar.batch_cigar(expected, n_limit=100)['cigar'])
+
+    def test_pslx(self):
+        """ Test that the block sequences of pslx lines are ignored. """
+        lines, _, _ = simulate.simulate(nr_records=300, read_length=200, block_count=4, pslx=True)
+        lines = self.lines[:100] + lines
+        self.assertColumnsEqual(psl_columns.parse_buffer(''.join(lines)), self._expected(lines))
+        lines[50] = lines[50].replace("\t", " ")
+        self.assertColumnsEqual(psl_columns.parse_buffer(''.join(lines)), self._expected(lines))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from os import path
+
+from uncle_PSL import psl_index
+from uncle_PSL import simulate
+
+
+class PslIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_psl_index')
+        lines, _, _ = simulate.simulate(nr_records=500, read_length=300, block_count=3, intron_length=5000,
+                                        nr_targets=3, target_length=100000)
+        self.lines = ["psLayout version 3\n", "\n"] + lines
+        self.psl = path.join(self.tmp_dir, 'input.psl')
+        with open(self.psl, 'w') as handle:
+            handle.writelines(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _expected(self, name, start, end):
+        """ Lines of a region by a full scan. """
+        result = []
+        for line in self.lines[2:]:
+            fields = line.split()
+            if fields[13] == name and int(fields[16]) > start and (end is None or int(fields[15]) < end):
+                result.append(line)
+        return result
+
+    def test_parse_region(self):
+        """ Test parsing of region strings. """
+        self.assertEqual(psl_index.parse_region('chr1'), ('chr1', 0, None))
+        self.assertEqual(psl_index.parse_region('chr1:1,001'), ('chr1', 1000, None))
+        self.assertEqual(psl_index.parse_region('HLA:A:11-20'), ('HLA:A', 10, 20))
+        self.assertRaises(Exception, psl_index.parse_region, 'chr1:20-11')
+
+    def test_regions(self):
+        """ Test region queries against a full scan, with a built and a saved index. """
+        built = psl_index.build_index(self.psl, bin_size=1000)
+        built.write(self.psl + psl_index.INDEX_SUFFIX)
+        index = psl_index.open_index(self.psl)
+        self.assertEqual((index.bin_size, index.max_spans, index.ranges), (1000, built.max_spans, built.ranges))
+        partial = psl_index.open_index(self.psl, names=['target1'])
+        self.assertEqual((partial.bins.keys(), partial.ranges['target1']), (['target1'], built.ranges['target1']))
+        regions = [('target0', 0, None), ('target1', 20000, 30000), ('target2', 50000, 50001),
+                   ('target1', 85000, 100000), ('missing', 0, None)]
+        with open(self.psl, 'rb') as handle:
+            for name, start, end in regions:
+                lines = list(psl_index.iter_region(handle, index, name, start, end))
+                self.assertEqual(lines, self._expected(name, start, end))
+                self.assertEqual(len(lines) > 0, name != 'missing')
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import unittest
+from cStringIO import StringIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.read_cache import ReadCache
+from uncle_PSL.read_stream import ReadStream
+from uncle_PSL.stats import Stats
+
+
+class ReadCacheTest(unittest.TestCase):
+
+    def test_oriented(self):
+        """ Test cached lookups in both orientations, missing reads and eviction. """
+        cache = ReadCache({'r1': ('ACGTT', 'ABCDE'), 'r2': 'GGA'}, max_size=20)
+        self.assertEqual(cache.oriented('r1', True), ('AACGT', 'EDCBA'))
+        self.assertEqual(cache.oriented('r1', False), ('ACGTT', 'ABCDE'))
+        self.assertEqual(cache.oriented('r3', False), None)
+        self.assertEqual(cache.oriented('r3', True), None)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        # Evicts r1:
+        self.assertEqual(cache.oriented('r2', True), ('TCC', None))
+        self.assertEqual(cache.oriented('r1', False), ('ACGTT', 'ABCDE'))
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_conversion(self):
+        """ Test that the cache does not change the output and counts the lookups, with and without workers. """
+        lines, reads, _ = simulate.simulate(nr_records=300, read_length=150, block_count=3)
+        # Several hits per read, not split between the chunks of the workers:
+        lines = [line for line in lines for _ in xrange(3)]
+        expected = StringIO()
+        psl2sam.psl2sam(lines, expected, reads)
+        for processes in (None, 3):
+            for stream in (False, True):
+                out = StringIO()
+                stats = Stats()
+                source = ReadStream(StringIO(''.join('>{}\n{}\n'.format('read{}'.format(i), reads['read{}'.format(i)])
+                                                     for i in xrange(300)))) if stream else reads
+                psl2sam.psl2sam(lines, out, source, processes=processes, chunk_size=60, stats=stats,
+                                read_cache_size=1 << 20)
+                self.assertEqual(out.getvalue(), expected.getvalue())
+                counters = stats.as_dict()['counters']
+                self.assertEqual((counters['read_cache_hits'], counters['read_cache_misses']), (600, 300))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import random
+import re
+import shutil
+import tempfile
+import unittest
+from os import path
+from cStringIO import StringIO
+
+from Bio import SeqIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.read_stream import ReadStream, iter_reads
+from uncle_PSL.stats import Stats
+
+
+class ReadStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_read_stream')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_iter_reads(self):
+        """ Test parsing FASTA and FASTQ, including quality lines starting with '@'. """
+        fastq = "@r1 desc\nACGT\nAC\n+\n@@II\nI#\n\n@r2\nA\n+r2\n@\n"
+        self.assertEqual(list(iter_reads(StringIO(fastq))), [('r1', 'ACGTAC', '@@III#'), ('r2', 'A', '@')])
+        fasta = ">r1 desc\nACGT\nAC\n>r2\n\n>r3\nT\n"
+        self.assertEqual(list(iter_reads(StringIO(fasta))), [('r1', 'ACGTAC', None), ('r2', '', None),
+                                                             ('r3', 'T', None)])
+        stream = ReadStream(StringIO(fasta))
+        self.assertEqual((stream['r1'], stream['r1'], stream['r3']), (('ACGTAC', None),) * 2 + (('T', None),))
+        self.assertRaises(Exception, stream.__getitem__, 'r1')
+
+    def test_fastq_conversion(self):
+        """ Test base qualities from streamed and indexed FASTQ, with hard clipping and worker processes. """
+        lines, reads, _ = simulate.simulate(nr_records=200, read_length=150, block_count=3)
+        rng = random.Random(5)
+        names = ['read{}'.format(i) for i in xrange(len(lines))]
+        quals = dict((name, ''.join(chr(rng.randint(33, 73)) for _ in reads[name])) for name in names)
+        fastq = path.join(self.tmp_dir, 'reads.fq')
+        with open(fastq, 'w') as handle:
+            for name in names:
+                handle.write("@{}\n{}\n+\n{}\n".format(name, reads[name], quals[name]))
+
+        for soft_clip in (True, False):
+            out = StringIO()
+            index = SeqIO.index(fastq, 'fastq')
+            psl2sam.psl2sam(lines, out, index, soft_clip=soft_clip)
+            index.close()
+            for line in out.getvalue().splitlines():
+                fields = line.split("\t")
+                qual = quals[fields[0]][::-1] if fields[1] == '16' else quals[fields[0]]
+                seq = reads[fields[0]] if fields[1] == '0' else None
+                clip = re.match(r'(\d+)H', fields[5])
+                clip = int(clip.group(1)) if clip is not None else 0
+                self.assertEqual(fields[10], qual[clip:clip + len(fields[9])])
+                self.assertTrue(seq is None or fields[9] == seq[clip:clip + len(fields[9])])
+                self.assertEqual(len(fields[9]), len(fields[10]))
+            for processes in (None, 3):
+                streamed = StringIO()
+                stream = ReadStream(open(fastq))
+                psl2sam.psl2sam(lines, streamed, stream, soft_clip=soft_clip, processes=processes, chunk_size=30)
+                stream.close()
+                self.assertEqual(streamed.getvalue(), out.getvalue())
+
+    def test_missing_reads(self):
+        """ Test that reads missing from the stream are counted, without losing the following reads. """
+        lines, reads, _ = simulate.simulate(nr_records=100, read_length=150, block_count=3)
+        fasta = path.join(self.tmp_dir, 'reads.fas')
+        with open(fasta, 'w') as handle:
+            for i in xrange(len(lines)):
+                if i % 10 != 3:
+                    handle.write(">read{}\n{}\n".format(i, reads['read{}'.format(i)]))
+        expected = StringIO()
+        index = dict((name, seq) for name, seq in reads.iteritems() if int(name[4:]) % 10 != 3)
+        psl2sam.psl2sam(lines, expected, index)
+        for processes in (None, 3):
+            out = StringIO()
+            stats = Stats()
+            stream = ReadStream(open(fasta))
+            psl2sam.psl2sam(lines, out, stream, processes=processes, chunk_size=30, stats=stats)
+            stream.close()
+            self.assertEqual(out.getvalue(), expected.getvalue())
+            self.assertEqual(stats.counters['missing_reads'], 10)
+        fasta = ">r1\nACGT\n>r2\nACGT\n>r3\nACGT\n>r4\nA\n"
+        # A missing read does not consume the reads after it:
+        stream = ReadStream(StringIO(fasta))
+        self.assertEqual(['r0' in stream, 'r2' in stream, 'r3' in stream], [False, True, True])
+        self.assertEqual(stream['r4'], ('A', None))
+        self.assertRaises(KeyError, stream.__getitem__, 'r1')
+        # Reads after more skipped reads than the lookahead are reported as missing, the next ones are found again:
+        stream = ReadStream(StringIO(fasta), lookahead=6)
+        self.assertEqual(['r3' in stream, 'r4' in stream], [False, True])
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from uncle_PSL.records import PslRecord, SamRecord
+
+
+class RecordsTest(unittest.TestCase):
+
+    def test_psl_record(self):
+        """ Test parsing of PSL records. """
+        fields = "156 1 0 0 1 7 1 4 - read2 193 20 184 ref 171 0 161 3 41,47,69, 9,50,104, 0,45,92,".split()
+        psl = PslRecord(fields)
+        self.assertEqual((psl.misMatches, psl.qSize, psl.tEnd, psl.blockCount), (1, 193, 161, 3))
+        self.assertEqual((psl.strand, psl.qName, psl.tName, psl.qStarts), ('-', 'read2', 'ref', '9,50,104,'))
+        self.assertEqual(psl.fields(), fields)
+        self.assertFalse(hasattr(psl, '__dict__'))
+
+    def test_sam_record(self):
+        """ Test formatting of SAM records. """
+        sam = SamRecord('read1', 16, 'ref', 1, 0, '10M', '*', 0, 0, 'ACGTACGTAC', '*', 'NM:i:0')
+        self.assertEqual(sam.format(), "read1\t16\tref\t1\t0\t10M\t*\t0\t0\tACGTACGTAC\t*\tNM:i:0")
+        self.assertFalse(hasattr(sam, '__dict__'))
+
+    def test_pslx_record(self):
+        """ Test parsing of pslx records. """
+        fields = "10 0 0 0 0 0 0 0 + read1 10 0 10 ref 171 5 15 2 4,6, 0,4, 5,9, acgt,acgtac, acgt,acgtac,".split()
+        psl = PslRecord(fields)
+        self.assertEqual((psl.qSeqs, psl.tSeqs), ('acgt,acgtac,', 'acgt,acgtac,'))
+        self.assertEqual(psl.fields(), fields)
+        self.assertEqual(PslRecord(fields[:21]).qSeqs, None)
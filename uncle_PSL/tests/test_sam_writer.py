@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import unittest
+from collections import OrderedDict
+from cStringIO import StringIO
+
+from uncle_PSL.sam_writer import SamWriter, new_header
+
+
+class _CountingHandle(object):
+    """ Handle counting write calls. """
+
+    def __init__(self):
+        self.data = StringIO()
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.data.write(data)
+
+    def flush(self):
+        pass
+
+
+class SamWriterTest(unittest.TestCase):
+
+    def _write(self, out, **kwargs):
+        """ Write header and records. """
+        header = OrderedDict([('HD', [OrderedDict([('VN', '1.5')])]),
+                              ('SQ', [OrderedDict([('SN', 'ref'), ('LN', 171)])])])
+        writer = SamWriter(out, header=header, **kwargs)
+        records = [writer.new_sam_record('read{}'.format(i), 0, 'ref', i + 1, 0, '10M', '*', 0, 0, 'A' * 10, '*',
+                                         'NM:i:0') for i in xrange(100)]
+        writer.write(records[0])
+        writer.write_many(records[1:])
+        writer.write_many([])
+        writer.finish()
+
+    def test_buffered_output(self):
+        """ Test that buffered output matches unbuffered output with fewer writes. """
+        plain = _CountingHandle()
+        self._write(plain)
+        buffered = _CountingHandle()
+        self._write(buffered, buffer_size=1024)
+        self.assertEqual(plain.data.getvalue(), buffered.data.getvalue())
+        self.assertTrue(plain.data.getvalue().startswith("@HD\tVN:1.5\n@SQ\tSN:ref\tLN:171\nread0\t0\tref\t1\t"))
+        self.assertEqual(plain.writes, 3)
+        self.assertTrue(buffered.writes < len(buffered.data.getvalue()) // 1024 + 2)
+
+    def test_collected_references(self):
+        """ Test that @SQ records are collected from the records when missing from the header. """
+        out = StringIO()
+        writer = SamWriter(out, header=new_header(command_line='uncle_psl.py in.psl'), buffer_size=64)
+        for i, name in enumerate(['ref2', 'ref1', 'ref2']):
+            writer.add_reference(name, 100 + len(name) * i)
+            writer.write(writer.new_sam_record('read{}'.format(i), 0, name, 1, 0, '4M', '*', 0, 0, 'ACGT', '*', ''))
+        writer.write_formatted("read3\t0\tref3\t1\t0\t4M\t*\t0\t0\tACGT\t*\t\n", [('ref3', 50)])
+        self.assertEqual(out.getvalue(), '')
+        writer.finish()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[:4], ['@HD\tVN:1.6\tSO:unsorted', '@SQ\tSN:ref2\tLN:100', '@SQ\tSN:ref1\tLN:104',
+                                     '@SQ\tSN:ref3\tLN:50'])
+        self.assertTrue(lines[4].startswith('@PG\tID:uncle_psl\tPN:uncle_psl\t'))
+        self.assertTrue(lines[4].endswith('\tCL:uncle_psl.py in.psl'))
+        self.assertEqual([line.split("\t")[0] for line in lines[5:]], ['read0', 'read1', 'read2', 'read3'])
+
+    def test_fixed_references(self):
+        """ Test that references missing from a header with @SQ records are rejected. """
+        writer = SamWriter(StringIO(), header=new_header([('ref1', 100)]))
+        writer.add_reference('ref1', 100)
+        self.assertRaises(Exception, writer.add_reference, 'ref2', 100)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import unittest
+from cStringIO import StringIO
+
+from uncle_PSL import seq_util
+
+
+class SeqUtilTest(unittest.TestCase):
+
+    def test_reverse_complement(self):
+        """ Test reverse complement over the IUPAC alphabet. """
+        self.assertEqual(seq_util.reverse_complement('ACGTNacgtn'), 'nacgtNACGT')
+        self.assertEqual(seq_util.reverse_complement('RYKMSWBDHV'), 'BDHVWSKMRY')
+        self.assertEqual(seq_util.reverse_complement(bytearray('AAGC')), bytearray('GCTT'))
+        self.assertEqual(seq_util.reverse_complement(''), '')
+
+    def test_unknown_bases(self):
+        """ Test aggregate counting of bases without complement. """
+        unknown = seq_util.UnknownBaseCounter()
+        self.assertEqual(seq_util.reverse_complement('AC?GZ', unknown), 'ZC?GT')
+        self.assertEqual(unknown.count, 2)
+        handle = StringIO()
+        unknown.warn(handle)
+        self.assertEqual(len(handle.getvalue().splitlines()), 1)
+
+    def test_reverse_complement_many(self):
+        """ Test batch reverse complement. """
+        seqs = ['ACGT', '', 'AACG?', 'T']
+        unknown = seq_util.UnknownBaseCounter()
+        self.assertEqual(seq_util.reverse_complement_many(seqs, unknown),
+                         [seq_util.reverse_complement(s) for s in seqs])
+        self.assertEqual(unknown.count, 1)
+        self.assertEqual(seq_util.reverse_complement_many([]), [])
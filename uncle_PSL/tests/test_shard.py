@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from os import path
+
+from uncle_PSL import multi_hit
+from uncle_PSL import psl2sam
+from uncle_PSL import shard
+from uncle_PSL import simulate
+from uncle_PSL.sam_writer import new_header
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_shard')
+        lines, self.reads, targets = simulate.simulate(nr_records=100, read_length=200, block_count=3)
+        self.references = sorted((name, len(seq)) for name, seq in targets.iteritems())
+        # Three hits per query, to test that the hits of a query stay in one shard:
+        self.lines = ["psLayout version 3\n", "\n"] + [line for line in lines for _ in range(3)]
+        self.psl = path.join(self.tmp_dir, 'input.psl')
+        with open(self.psl, 'w') as handle:
+            handle.writelines(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _shards(self, count, key=None):
+        with open(self.psl, 'rb') as handle:
+            return [list(shard.iter_shard(handle, index, count, key)) for index in range(1, count + 1)]
+
+    def test_parse_shard(self):
+        """ Test parsing of shard strings. """
+        self.assertEqual(shard.parse_shard('2/5'), (2, 5))
+        for invalid in ['0/5', '6/5', '2', '2/5/1']:
+            self.assertRaises(Exception, shard.parse_shard, invalid)
+
+    def test_boundaries(self):
+        """ Test that the shards partition the lines, without splitting queries if keyed. """
+        for count in [1, 2, 3, 7, 1000]:
+            shards = self._shards(count)
+            self.assertEqual(sum(shards, []), self.lines)
+            shards = self._shards(count, multi_hit.line_query)
+            self.assertEqual(sum(shards, []), self.lines)
+            queries = [set(multi_hit.line_query(line) for line in lines) - set([None]) for lines in shards]
+            self.assertEqual(sum(len(names) for names in queries), len(set.union(*queries)))
+
+    def _convert(self, lines, header, **kwargs):
+        out = StringIO()
+        psl2sam.psl2sam(lines, out, self.reads, header=header, multi_hits=True, **kwargs)
+        return StringIO(out.getvalue())
+
+    def test_merge(self):
+        """ Test that the merged shard outputs equal the output of a single run. """
+        configs = [(None, {}), (new_header(), {}), (new_header(self.references), {'sort_memory': 1 << 20})]
+        for header, kwargs in configs:
+            single = self._convert(self.lines, header, **kwargs).getvalue()
+            for count in [1, 3, 7]:
+                outputs = [self._convert(lines, header, **kwargs)
+                           for lines in self._shards(count, multi_hit.line_query)]
+                merged = StringIO()
+                shard.merge_shards(outputs, merged)
+                self.assertEqual(merged.getvalue(), single)
+
+    def test_merge_different_references(self):
+        """ Test that sorted shards with different @SQ records are rejected. """
+        header = new_header(self.references)
+        other = new_header(self.references[::-1])
+        outputs = [self._convert(lines, h, sort_memory=1 << 20)
+                   for lines, h in zip(self._shards(2), [header, other])]
+        self.assertRaises(Exception, shard.merge_shards, outputs, StringIO())
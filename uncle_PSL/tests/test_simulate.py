@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import re
+import unittest
+from cStringIO import StringIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.seq_util import reverse_complement
+
+
+class SimulateTest(unittest.TestCase):
+
+    def test_simulated_alignments(self):
+        """ Test that simulated alignments are consistent with the reads and targets. """
+        lines, reads, targets = simulate.simulate(nr_records=50, read_length=300, block_count=4, intron_length=100)
+        out = StringIO()
+        psl2sam.psl2sam(lines, out, reads, n_limit=50)
+        for line in out.getvalue().splitlines():
+            fields = line.split("\t")
+            cigar = [(int(l), op) for l, op in re.findall(r'(\d+)([MIDNS])', fields[5])]
+            self.assertEqual(sum(l for l, op in cigar if op in 'MIS'), len(fields[9]))
+            self.assertTrue(len([op for l, op in cigar if op == 'N']) > 0)
+            # Walk the alignment and count mismatches against the target:
+            seq, target = fields[9], targets[fields[2]]
+            q_pos, t_pos, mismatches = 0, int(fields[3]) - 1, 0
+            for length, op in cigar:
+                if op == 'M':
+                    mismatches += sum(a != b for a, b in zip(seq[q_pos:q_pos + length], target[t_pos:t_pos + length]))
+                if op in 'MIS':
+                    q_pos += length
+                if op in 'MDN':
+                    t_pos += length
+            psl = lines[int(fields[0][4:])].split("\t")
+            self.assertEqual(mismatches, int(psl[1]))
+            expected_seq = reads[fields[0]] if fields[1] == '0' else reverse_complement(reads[fields[0]])
+            self.assertEqual(seq, expected_seq)
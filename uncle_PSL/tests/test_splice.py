@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from os import path
+from cStringIO import StringIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL import simulate
+from uncle_PSL.fasta_store import FastaStore, ReferenceWindows
+from uncle_PSL.splice import SpliceJunctions
+
+# Exons separated by a GT-AG (plus strand) and a CT-AC (minus strand) intron:
+TARGET = 'ACGTACGTAC' + 'gtaaaaaaaaaaag' + 'CCGGTTAACC' + 'CTTTTTTTTTTTAC' + 'GGGGAAAACC'
+
+
+def _psl_line(name, blocks):
+    """ PSL line of a read aligned without mismatches to (start, end) target blocks. """
+    sizes = [end - start for start, end in blocks]
+    q_starts = [sum(sizes[:i]) for i in xrange(len(blocks))]
+    fields = [sum(sizes), 0, 0, 0, 0, 0, len(blocks) - 1, blocks[-1][1] - blocks[0][0] - sum(sizes), '+', name,
+              sum(sizes), 0, sum(sizes), 't', len(TARGET), blocks[0][0], blocks[-1][1], len(blocks),
+              ''.join('{},'.format(x) for x in sizes), ''.join('{},'.format(x) for x in q_starts),
+              ''.join('{},'.format(start) for start, _ in blocks)]
+    return "\t".join(str(field) for field in fields) + "\n"
+
+
+class SpliceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='test_splice')
+        fasta = path.join(self.tmp_dir, 'ref.fas')
+        with open(fasta, 'w') as handle:
+            simulate.write_fasta({'t': TARGET}, handle, line_width=7)
+        self.reference = ReferenceWindows(FastaStore(fasta), window_size=16, max_windows=2)
+
+    def tearDown(self):
+        self.reference.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_xs_tags(self):
+        """ Test XS tags and junction counts of records with plus, minus, conflicting and no junctions. """
+        lines = [_psl_line('plus', [(0, 10), (24, 34)]), _psl_line('minus', [(30, 34), (48, 58)]),
+                 _psl_line('both', [(5, 10), (24, 34), (48, 50)]), _psl_line('unspliced', [(0, 10), (12, 20)])]
+        for processes in (None, 3):
+            junctions = SpliceJunctions(self.reference, count=True)
+            out = StringIO()
+            psl2sam.psl2sam(lines * 5, out, None, n_limit=10, processes=processes, chunk_size=4,
+                            splice_junctions=junctions)
+            tags = [line.split("\t")[11:] for line in out.getvalue().splitlines()[:4]]
+            self.assertEqual(tags, [['NM:i:14', 'XS:A:+'], ['NM:i:14', 'XS:A:-'], ['NM:i:28'], ['NM:i:2']])
+            bed = StringIO()
+            junctions.write_bed(bed)
+            self.assertEqual(bed.getvalue(), "t\t10\t24\tGT-AG\t10\t+\nt\t34\t48\tCT-AC\t10\t-\n")
+        self.assertEqual(junctions.motif('t', 10, 24), 'GT-AG')
+        self.assertEqual(junctions.cache.misses, 2)
+
+    def test_count_only(self):
+        """ Test that counting the junctions for the BED file leaves the SAM records unchanged. """
+        lines = [_psl_line('plus', [(0, 10), (24, 34)]), _psl_line('minus', [(30, 34), (48, 58)])] * 3
+        expected = StringIO()
+        psl2sam.psl2sam(lines, expected, None, n_limit=10)
+        for processes in (None, 2):
+            junctions = SpliceJunctions(self.reference, count=True, tags=False)
+            out = StringIO()
+            psl2sam.psl2sam(lines, out, None, n_limit=10, processes=processes, chunk_size=2,
+                            splice_junctions=junctions)
+            self.assertEqual(out.getvalue(), expected.getvalue())
+            bed = StringIO()
+            junctions.write_bed(bed)
+            self.assertEqual(bed.getvalue(), "t\t10\t24\tGT-AG\t3\t+\nt\t34\t48\tCT-AC\t3\t-\n")
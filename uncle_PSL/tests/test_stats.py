@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import unittest
+from os import path
+from cStringIO import StringIO
+
+from uncle_PSL import psl2sam
+from uncle_PSL.stats import Stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def _convert(self, psl_lines, reads, processes=None):
+        """ Convert PSL lines with statistics enabled. """
+        out = StringIO()
+        stats = Stats()
+        psl2sam.psl2sam(psl_lines, out, reads, soft_clip=True, n_limit=None, processes=processes, chunk_size=7,
+                        stats=stats)
+        return out.getvalue(), stats
+
+    def test_stats(self):
+        """ Test conversion statistics and that they do not change the output. """
+        top = path.dirname(__file__)
+        psl_lines = open(path.join(top, "data/blat_top.psl"), 'r').readlines()
+        psl_lines.append("malformed line\n")
+        records = list(psl2sam._iter_fields(psl_lines))
+        reads = dict((fields[9], 'ACGT' * (int(fields[10]) // 4) + 'A' * (int(fields[10]) % 4))
+                     for fields in records[1:])
+        plain = StringIO()
+        psl2sam.psl2sam(psl_lines, plain, reads, soft_clip=True, n_limit=None)
+        expected = {'records': len(records), 'skipped_lines': 1, 'missing_reads': 1,
+                    'minus_strand': sum(1 for fields in records if fields[8] == '-'), 'unknown_bases': 0,
+                    'bytes_written': len(plain.getvalue())}
+
+        for processes in (None, 3):
+            sam, stats = self._convert(psl_lines, reads, processes)
+            self.assertEqual(sam, plain.getvalue())
+            self.assertEqual(dict(stats.counters), expected)
+            self.assertTrue(set(['parse', 'cigar', 'reads_lookup', 'reverse_complement', 'write']) <=
+                            set(stats.timers.keys()))
+
+        report = json.loads(json.dumps(stats.report()))
+        self.assertEqual(report['counters'], expected)
+        self.assertGreater(report['peak_rss_mb'], 0)
+
+    def test_merge(self):
+        """ Test merging of statistics. """
+        first, second = Stats(), Stats()
+        first.add_time('parse', 1.0)
+        first.count('records', 2)
+        second.add_time('parse', 0.5)
+        second.add_time('write', 0.25)
+        second.count('records')
+        first.merge(second.as_dict())
+        self.assertEqual(dict(first.timers), {'parse': 1.5, 'write': 0.25})
+        self.assertEqual(dict(first.counters), {'records': 3})
+
+    def test_threads(self):
+        """ Test that counters and timers updated from several threads add up. """
+        stats = Stats()
+
+        def update(index):
+            for i in xrange(20000):
+                stats.count('shared')
+                stats.count('counter{}'.format(i % 50))
+                stats.add_time('stage{}'.format(index), 1.0)
+
+        threads = [threading.Thread(target=update, args=(index,)) for index in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.counters['shared'], 80000)
+        self.assertEqual(sum(stats.counters.values()), 160000)
+        self.assertEqual(stats.timers.values(), [20000.0] * 4)